@@ -9,6 +9,8 @@ After being invoked, the script will perform the following tasks:
     - check the resulting file matches with the one specified in the repo (by comparing SHA256 hashes)
 
 If a file was already downloaded, the script will not download it again, unless specified otherwise with the `--overwrite` argument (the same holds true for decryption and unpacking).
+Interrupted downloads are resumed where they stopped, and `--jobs N` processes several scenarios concurrently.
+With `--stream`, the archives are decrypted and unpacked while downloading, without writing them to disk.
 Call the script with `--help` to get a print of all supported arguments.
 For most use-cases, running 
 ```bash
@@ -18,12 +20,19 @@ is sufficient.
 
 """
 import argparse
+import json
 import os
+import sys
 import subprocess
 import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from getpass import getpass
 from hashlib import sha256
 import tarfile
+import http.client
+import urllib.error
 import urllib.request
 from tqdm.auto import tqdm
 
@@ -38,6 +47,7 @@ __status__ = "Development"
 SERVER = "https://resdata.tu-ilmenau.de"
 DIR = "/public/ei/ems/isac-uav-dataset/"
 SHASUM_FILE = "scenarios.checksum"
+MANIFEST_FILE = ".manifest.json"
 
 RXS = ["VGH0", "VGH1", "VGH2"]
 
@@ -63,26 +73,109 @@ class CustomFormatter(logging.Formatter):
         return formatter.format(record)
     
 
+class DecryptionError(Exception):
+    """Raised if openssl failed to decrypt an archive"""
+
+
+class ChecksumError(Exception):
+    """Raised if an unpacked file does not match its shasum"""
+
+
 class Downloader:
+    retries = 5
+    """Number of retries after a failed or interrupted download"""
+    backoff = 2.0
+    """Base of the exponential backoff between retries in seconds"""
+    timeout = 60
+    """Socket timeout in seconds"""
+    chunk_size = 2**20
+
     @classmethod  
-    def download(cls, url: str, out_file: str):
-        if not cls._download_file_from_server(url, out_file=out_file):
+    def download(cls, url: str, out_file: str, progress: tqdm = None, overwrite: bool = False):
+        if not cls._download_file_from_server(url, out_file=out_file, progress=progress, overwrite=overwrite):
             raise Exception(f"Failed to download file { url } from server.")
 
         return
 
     @classmethod
-    def _download_file_from_server(cls, url: str, out_file: str) -> bool:
-        class DownloadProgressBar(tqdm):
-            def update_to(self, b=1, bsize=1, tsize=None):
-                if tsize is not None:
-                    self.total = tsize
-                self.update(b * bsize - self.n)  
-        
-        with DownloadProgressBar(unit='B', unit_scale=True, miniters=1, desc=url.split('/')[-1]) as t:
-            urllib.request.urlretrieve(url, filename=out_file, reporthook=t.update_to)
+    def _download_file_from_server(cls, url: str, out_file: str, progress: tqdm = None, overwrite: bool = False) -> bool:
+        """Downloads `url` to `out_file`, resuming interrupted transfers with HTTP Range requests
+
+        The data is written to `<out_file>.part` first and only renamed to `out_file` once its size matches the size announced by the server.
+        A partially written file is thus never mistaken for a complete download.
+        With `overwrite`, a `.part` file of an earlier run is discarded instead of resumed.
+        If `progress` is given, it is used as a shared (aggregate) progress bar, otherwise one is created for this file.
+        """
+        part_file = f"{ out_file }.part"
+        if overwrite and os.path.exists(part_file):
+            os.remove(part_file)
+        own_progress = progress is None
+        if own_progress:
+            progress = tqdm(unit='B', unit_scale=True, miniters=1, desc=url.split('/')[-1])
+        counted_total = False
+        counted = 0
+
+        try:
+            for attempt in range(cls.retries + 1):
+                if attempt > 0:
+                    delay = cls.backoff ** attempt
+                    logger.warning(f"Retrying download of { url } in {delay:.0f}s (attempt { attempt }/{ cls.retries }).")
+                    time.sleep(delay)
+
+                offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+                request = urllib.request.Request(url, headers={"Range": f"bytes={ offset }-"} if offset else {})
+                try:
+                    with urllib.request.urlopen(request, timeout=cls.timeout) as response:
+                        if response.status == 206:
+                            total = int(response.headers["Content-Range"].split("/")[-1])
+                        else:
+                            # the server ignored the range request, start over
+                            offset = 0
+                            length = response.headers.get("Content-Length")
+                            total = int(length) if length is not None else None
+
+                        if not counted_total and total is not None:
+                            with progress.get_lock():
+                                progress.total = (progress.total or 0) + total
+                            counted_total = True
+                        progress.update(offset - counted)
+                        counted = offset
+
+                        with open(part_file, "ab" if offset else "wb") as f:
+                            for chunk in iter(lambda: response.read(cls.chunk_size), b""):
+                                f.write(chunk)
+                                progress.update(len(chunk))
+                                counted += len(chunk)
+                except urllib.error.HTTPError as e:
+                    if e.code == 416 and offset:
+                        # the part file is at least as large as the remote file
+                        total = int(e.headers.get("Content-Range", "*/-1").split("/")[-1])
+                        if total != offset:
+                            os.remove(part_file)
+                            continue
+                    else:
+                        logger.warning(f"Download of { url } failed: { e }.")
+                        if 400 <= e.code < 500 and e.code not in (408, 429):
+                            return False
+                        continue
+                except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+                    logger.warning(f"Download of { url } interrupted: { e }.")
+                    continue
+
+                size = os.path.getsize(part_file)
+                if total is not None and size != total:
+                    logger.warning(f"Downloaded { size } of { total } bytes of { url }.")
+                    if size > total:
+                        os.remove(part_file)
+                    continue
+
+                os.replace(part_file, out_file)
+                return True
+        finally:
+            if own_progress:
+                progress.close()
 
-        return True
+        return False
 
 def add_rx_to_scenarios(scenarios: list) -> list:
     allrx = []
@@ -107,14 +200,168 @@ def unpack_file(archive: str, out_dir: str, file_to_unpack: str) -> bool:
 
     return
 
-def check_shasum(shasum: dict, h5_file: str, dir: str) -> bool:
-    logger.info(f"Checking Shasum-256 using Repos `*.checksum` files to verify downloaded Scenario { h5_file }.")
+def stream_scenario(url: str, password: str, out_dir: str, shasums: dict, progress: tqdm = None, count_total: bool = True) -> bool:
+    """Downloads, decrypts, unpacks and hashes a scenario archive in a single pass
+
+    The HTTP body is piped into `openssl enc -d`, whose output is read as a `r|bz2` tar stream.
+    Members listed in `shasums` are written to `<name>.part` in `out_dir` while their SHA-256 is computed, all other members are skipped.
+    A member is only renamed to its final name if its shasum matched, otherwise the `.part` file is deleted.
+    Neither the encrypted nor the decrypted archive touch the disk. Once all listed members were found, the download is stopped.
+
+    Only network errors are reported by the return value, so the caller can retry them.
+    Failed decryption, an invalid archive and mismatching shasums do not go away by streaming again and raise instead.
+
+    Args:
+        url (str): The URL of the encrypted archive
+        password (str): The decryption password
+        out_dir (str): The output directory of the unpacked files
+        shasums (dict): The expected SHA-256 of each member to unpack, keyed by file name
+        progress (tqdm, optional): A shared progress bar for the downloaded bytes. Defaults to None (own progress bar).
+        count_total (bool, optional): Whether to add the archive size to the total of `progress`. Defaults to True.
+
+    Raises:
+        DecryptionError: If openssl failed to decrypt the archive
+        ChecksumError: If an unpacked member did not match its shasum
+        Exception: If the server rejected the request, or the archive is invalid or incomplete
+
+    Returns:
+        bool: Whether the stream was completed, False after a network error
+    """
+    logger.info(f"Streaming { url } into { out_dir }.")
+    own_progress = progress is None
+    if own_progress:
+        progress = tqdm(unit='B', unit_scale=True, miniters=1, desc=url.split('/')[-1])
+
+    proc = subprocess.Popen(
+        ["openssl", "enc", "-d", "-aes256", "-pbkdf2", "-pass", f"pass:{password}"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+    )
+    network_errors = []
+    received = 0
+    stopped = threading.Event()
+
+    def feed():
+        nonlocal received
+        try:
+            with urllib.request.urlopen(url, timeout=Downloader.timeout) as response:
+                length = response.headers.get("Content-Length")
+                if count_total and length is not None:
+                    with progress.get_lock():
+                        progress.total = (progress.total or 0) + int(length)
+                for chunk in iter(lambda: response.read(Downloader.chunk_size), b""):
+                    if stopped.is_set():
+                        break
+                    try:
+                        proc.stdin.write(chunk)
+                    except BrokenPipeError:
+                        # openssl exited, its return code tells why
+                        break
+                    progress.update(len(chunk))
+                    received += len(chunk)
+                if stopped.is_set() and length is not None:
+                    with progress.get_lock():
+                        progress.total -= int(length) - received
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+            if not stopped.is_set():
+                network_errors.append(e)
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    matched = []
+    mismatched = None
+    archive_error = None
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode="r|bz2") as tf:
+            for member in tf:
+                name = os.path.basename(member.name)
+                if not member.isfile() or name not in shasums:
+                    continue
+
+                out_file = os.path.join(out_dir, name)
+                hash_func = sha256()
+                try:
+                    with tf.extractfile(member) as src, open(f"{ out_file }.part", "wb") as dst:
+                        for chunk in iter(lambda: src.read(2**23), b""):
+                            hash_func.update(chunk)
+                            dst.write(chunk)
+                except BaseException:
+                    os.remove(f"{ out_file }.part")
+                    raise
+
+                if hash_func.hexdigest() != shasums[name]:
+                    os.remove(f"{ out_file }.part")
+                    mismatched = name
+                    stopped.set()
+                    proc.kill()
+                    break
+
+                os.replace(f"{ out_file }.part", out_file)
+                matched.append(name)
+                logger.info(f"Shasum-256 of { name } and Shasum-256 in Git repository matched!")
+
+                if len(matched) == len(shasums):
+                    # skip the remaining members without downloading them
+                    stopped.set()
+                    proc.kill()
+                    break
+        if not stopped.is_set():
+            # drain the rest of the stream, so openssl and the download terminate
+            for _ in iter(lambda: proc.stdout.read(2**20), b""):
+                pass
+    except (tarfile.TarError, EOFError, OSError) as e:
+        archive_error = e
+    finally:
+        proc.stdout.close()
+        proc.wait()
+        feeder.join()
+        if own_progress:
+            progress.close()
+
+    if mismatched is not None:
+        raise ChecksumError(f"The shasum of the streamed file { mismatched } does not match the Shasum-256 in the Git repository, the file was deleted.")
+
+    if stopped.is_set():
+        return True
+
+    if network_errors:
+        logger.warning(f"Streaming { url } failed: { network_errors[0] }.")
+        e = network_errors[0]
+        if isinstance(e, urllib.error.HTTPError) and 400 <= e.code < 500 and e.code not in (408, 429):
+            raise Exception(f"Failed to download { url }: { e }.")
+        if not own_progress:
+            # the next attempt streams from the beginning
+            progress.update(-received)
+        return False
+
+    if proc.returncode:
+        raise DecryptionError(f"Failed to decrypt { url } (openssl exited with { proc.returncode }). Did you enter the correct password?")
+
+    if archive_error is not None:
+        raise Exception(f"Archive { url } could not be unpacked: { archive_error }.")
+
+    missing = set(shasums) - set(matched)
+    if missing:
+        raise Exception(f"Archive { url } did not contain { sorted(missing) }.")
+
+    return True
+
+def hash_file(path: str) -> str:
     hash_func = sha256()
-    with open(h5_file, "rb") as f:
+    with open(path, "rb") as f:
         for chunk in iter(lambda: f.read(2**23), b""):
             hash_func.update(chunk)
 
-    hash = hash_func.hexdigest()
+    return hash_func.hexdigest()
+
+def check_shasum(shasum: dict, h5_file: str, dir: str) -> bool:
+    logger.info(f"Checking Shasum-256 using Repos `*.checksum` files to verify downloaded Scenario { h5_file }.")
+    hash = hash_file(h5_file)
     if shasum != hash:
         logger.warning(f"The shasums of the downloaded file and in the Gitlab did not match!")
         return False
@@ -122,6 +369,68 @@ def check_shasum(shasum: dict, h5_file: str, dir: str) -> bool:
     logger.info(f"Shasum-256 of {h5_file} and Shasum-256 in Git repository matched!")   
     return True
 
+def load_manifest(manifest_file: str) -> dict:
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as file:
+        return json.load(file)
+
+def save_manifest(manifest: dict, manifest_file: str) -> None:
+    with open(f"{ manifest_file }.tmp", "w") as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(f"{ manifest_file }.tmp", manifest_file)
+
+def verify_files(checksums: dict, dir: str, jobs: int = 1, manifest_file: str = None, required: bool = True) -> list:
+    """Verifies local files against their shasums, rehashing only files that changed since the last run
+
+    The hash of each file is cached in a manifest together with its size and modification time.
+    Files whose size and `mtime_ns` match the manifest are not read again, all others are hashed in a process pool.
+
+    Args:
+        checksums (dict): The expected SHA-256 of each file, keyed by file name
+        dir (str): The directory of the files
+        jobs (int, optional): The number of hashing processes. Defaults to 1.
+        manifest_file (str, optional): The path of the manifest. Defaults to `<dir>/.manifest.json`.
+        required (bool, optional): Whether missing files count as mismatches. Defaults to True.
+
+    Returns:
+        list: The names of all files that did not match (or are missing, if `required`)
+    """
+    if manifest_file is None:
+        manifest_file = os.path.join(dir, MANIFEST_FILE)
+    manifest = load_manifest(manifest_file)
+
+    mismatches = []
+    to_hash = {}
+    for name in checksums:
+        path = os.path.join(dir, name)
+        if not os.path.exists(path):
+            manifest.pop(name, None)
+            if required:
+                logger.warning(f"File { name } is missing.")
+                mismatches.append(name)
+            continue
+        stat = os.stat(path)
+        entry = manifest.get(name)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            to_hash[name] = dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    logger.info(f"Hashing { len(to_hash) } of { len(checksums) } files, reusing the manifest for the others.")
+    with ProcessPoolExecutor(max(jobs, 1)) as pool:
+        hashes = pool.map(hash_file, [os.path.join(dir, name) for name in to_hash])
+        for (name, entry), hash in tqdm(zip(to_hash.items(), hashes), total=len(to_hash), desc="Hashing"):
+            manifest[name] = dict(entry, sha256=hash)
+            # persist progress, so an interrupted check does not start over
+            save_manifest(manifest, manifest_file)
+
+    save_manifest(manifest, manifest_file)
+    for name, shasum in checksums.items():
+        if name in manifest and manifest[name]["sha256"] != shasum:
+            logger.warning(f"The shasum of { name } does not match the Shasum-256 in the Git repository!")
+            mismatches.append(name)
+
+    return sorted(mismatches)
+
 def create_download_dir(dir: str) -> None:
     try: 
         os.mkdir(dir)
@@ -142,41 +451,100 @@ def load_shasum_dict(shasum_file: str) -> dict:
 
     return shasums
 
-def main(args, checksums):
+def file_types(args) -> list:
+    return ["channel", "target"] if args.only is None else [args.only]
+
+def process_scenario(scenario: str, args, checksums: dict, password: str, tmp_dir: str, progress: tqdm = None) -> None:
     repo_dir = args.output_dir
-    tmp_dir = os.path.join(repo_dir, ".tmp")
-    create_download_dir(tmp_dir)
-    password = getpass("Please enter the password to decrypt the files:")
+    url = f"{ args.base_url }{scenario}.tar.bz2.encrypted"
+    encrypted_file = os.path.join(tmp_dir ,f"{ scenario }.tar.bz2.encrypted")
+    decrypted_file = os.path.join(tmp_dir, f"{ scenario }.tar.bz2")
+    h5_filenames = [f"{ scenario }_{ type }.h5" for type in file_types(args)]
+    shasums = [checksums[x] for x in h5_filenames]
+
+    if args.stream or args.only is not None:
+        missing = {
+            h5_file: shasum for shasum, h5_file in zip(shasums, h5_filenames)
+            if args.overwrite or not os.path.exists(os.path.join(repo_dir, h5_file))
+        }
+        if not missing:
+            logger.info(f"All files of { scenario } exist, skipping the scenario. Use `--verify-only` to check them.")
+            return
+        for attempt in range(Downloader.retries + 1):
+            if attempt > 0:
+                delay = Downloader.backoff ** attempt
+                logger.warning(f"Retrying stream of { url } in {delay:.0f}s (attempt { attempt }/{ Downloader.retries }).")
+                time.sleep(delay)
+            if stream_scenario(url, password, repo_dir, missing, progress, count_total=attempt == 0):
+                break
+        else:
+            raise Exception(f"Failed to stream { url } after { Downloader.retries + 1 } attempts.")
 
-    for scenario in args.scenario:
-        url = f"{SERVER}{DIR}{scenario}.tar.bz2.encrypted"
-        encrypted_file = os.path.join(tmp_dir ,f"{ scenario }.tar.bz2.encrypted")
-        decrypted_file = os.path.join(tmp_dir, f"{ scenario }.tar.bz2")
-        h5_filenames = [f"{ scenario }_{ type }.h5" for type in ["channel", "target"]]
-        shasums = [checksums[x] for x in h5_filenames]
+        for shasum, h5_file in zip(shasums, h5_filenames):
+            if h5_file not in missing:
+                check_shasum(shasum, os.path.join(repo_dir, h5_file), repo_dir)
+        return
 
-        if not os.path.exists(encrypted_file) or args.overwrite:
-            Downloader.download(url, out_file=encrypted_file)
-        else:
-            logger.info("Reusing previously downloaded file.")
+    if not os.path.exists(encrypted_file) or args.overwrite:
+        Downloader.download(url, out_file=encrypted_file, progress=progress, overwrite=args.overwrite)
+    else:
+        logger.info("Reusing previously downloaded file.")
 
-        # decrypt file in tmpdir
-        if not os.path.exists(decrypted_file):
-            if not decrypt_file(in_file=encrypted_file, password=password, out_file=decrypted_file):
-                raise Exception(f"Failed to decrypt file. Did you enter the correct password?")
+    # decrypt file in tmpdir
+    if not os.path.exists(decrypted_file):
+        if not decrypt_file(in_file=encrypted_file, password=password, out_file=decrypted_file):
+            raise Exception(f"Failed to decrypt file. Did you enter the correct password?")
 
-        # unpack file from tmpdir to repodir
-        for h5_file in h5_filenames:
-            if not os.path.exists(os.path.join(repo_dir, h5_file)):
-                unpack_file(archive=decrypted_file, out_dir=repo_dir, file_to_unpack=h5_file)
+    # unpack file from tmpdir to repodir
+    for h5_file in h5_filenames:
+        if not os.path.exists(os.path.join(repo_dir, h5_file)):
+            unpack_file(archive=decrypted_file, out_dir=repo_dir, file_to_unpack=h5_file)
 
-        # check shasum of file with *.checksum file from repo
-        for shasum, h5_file in zip(shasums, h5_filenames):
-            check_shasum(shasum, h5_file, repo_dir)
+    # check shasum of file with *.checksum file from repo
+    for shasum, h5_file in zip(shasums, h5_filenames):
+        check_shasum(shasum, os.path.join(repo_dir, h5_file), repo_dir)
+
+    if not args.no_cleanup:
+        os.remove(encrypted_file)
+        os.remove(decrypted_file)
+
+    return
+
+def verify_only(args, checksums) -> int:
+    h5_filenames = [f"{ scenario }_{ type }.h5" for scenario in args.scenario for type in file_types(args)]
+    mismatches = verify_files(
+        {name: checksums[name] for name in h5_filenames},
+        args.output_dir,
+        jobs=args.jobs,
+        required=args.required,
+    )
+    if mismatches:
+        logger.error(f"{ len(mismatches) } file(s) failed verification:")
+        for name in mismatches:
+            print(name)
+        return 1
+
+    logger.info("All files verified.")
+    return 0
+
+def main(args, checksums):
+    repo_dir = args.output_dir
+    tmp_dir = os.path.join(repo_dir, ".tmp")
+    create_download_dir(tmp_dir)
+    password = getpass("Please enter the password to decrypt the files:")
 
-        if not args.no_cleanup:
-            os.remove(encrypted_file)
-            os.remove(decrypted_file)
+    if args.jobs <= 1:
+        for scenario in args.scenario:
+            process_scenario(scenario, args, checksums, password, tmp_dir)
+    else:
+        # one aggregate progress bar over all concurrent downloads
+        with tqdm(total=0, unit='B', unit_scale=True, miniters=1, desc="Total") as progress, ThreadPoolExecutor(args.jobs) as pool:
+            futures = [
+                pool.submit(process_scenario, scenario, args, checksums, password, tmp_dir, progress)
+                for scenario in args.scenario
+            ]
+            for future in futures:
+                future.result()
 
     logger.info("All done. Exiting.")
 
@@ -212,6 +580,33 @@ if __name__ == "__main__":
         help="Re-download and overwrite previously downloaded files",
         action="store_true",
     )
+    parser.add_argument(
+        "--stream",
+        help="Download, decrypt, unpack and hash in a single pass without writing the archives to disk.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of scenarios to download and unpack concurrently, or number of hashing processes with `--verify-only`.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--only",
+        help="Only fetch the `channel` or the `target` files. Implies `--stream`, the other members are skipped without writing them.",
+        choices=["channel", "target"],
+    )
+    parser.add_argument(
+        "--verify-only",
+        help="Only verify the local files against the shasum file, using a cached manifest to skip unchanged files. Exits non-zero on mismatches.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--base-url",
+        help=f"Base URL of the encrypted scenario archives. Defaults to `{SERVER}{DIR}`.",
+        default=f"{SERVER}{DIR}",
+    )
 
     logger = logging.getLogger("Data-Downloader")
     logger.setLevel(logging.INFO)
@@ -229,9 +624,14 @@ if __name__ == "__main__":
     shasums = load_shasum_dict(args.shasum_file)
     all_scenarios = [ x.split("_channel.h5")[0] for x in shasums.keys() if "_channel.h5" in x]
 
+    # missing files only fail the verification if the scenarios were selected explicitly
+    args.required = args.scenario is not None
     if args.scenario is None:
         args.scenario = all_scenarios
     else:
         args.scenario = add_rx_to_scenarios(args.scenario)
 
+    if args.verify_only:
+        sys.exit(verify_only(args, shasums))
+
     main(args, shasums)
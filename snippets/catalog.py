@@ -0,0 +1,302 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import re
+import sqlite3
+import numpy as np
+from tqdm.auto import tqdm
+from uavdataset import UAVDataset
+from delaydoppler import SNAPSHOT_PERIOD
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["Catalog", "parse_recording", "scan_recording"]
+
+NAME_PATTERN = re.compile(r"^(?P<origin>\d+)to(?P<destination>\d+)_H(?P<height>\d+)_V(?P<velocity>\d+)_(?P<rx>VGH\d+)$")
+"""The recording names, e.g. `1to2_H15_V11_VGH0` is the route from waypoint 1 to 2 at 15 m height and 11 m/s, seen by VGH0"""
+
+COLUMNS = dict(
+    recording="TEXT PRIMARY KEY",
+    scenario="TEXT",
+    route="TEXT",
+    origin="INTEGER",
+    destination="INTEGER",
+    height="INTEGER",
+    velocity="INTEGER",
+    rx="TEXT",
+    local="INTEGER",
+    channel_size="INTEGER",
+    channel_mtime_ns="INTEGER",
+    target_size="INTEGER",
+    target_mtime_ns="INTEGER",
+    snapshots="INTEGER",
+    subcarriers="INTEGER",
+    duration="REAL",
+    delay_min="REAL",
+    delay_max="REAL",
+    doppler_min="REAL",
+    doppler_max="REAL",
+    uav_height_min="REAL",
+    uav_height_max="REAL",
+)
+"""The columns of the catalog, the scan columns are NULL for recordings that were not downloaded"""
+
+
+def parse_recording(recording: str) -> dict:
+    """Returns the scenario, route, height, velocity and receiver encoded in a recording name"""
+    match = NAME_PATTERN.match(recording)
+    if match is None:
+        raise ValueError(f"Invalid recording name { recording }, expected e.g. `1to2_H15_V11_VGH0`.")
+    return dict(
+        recording=recording,
+        scenario=recording.rsplit("_", 1)[0],
+        route=f"{match['origin']}to{match['destination']}",
+        origin=int(match["origin"]),
+        destination=int(match["destination"]),
+        height=int(match["height"]),
+        velocity=int(match["velocity"]),
+        rx=match["rx"],
+    )
+
+
+def _stat(path: str) -> tuple:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None, None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def scan_recording(channelfile: str, targetfile: str = None) -> dict:
+    """Reads the shapes and value ranges of a recording, the channel itself is not read
+
+    Args:
+        channelfile (str): The `*_channel.h5` file
+        targetfile (str, optional): The `*_target.h5` file. Defaults to None.
+
+    Returns:
+        dict: The scan columns of the catalog
+    """
+    row = {}
+    row["channel_size"], row["channel_mtime_ns"] = _stat(channelfile)
+    row["target_size"], row["target_mtime_ns"] = _stat(targetfile) if targetfile is not None else (None, None)
+    with UAVDataset(channelfile, targetfile if row["target_size"] is not None else None, lazy=True) as dataset:
+        snapshots, subcarriers = dataset.channel.shape
+        groundtruth = dataset.groundtruth[:]
+        row.update(
+            snapshots=snapshots,
+            subcarriers=subcarriers,
+            duration=snapshots * SNAPSHOT_PERIOD,
+            delay_min=float(np.nanmin(groundtruth[:, 0])),
+            delay_max=float(np.nanmax(groundtruth[:, 0])),
+            doppler_min=float(np.nanmin(groundtruth[:, 1])),
+            doppler_max=float(np.nanmax(groundtruth[:, 1])),
+        )
+        if dataset.uav is not None:
+            uav = dataset.uav[:]
+            row.update(uav_height_min=float(np.nanmin(uav[:, 2])), uav_height_max=float(np.nanmax(uav[:, 2])))
+    return row
+
+
+class Catalog:
+    def __init__(self, data_dir: str, db_file: str = None, shasum_file: str = None):
+        """SQLite catalog of all recordings, to select experiments without opening their HDF5 files
+
+        Every recording of `scenarios.checksum` gets a row with the route, height, velocity and receiver parsed from
+        its name. Downloaded recordings are also scanned once for their shapes, duration, groundtruth ranges and file
+        sizes. `update` only rescans files whose size or modification time changed since the last scan.
+
+        Args:
+            data_dir (str): The directory of the `*.h5` files
+            db_file (str, optional): The SQLite database. Defaults to None (`data_dir/catalog.sqlite`).
+            shasum_file (str, optional): The `scenarios.checksum` file. Defaults to None (`data_dir/scenarios.checksum`).
+
+        """
+        self.data_dir = data_dir
+        self.db_file = db_file or os.path.join(data_dir, "catalog.sqlite")
+        self.shasum_file = shasum_file or os.path.join(data_dir, "scenarios.checksum")
+        self._db = sqlite3.connect(self.db_file)
+        self._db.row_factory = sqlite3.Row
+        columns = ", ".join(f"{name} {kind}" for name, kind in COLUMNS.items())
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS recordings ({ columns })")
+
+        return
+
+    def channelfile(self, recording: str) -> str:
+        return os.path.join(self.data_dir, f"{recording}_channel.h5")
+
+    def targetfile(self, recording: str) -> str:
+        return os.path.join(self.data_dir, f"{recording}_target.h5")
+
+    def _recordings(self) -> list:
+        recordings = set()
+        with open(self.shasum_file) as file:
+            for line in file:
+                name = line.rstrip().split("  ")[-1]
+                if name.endswith("_channel.h5") or name.endswith("_target.h5"):
+                    recordings.add(name.rsplit("_", 1)[0])
+        return sorted(recordings)
+
+    def _is_current(self, row: sqlite3.Row) -> bool:
+        channel = _stat(self.channelfile(row["recording"]))
+        target = _stat(self.targetfile(row["recording"]))
+        if channel[0] is None:
+            return not row["local"]
+        return bool(row["local"]) and channel == (row["channel_size"], row["channel_mtime_ns"]) \
+            and target == (row["target_size"], row["target_mtime_ns"])
+
+    def update(self, jobs: int = None, progress: bool = True) -> list:
+        """Adds new recordings and (re-)scans all local recordings that changed, in parallel worker processes
+
+        Args:
+            jobs (int, optional): The number of worker processes. Defaults to None (number of CPUs).
+            progress (bool, optional): Whether to show a progress bar. Defaults to True.
+
+        Returns:
+            list: The (re-)scanned recordings
+        """
+        rows = {row["recording"]: row for row in self._db.execute("SELECT * FROM recordings")}
+        recordings = self._recordings()
+        stale = [r for r in recordings if r not in rows or not self._is_current(rows[r])]
+
+        updates = {r: dict(parse_recording(r), local=0) for r in stale}
+        scan = [r for r in stale if os.path.exists(self.channelfile(r))]
+        if scan:
+            with ProcessPoolExecutor(max_workers=jobs) as pool, tqdm(total=len(scan), unit="file", disable=not progress) as pbar:
+                futures = {pool.submit(scan_recording, self.channelfile(r), self.targetfile(r)): r for r in scan}
+                for future in as_completed(futures):
+                    updates[futures[future]].update(future.result(), local=1)
+                    pbar.set_description(futures[future])
+                    pbar.update()
+
+        with self._db:
+            removed = [(r,) for r in rows if r not in set(recordings)]
+            self._db.executemany("DELETE FROM recordings WHERE recording = ?", removed)
+            for row in updates.values():
+                row = {name: row.get(name) for name in COLUMNS}
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO recordings ({ ', '.join(row) }) VALUES ({ ', '.join('?' * len(row)) })",
+                    list(row.values()),
+                )
+
+        return scan
+
+    def query(self, where: str = None, params: tuple = (), **filters) -> list:
+        """Returns the rows of all recordings matching the filters, ordered by name
+
+        Every keyword is a column that must equal the value, or be one of the values of a list, tuple or set.
+        Other conditions are given as SQL with `where`, e.g.
+        `query(height=15, rx={"VGH0", "VGH2"}, where="duration > ?", params=(20,))`.
+
+        Returns:
+            list: The matching rows as `sqlite3.Row`, which are indexed by column name
+        """
+        conditions, values = [], []
+        for name, value in filters.items():
+            if name not in COLUMNS:
+                raise ValueError(f"Unknown column { name }, expected one of { list(COLUMNS) }.")
+            if isinstance(value, (list, tuple, set, frozenset)):
+                conditions.append(f"{name} IN ({ ', '.join('?' * len(value)) })")
+                values.extend(value)
+            else:
+                conditions.append(f"{name} = ?")
+                values.append(value)
+        if where is not None:
+            conditions.append(f"({ where })")
+            values.extend(params)
+
+        sql = "SELECT * FROM recordings"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return self._db.execute(sql + " ORDER BY recording", values).fetchall()
+
+    def recordings(self, **kwargs) -> list:
+        """Returns the names of the matching recordings, e.g. for `CorpusDataset`. See `query`."""
+        return [row["recording"] for row in self.query(**kwargs)]
+
+    def scenarios(self, **kwargs) -> list:
+        """Returns the names of the scenarios with a matching recording, e.g. for `downloader.py -s`. See `query`."""
+        return sorted({row["scenario"] for row in self.query(**kwargs)})
+
+    def files(self, **kwargs) -> list:
+        """Returns the channel and target file of the matching local recordings, e.g. for `UAVDataset`. See `query`."""
+        kwargs["local"] = 1
+        return [
+            (self.channelfile(row["recording"]), self.targetfile(row["recording"]) if row["target_size"] is not None else None)
+            for row in self.query(**kwargs)
+        ]
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "Catalog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM recordings").fetchone()[0]
+
+
+def main(args):
+    with Catalog(args.data_dir, args.db_file, args.shasum_file) as catalog:
+        if not args.no_update:
+            catalog.update(jobs=args.jobs)
+
+        filters = {
+            name: getattr(args, name) for name in ("route", "height", "velocity", "rx")
+            if getattr(args, name) is not None
+        }
+        if args.local:
+            filters["local"] = 1
+
+        if args.print == "scenarios":
+            lines = catalog.scenarios(**filters)
+        elif args.print == "recordings":
+            lines = catalog.recordings(**filters)
+        else:
+            lines = [channelfile for channelfile, _ in catalog.files(**filters)]
+        print("\n".join(lines))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Builds the catalog of all recordings and prints the scenarios, recordings or files matching a selection."
+    )
+    parser.add_argument(
+        "--data-dir", help="Directory of the `*.h5` files. Default is the current working directory.", default=os.getcwd(),
+    )
+    parser.add_argument(
+        "--db-file", help="Path of the SQLite catalog. Defaults to `<data-dir>/catalog.sqlite`.", default=None,
+    )
+    parser.add_argument(
+        "--shasum-file", help="Path to the `scenarios.checksum` file. Defaults to `<data-dir>/scenarios.checksum`.", default=None,
+    )
+    parser.add_argument(
+        "--route", help="Routes (e.g. `1to2`), separated by spaces.", nargs="+",
+    )
+    parser.add_argument(
+        "--height", help="Flight heights in m, separated by spaces.", type=int, nargs="+",
+    )
+    parser.add_argument(
+        "--velocity", help="Velocities in m/s, separated by spaces.", type=int, nargs="+",
+    )
+    parser.add_argument(
+        "--rx", help="Receivers (e.g. `VGH0`), separated by spaces.", nargs="+",
+    )
+    parser.add_argument(
+        "--local", help="Only select downloaded recordings.", action="store_true",
+    )
+    parser.add_argument(
+        "--print", help="What to print, one per line. `scenarios` can be passed to `downloader.py -s`.", choices=["scenarios", "recordings", "files"], default="recordings",
+    )
+    parser.add_argument(
+        "--no-update", help="Do not rescan changed files before the query.", action="store_true",
+    )
+    parser.add_argument(
+        "-j", "--jobs", help="Number of worker processes. Defaults to the number of CPUs.", type=int, default=None,
+    )
+    args = parser.parse_args()
+
+    main(args)
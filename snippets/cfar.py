@@ -0,0 +1,308 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import os
+import numpy as np
+from tqdm.auto import tqdm
+from uavdataset import UAVDataset
+from delaydoppler import DelayDopplerEngine, zoom_transform
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["CFARDetector", "box_sum", "detect_recording", "score_detections", "DETECTION", "STATISTICS"]
+
+DETECTION = np.dtype([
+    ("recording", np.int32),
+    ("start", np.int64),
+    ("doppler_bin", np.int32),
+    ("delay_bin", np.int32),
+    ("delay", np.float32),
+    ("doppler", np.float32),
+    ("power_db", np.float32),
+    ("snr_db", np.float32),
+    ("target", np.bool_),
+])
+"""One row of the detection table, `target` marks the detection assigned to the groundtruth of the map"""
+
+STATISTICS = np.dtype([
+    ("recording", np.int32),
+    ("maps", np.int64),
+    ("detections", np.int64),
+    ("pd", np.float64),
+    ("pfa", np.float64),
+    ("delay_rmse", np.float64),
+    ("doppler_rmse", np.float64),
+])
+"""The per-recording statistics, errors in s and Hz"""
+
+
+def box_sum(x: np.ndarray, half_rows: int, half_cols: int) -> np.ndarray:
+    """Sums of all (2*half_rows+1) x (2*half_cols+1) boxes over the last two axes with an integral image
+
+    Args:
+        x (np.ndarray): The (padded) maps with shape (..., rows, cols)
+        half_rows (int): The half height of the box
+        half_cols (int): The half width of the box
+
+    Returns:
+        np.ndarray: The box sums with shape (..., rows - 2*half_rows, cols - 2*half_cols), centered on each valid cell
+    """
+    c = np.zeros(x.shape[:-2] + (x.shape[-2] + 1, x.shape[-1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(x, axis=-2, dtype=np.float64), axis=-1, out=c[..., 1:, 1:])
+    h, w = 2*half_rows + 1, 2*half_cols + 1
+    return c[..., h:, w:] - c[..., :-h, w:] - c[..., h:, :-w] + c[..., :-h, :-w]
+
+
+def _pad(x: np.ndarray, rows: int, cols: int) -> np.ndarray:
+    # the Doppler axis is periodic, the delay axis is mirrored at its ends
+    x = np.pad(x, [(0, 0)] * (x.ndim - 2) + [(rows, rows), (0, 0)], mode="wrap")
+    return np.pad(x, [(0, 0)] * (x.ndim - 1) + [(cols, cols)], mode="reflect")
+
+
+@dataclass
+class CFARDetector:
+    method: str = "ca"
+    """`ca` (cell averaging) or `os` (ordered statistic)"""
+    guard: tuple = (2, 2)
+    """The number of guard cells on each side in Doppler and delay"""
+    train: tuple = (8, 8)
+    """The number of training cells on each side (beyond the guard cells) in Doppler and delay"""
+    pfa: float = 1e-6
+    """The design probability of false alarm per cell"""
+    rank: float = 0.75
+    """The rank of the ordered statistic as fraction of the training cells (only `os`)"""
+    num_train: int = field(init=False)
+    """The number of training cells per cell under test"""
+    alpha: float = field(init=False)
+    """The threshold factor for the noise estimate"""
+
+    def __post_init__(self) -> None:
+        """Constant false alarm rate detector for batches of delay-Doppler power maps
+
+        The noise level of every cell is estimated from the training cells of a rectangular window around it,
+        without the guard cells. The cell averaging estimate uses box sums of an integral image, the ordered
+        statistic estimate one partial sort per cell. The threshold factors assume exponentially distributed noise power.
+        """
+        if self.method not in ("ca", "os"):
+            raise ValueError(f"Unknown method { self.method }, expected ca or os.")
+        outer = [2*(g + t) + 1 for g, t in zip(self.guard, self.train)]
+        inner = [2*g + 1 for g in self.guard]
+        self.num_train = outer[0]*outer[1] - inner[0]*inner[1]
+
+        n = self.num_train
+        if self.method == "ca":
+            self.alpha = n * (self.pfa**(-1/n) - 1)
+        else:
+            self._k = min(max(int(round(self.rank * n)), 1), n)
+            self.alpha = self._os_alpha(n, self._k, self.pfa)
+
+        return
+
+    @staticmethod
+    def _os_alpha(n: int, k: int, pfa: float) -> float:
+        # Pfa = prod_{i<k} (n-i) / (n-i+alpha) decreases monotonically in alpha, solved by bisection in log domain
+        i = np.arange(k)
+        log_pfa = lambda alpha: np.sum(np.log(n - i) - np.log(n - i + alpha))
+        low, high = 0.0, 1.0
+        while log_pfa(high) > np.log(pfa):
+            high *= 2
+        for _ in range(100):
+            mid = (low + high) / 2
+            low, high = (mid, high) if log_pfa(mid) > np.log(pfa) else (low, mid)
+        return high
+
+    def noise(self, power: np.ndarray) -> np.ndarray:
+        """Estimates the noise power of every cell of maps with shape (..., doppler_bins, delay_bins)"""
+        (g_d, g_t), (t_d, t_t) = self.guard, self.train
+        r_d, r_t = g_d + t_d, g_t + t_t
+        padded = _pad(power, r_d, r_t)
+
+        if self.method == "ca":
+            outer = box_sum(padded, r_d, r_t)
+            inner = box_sum(padded[..., t_d:padded.shape[-2] - t_d, t_t:padded.shape[-1] - t_t], g_d, g_t)
+            return (outer - inner) / self.num_train
+
+        mask = np.ones((2*r_d + 1, 2*r_t + 1), dtype=bool)
+        mask[t_d:t_d + 2*g_d + 1, t_t:t_t + 2*g_t + 1] = False
+        padded = padded.reshape((-1,) + padded.shape[-2:])
+        noise = np.empty((len(padded),) + power.shape[-2:], dtype=np.float64)
+        for i, p in enumerate(padded):
+            # one map at a time bounds the memory of the training cells
+            cells = np.lib.stride_tricks.sliding_window_view(p, mask.shape)[..., mask]
+            noise[i] = np.partition(cells, self._k - 1, axis=-1)[..., self._k - 1]
+        return noise.reshape(power.shape)
+
+    def detect(self, power: np.ndarray) -> tuple:
+        """Detects the local maxima above the threshold in maps with shape (..., doppler_bins, delay_bins)
+
+        Returns:
+            tuple: The detection mask with the shape of `power` and the noise estimate of every cell
+        """
+        noise = self.noise(power)
+        neighbours = np.lib.stride_tricks.sliding_window_view(_pad(power, 1, 1), (3, 3), axis=(-2, -1))
+        peaks = power >= neighbours.max(axis=(-2, -1))
+        return peaks & (power > self.alpha * noise), noise
+
+
+def score_detections(table: np.ndarray, groundtruth: np.ndarray, starts: np.ndarray, gates: tuple, doppler_period: float, num_cells: int) -> np.ndarray:
+    """Assigns detections to the groundtruth of their map and computes the detection statistics
+
+    The strongest detection within `gates` (delay in s, Doppler in Hz) of the groundtruth is the target of a map.
+    All other detections are false alarms, Pfa is counted over all cells of all maps.
+
+    Args:
+        table (np.ndarray): The detections of one recording with dtype `DETECTION`, its `target` field is set
+        groundtruth (np.ndarray): The delay and Doppler of each map with shape (maps, 2)
+        starts (np.ndarray): The window start of each map
+        gates (tuple): The maximum delay and Doppler error of the target detection
+        doppler_period (float): The unambiguous Doppler range in Hz, Doppler errors are wrapped into it
+        num_cells (int): The number of cells per map
+
+    Returns:
+        np.ndarray: The statistics with dtype `STATISTICS`
+    """
+    map_idx = np.searchsorted(starts, table["start"])
+    delay_error = table["delay"] - groundtruth[map_idx, 0]
+    doppler_error = (table["doppler"] - groundtruth[map_idx, 1] + doppler_period/2) % doppler_period - doppler_period/2
+    inside = (np.abs(delay_error) <= gates[0]) & (np.abs(doppler_error) <= gates[1])
+
+    # strongest detection inside the gates of each map
+    order = np.lexsort((-table["power_db"], map_idx))
+    candidates = order[inside[order]]
+    _, first = np.unique(map_idx[candidates], return_index=True)
+    targets = candidates[first]
+    table["target"] = False
+    table["target"][targets] = True
+
+    stats = np.zeros(1, dtype=STATISTICS)[0]
+    stats["maps"] = len(starts)
+    stats["detections"] = len(table)
+    stats["pd"] = len(targets) / max(len(starts), 1)
+    stats["pfa"] = (len(table) - len(targets)) / max(len(starts) * num_cells, 1)
+    stats["delay_rmse"] = np.sqrt(np.mean(delay_error[targets]**2)) if len(targets) else np.nan
+    stats["doppler_rmse"] = np.sqrt(np.mean(doppler_error[targets]**2)) if len(targets) else np.nan
+    return stats
+
+
+def detect_recording(recording: int, channelfile: str, engine: DelayDopplerEngine, detector: CFARDetector, gates: tuple = (25e-9, 50)) -> tuple:
+    """Detects the targets in all maps of a recording and scores them against its groundtruth
+
+    Args:
+        recording (int): The index of the recording, stored in the detection table
+        channelfile (str): The channel file
+        engine (DelayDopplerEngine): The engine computing the maps
+        detector (CFARDetector): The detector
+        gates (tuple, optional): The maximum delay (s) and Doppler (Hz) error of a target detection. Defaults to (25e-9, 50).
+
+    Returns:
+        tuple: The detection table with dtype `DETECTION` and the statistics with dtype `STATISTICS`
+    """
+    tables, starts = [], []
+    with UAVDataset(channelfile, lazy=True) as dataset:
+        f_n = dataset.channel.shape[1]
+        # the bins of the maps of `delay_doppler` are the same as of the equivalent zoom transform
+        grid = zoom_transform(engine.window, f_n, engine.upsample, engine.delay_bins, engine.filter_clutter)
+        for block_starts, maps in engine.blocks(dataset.channel):
+            power = np.abs(maps)**2
+            detections, noise = detector.detect(power)
+            m, d, t = np.nonzero(detections)
+            table = np.zeros(len(m), dtype=DETECTION)
+            table["recording"] = recording
+            table["start"] = block_starts[m]
+            table["doppler_bin"] = d
+            table["delay_bin"] = t
+            table["delay"] = grid.delays[t]
+            table["doppler"] = grid.dopplers[d]
+            table["power_db"] = 10*np.log10(power[m, d, t])
+            table["snr_db"] = 10*np.log10(power[m, d, t] / noise[m, d, t])
+            tables.append(table)
+            starts.append(block_starts)
+
+        starts = np.concatenate(starts) if starts else np.empty(0, dtype=np.int64)
+        groundtruth = np.asarray(dataset.groundtruth[starts + engine.window // 2]).reshape(-1, 2)
+
+    table = np.concatenate(tables) if tables else np.zeros(0, dtype=DETECTION)
+    num_cells = len(grid.dopplers) * len(grid.delays)
+    stats = score_detections(table, groundtruth, starts, gates, 1 / grid.snapshot_period, num_cells)
+    stats["recording"] = recording
+    return table, stats
+
+
+def main(args):
+    engine = DelayDopplerEngine(
+        args.window, hop=args.hop, filter_clutter=True, upsample=args.upsample, delay_bins=args.delay_bins, zoom=True)
+    detector = CFARDetector(args.method, tuple(args.guard), tuple(args.train), args.pfa, args.rank)
+    channelfiles = [os.path.join(args.data_dir, f"{r}_channel.h5") for r in args.recording]
+
+    tables, stats = [], []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [
+            pool.submit(detect_recording, i, channelfile, engine, detector, (args.delay_gate, args.doppler_gate))
+            for i, channelfile in enumerate(channelfiles)
+        ]
+        for future in tqdm(futures, unit="file"):
+            table, stat = future.result()
+            tables.append(table)
+            stats.append(stat)
+
+    stats = np.array(stats, dtype=STATISTICS)
+    np.savez(args.output, detections=np.concatenate(tables), statistics=stats, recordings=np.array(args.recording))
+    for recording, stat in zip(args.recording, stats):
+        print(
+            f"{recording}: \tPd {stat['pd']:.3f} \tPfa {stat['pfa']:.2e} "
+            f"\tDelay RMSE {stat['delay_rmse']*1e9:.2f} ns \tDoppler RMSE {stat['doppler_rmse']:.2f} Hz"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Detects the UAV with a CFAR detector in all delay-Doppler maps of recordings and scores the detections."
+    )
+    parser.add_argument(
+        "-r", "--recording", help="Recording names (e.g. `1to2_H15_V11_VGH0`), separated by spaces.", nargs="+", required=True,
+    )
+    parser.add_argument(
+        "--data-dir", help="Directory of the `*.h5` files. Default is the current working directory.", default=os.getcwd(),
+    )
+    parser.add_argument(
+        "-o", "--output", help="Output `.npz` file with the detection table and statistics.", default="detections.npz",
+    )
+    parser.add_argument(
+        "-w", "--window", help="Length of the slow time window.", type=int, default=100,
+    )
+    parser.add_argument(
+        "--hop", help="Slow time samples between two maps. Defaults to the window length.", type=int, default=None,
+    )
+    parser.add_argument(
+        "--upsample", help="Zero-padding factor of both FFTs.", type=int, default=2,
+    )
+    parser.add_argument(
+        "--delay-bins", help="Number of delay bins to keep.", type=int, default=160,
+    )
+    parser.add_argument(
+        "--method", help="CFAR method.", choices=["ca", "os"], default="ca",
+    )
+    parser.add_argument(
+        "--guard", help="Guard cells on each side in Doppler and delay.", type=int, nargs=2, default=[2, 2],
+    )
+    parser.add_argument(
+        "--train", help="Training cells on each side in Doppler and delay.", type=int, nargs=2, default=[8, 8],
+    )
+    parser.add_argument(
+        "--pfa", help="Design probability of false alarm per cell.", type=float, default=1e-6,
+    )
+    parser.add_argument(
+        "--rank", help="Rank of the ordered statistic as fraction of the training cells.", type=float, default=0.75,
+    )
+    parser.add_argument(
+        "--delay-gate", help="Maximum delay error of a target detection in s.", type=float, default=25e-9,
+    )
+    parser.add_argument(
+        "--doppler-gate", help="Maximum Doppler error of a target detection in Hz.", type=float, default=50,
+    )
+    parser.add_argument(
+        "-j", "--jobs", help="Number of worker processes. Defaults to the number of CPUs.", type=int, default=None,
+    )
+    args = parser.parse_args()
+
+    main(args)
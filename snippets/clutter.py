@@ -0,0 +1,237 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from math import comb
+import numpy as np
+from delaydoppler import DelayDopplerEngine, sliding_windows
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["ClutterFilter", "EMAFilter", "RunningMeanFilter", "MTIFilter", "filtered_blocks"]
+
+
+@dataclass
+class ClutterFilter(ABC):
+    count: int = field(init=False, default=0)
+    """The number of snapshots processed so far"""
+
+    @property
+    @abstractmethod
+    def warmup(self) -> int:
+        """The number of snapshots that only initialize the state, the first output belongs to this snapshot"""
+
+    def reset(self) -> None:
+        """Clears the state, the next snapshot is treated as the start of a new recording"""
+        self.count = 0
+        self._reset()
+
+    @abstractmethod
+    def _reset(self) -> None:
+        pass
+
+    @abstractmethod
+    def _process(self, x: np.ndarray) -> np.ndarray:
+        pass
+
+    def process(self, x: np.ndarray) -> np.ndarray:
+        """Filters the next consecutive snapshots of a recording
+
+        Snapshots are processed in O(1) each, so a recording can be filtered block by block in a single pass.
+        The output row `i` belongs to the input snapshot `max(count, warmup) + i`, where `count` is the number of
+        snapshots processed before this call, i.e. the first `warmup` snapshots of a recording produce no output.
+
+        Args:
+            x (np.ndarray): The next snapshots with shape (t_bins, f_bins)
+
+        Returns:
+            np.ndarray: The filtered snapshots with shape (t_bins - skipped, f_bins)
+        """
+        x = np.asarray(x)
+        if self.count == 0:
+            self._reset()
+        y = self._process(x).astype(np.complex64, copy=False)
+        self.count += len(x)
+        return y
+
+    def state_dict(self) -> dict:
+        """Returns the parameters and the state of the filter as numpy arrays, e.g. to save them with `np.savez`"""
+        state = {name: np.asarray(value) for name, value in self.__dict__.items() if not name.startswith("_")}
+        state.update({name: np.asarray(value) for name, value in self._state().items()})
+        return state
+
+    def load_state_dict(self, state: dict) -> None:
+        """Restores a state returned by `state_dict`, processing then continues where it was stopped"""
+        for name, value in self.__dict__.copy().items():
+            if not name.startswith("_") and name != "count" and np.any(np.asarray(state[name]) != np.asarray(value)):
+                raise ValueError(f"The state was saved with { name }={ state[name] }, not { value }.")
+        self.count = int(state["count"])
+        self._load_state({name: np.asarray(state[name]) for name in self._state()})
+
+    @abstractmethod
+    def _state(self) -> dict:
+        pass
+
+    @abstractmethod
+    def _load_state(self, state: dict) -> None:
+        pass
+
+
+@dataclass
+class EMAFilter(ClutterFilter):
+    alpha: float = 0.05
+    """The weight of the newest snapshot in the background estimate, i.e. a memory of about 1/alpha snapshots"""
+
+    def __post_init__(self) -> None:
+        """Subtracts an exponential moving average of the previous snapshots (the background) from each snapshot"""
+        if not 0 < self.alpha <= 1:
+            raise ValueError("Alpha must be in (0, 1].")
+        self._background = None
+
+    @property
+    def warmup(self) -> int:
+        return 1
+
+    def _reset(self) -> None:
+        self._background = None
+
+    def _process(self, x: np.ndarray) -> np.ndarray:
+        y = np.empty(x.shape, dtype=np.complex128)
+        skip = 0
+        if self._background is None:
+            if len(x) == 0:
+                return y
+            self._background = x[0].astype(np.complex128)
+            skip = 1
+        background = self._background
+        for t in range(skip, len(x)):
+            np.subtract(x[t], background, out=y[t])
+            background += self.alpha * y[t]
+        return y[skip:]
+
+    def _state(self) -> dict:
+        return dict(background=np.empty(0) if self._background is None else self._background)
+
+    def _load_state(self, state: dict) -> None:
+        self._background = state["background"].copy() if state["background"].size else None
+
+
+@dataclass
+class RunningMeanFilter(ClutterFilter):
+    length: int = 32
+    """The number of previous snapshots that are averaged to the background"""
+
+    def __post_init__(self) -> None:
+        """Subtracts the mean of the previous `length` snapshots (the background) from each snapshot"""
+        if self.length < 1:
+            raise ValueError("Length must be positive.")
+        self._history = None
+
+    @property
+    def warmup(self) -> int:
+        return self.length
+
+    def _reset(self) -> None:
+        self._history = None
+
+    def _process(self, x: np.ndarray) -> np.ndarray:
+        # the running sums of history and block, restarted every block so rounding errors do not accumulate
+        history = x[:0] if self._history is None else self._history
+        rows = np.concatenate((history, x)).astype(np.complex128)
+        sums = np.concatenate((np.zeros((1,) + rows.shape[1:]), np.cumsum(rows, axis=0)))
+        n = self.length
+        y = rows[n:] - (sums[n:-1] - sums[:-n - 1]) / n
+        self._history = rows[-n:].astype(x.dtype)
+        return y
+
+    def _state(self) -> dict:
+        return dict(history=np.empty(0) if self._history is None else self._history)
+
+    def _load_state(self, state: dict) -> None:
+        self._history = state["history"].copy() if state["history"].size else None
+
+
+@dataclass
+class MTIFilter(ClutterFilter):
+    order: int = 2
+    """The order of the difference filter, 1 is the first-order difference of `get_channel`"""
+
+    def __post_init__(self) -> None:
+        """Moving target indication: the `order`-th difference along slow-time, i.e. binomial weights over `order + 1` snapshots"""
+        if self.order < 1:
+            raise ValueError("Order must be positive.")
+        self._weights = np.array([(-1)**i * comb(self.order, i) for i in range(self.order + 1)], dtype=np.float32)
+        self._history = None
+
+    @property
+    def warmup(self) -> int:
+        return self.order
+
+    def _reset(self) -> None:
+        self._history = None
+
+    def _process(self, x: np.ndarray) -> np.ndarray:
+        history = x[:0] if self._history is None else self._history
+        rows = np.concatenate((history, x))
+        n = len(rows) - self.order
+        y = np.zeros((max(n, 0),) + rows.shape[1:], dtype=np.complex64)
+        for i, weight in enumerate(self._weights):
+            y += weight * rows[self.order - i: self.order - i + n]
+        self._history = rows[-self.order:]
+        return y
+
+    def _state(self) -> dict:
+        return dict(history=np.empty(0) if self._history is None else self._history)
+
+    def _load_state(self, state: dict) -> None:
+        self._history = state["history"].copy() if state["history"].size else None
+
+
+def filtered_blocks(x: np.ndarray, clutter: ClutterFilter, engine: DelayDopplerEngine, block_size: int = 4096, start: int = 0, stop: int = None, resume: bool = False):
+    """Filters a recording in a single pass and yields the maps of all windows of the filtered snapshots
+
+    The snapshots are read and filtered `block_size` at a time. The last `window - 1` filtered snapshots are kept for
+    the windows that overlap the next block, so every snapshot is filtered exactly once and shared by all windows.
+    The window starts are indices of the input snapshots, beginning at `start + clutter.warmup`.
+
+    With `resume=True`, the state of `clutter` (e.g. restored with `load_state_dict`) is kept and filtering continues
+    at snapshot `start + clutter.count`. Only the filter state is checkpointed, not the filtered snapshots of
+    unfinished windows, so the windows that overlap the checkpoint are not yielded.
+
+    Args:
+        x (np.ndarray): The channel with shape (t_bins, f_bins), may be a lazy `UAVDataset.channel`
+        clutter (ClutterFilter): The clutter filter, it is reset before the first block unless `resume`
+        engine (DelayDopplerEngine): The engine computing the maps, must not apply its own clutter filter
+        block_size (int, optional): The number of snapshots read and filtered at once. Defaults to 4096.
+        start (int, optional): The first snapshot of the recording to filter. Defaults to 0.
+        stop (int, optional): The snapshot to stop at. Defaults to None (end of `x`).
+        resume (bool, optional): Whether to continue with the current state of `clutter`. Defaults to False.
+
+    Yields:
+        tuple: The window start indices with shape (n,) and their maps with shape (n, window*upsample, delay_bins)
+    """
+    if engine.filter_clutter:
+        raise ValueError("The engine must not apply the first-order clutter filter as well.")
+    stop = x.shape[0] if stop is None else min(stop, x.shape[0])
+
+    first = start + clutter.warmup
+    if not resume:
+        clutter.reset()
+    buffer = None
+    buffer_start = start + max(clutter.count, clutter.warmup)
+    # the first window start on the hop grid that only uses snapshots filtered after the checkpoint
+    next_start = first + -(-(buffer_start - first) // engine.hop) * engine.hop
+    for block_start in range(start + clutter.count, stop, block_size):
+        y = clutter.process(x[block_start:min(block_start + block_size, stop)])
+        buffer = y if buffer is None else np.concatenate((buffer, y))
+
+        n = (buffer_start + len(buffer) - engine.window - next_start) // engine.hop + 1
+        for idx in range(0, max(n, 0), engine.block_size):
+            starts = next_start + engine.hop * np.arange(idx, min(idx + engine.block_size, n))
+            offset = starts[0] - buffer_start
+            rows = buffer[offset: offset + (len(starts) - 1) * engine.hop + engine.window]
+            yield starts, engine.transform(sliding_windows(rows, engine.window, engine.hop))
+
+        # keep the snapshots of the windows that continue in the next block
+        next_start += engine.hop * max(n, 0)
+        drop = min(next_start - buffer_start, len(buffer))
+        buffer = buffer[drop:]
+        buffer_start += drop
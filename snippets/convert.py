@@ -0,0 +1,254 @@
+import argparse
+import os
+import time
+import numpy as np
+import h5py
+from delaydoppler import delay_doppler
+from uavdataset import (
+    UAVDataset,
+    CompactArray,
+    H5_CDATA,
+    H5_TARGET_DELAY,
+    H5_TARGET_DOPPLER,
+    H5_TXANTENNA,
+    H5_RXANTENNA,
+    H5_UAVPOSITIONS,
+    NPY_FILES,
+)
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["convert_hdf5", "convert_npy", "benchmark", "compact_error"]
+
+
+def _blocks(n: int, block_size: int):
+    for start in range(0, n, block_size):
+        yield start, min(start + block_size, n)
+
+
+def convert_hdf5(channelfile: str, targetfile: str, out_file: str, t_window: int = 100, compression: str = None, compression_opts: int = None, block_windows: int = 64) -> str:
+    """Rewrites a scenario into a single HDF5 file with window-aligned chunks
+
+    The datasets keep their original paths, so the file can be opened with `UAVDataset(out_file, out_file)`.
+    The channel is stored as native complex64 with chunks of `t_window` snapshots and all subcarriers,
+    so any slow-time window touches at most two chunks.
+
+    Args:
+        channelfile (str): The path to the original channel file
+        targetfile (str): The path to the original target file, may be None
+        out_file (str): The path of the converted file
+        t_window (int, optional): The slow-time window length the chunks are aligned to. Defaults to 100.
+        compression (str, optional): The HDF5 compression filter (`gzip`, `lzf`) or None. Defaults to None.
+        compression_opts (int, optional): The compression level for `gzip`. Defaults to None.
+        block_windows (int, optional): The number of chunks copied at once, bounds the memory usage. Defaults to 64.
+
+    Returns:
+        str: The path of the converted file
+    """
+    with UAVDataset(channelfile, targetfile, lazy=True) as dataset, h5py.File(out_file, "w") as h5_out:
+        n, f_n = dataset.channel.shape
+        filters = dict(compression=compression, compression_opts=compression_opts, shuffle=compression is not None)
+
+        channel = h5_out.create_dataset(
+            H5_CDATA, shape=(n, f_n), dtype=np.complex64, chunks=(min(t_window, n), f_n), **filters)
+        for start, stop in _blocks(n, t_window * block_windows):
+            channel[start:stop] = dataset.channel[start:stop]
+
+        groundtruth = dataset.groundtruth[:]
+        h5_out.create_dataset(H5_TARGET_DELAY, data=groundtruth[:, :1])
+        h5_out.create_dataset(H5_TARGET_DOPPLER, data=groundtruth[:, 1:])
+        h5_out.create_dataset(H5_TXANTENNA, data=dataset.tx[:])
+        h5_out.create_dataset(H5_RXANTENNA, data=dataset.rx[:])
+        if dataset.uav is not None:
+            h5_out.create_dataset(H5_UAVPOSITIONS, data=dataset.uav[:])
+
+        h5_out.attrs["t_window"] = t_window
+        h5_out.attrs["source"] = os.path.basename(channelfile)
+
+    return out_file
+
+
+def convert_npy(channelfile: str, targetfile: str, out_dir: str, block_size: int = 6400) -> str:
+    """Rewrites a scenario into a directory of raw `.npy` files that can be memory-mapped
+
+    The directory can be opened with `UAVDataset(out_dir)`, the channel is then a read-only `np.memmap`.
+
+    Args:
+        channelfile (str): The path to the original channel file
+        targetfile (str): The path to the original target file, may be None
+        out_dir (str): The output directory
+        block_size (int, optional): The number of snapshots copied at once, bounds the memory usage. Defaults to 6400.
+
+    Returns:
+        str: The output directory
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with UAVDataset(channelfile, targetfile, lazy=True) as dataset:
+        arrays = dict(
+            channel=dataset.channel,
+            groundtruth=dataset.groundtruth,
+            tx=dataset.tx,
+            rx=dataset.rx,
+            uav=dataset.uav,
+        )
+        for name, array in arrays.items():
+            if array is None:
+                continue
+            out = np.lib.format.open_memmap(
+                os.path.join(out_dir, NPY_FILES[name]), mode="w+", dtype=array.dtype, shape=array.shape)
+            for start, stop in _blocks(len(array), block_size):
+                out[start:stop] = array[start:stop]
+            out.flush()
+            del out
+
+    return out_dir
+
+
+def benchmark(path: str, t_window: int = 100, num_samples: int = 1000, lazy: bool = True, seed: int = 0) -> float:
+    """Measures the random window reads per second of a (converted) scenario, like `TorchDataset.__getitem__`
+
+    Args:
+        path (str): The channel file or `.npy` directory
+        t_window (int, optional): The slow-time window length. Defaults to 100.
+        num_samples (int, optional): The number of random windows to read. Defaults to 1000.
+        lazy (bool, optional): Whether to open HDF5 files lazily. Defaults to True.
+        seed (int, optional): The seed of the random window starts. Defaults to 0.
+
+    Returns:
+        float: The number of windows per second
+    """
+    with UAVDataset(path, lazy=lazy) as dataset:
+        starts = np.random.default_rng(seed).integers(0, len(dataset) - t_window + 1, num_samples)
+        tic = time.perf_counter()
+        for idx in starts:
+            np.asarray(dataset.channel[idx:idx + t_window])
+        return num_samples / (time.perf_counter() - tic)
+
+
+def compact_error(channelfile: str, precision: str = "int16", t_window: int = 100, num_windows: int = 100, filter_clutter: bool = False, upsample: int = 1, seed: int = 0) -> dict:
+    """Compares the delay-Doppler maps of a compact channel (see `CompactArray`) with the maps of the exact channel
+
+    The error of the normalized maps is measured relative to the energy of the full (uncropped) maps. Since the maps
+    are normalized, the relative error is at most twice the relative error of the (clutter-filtered) window,
+    which is bounded by the error bound of the compact representation.
+
+    Args:
+        channelfile (str): The channel file
+        precision (str, optional): The compact storage type. Defaults to "int16".
+        t_window (int, optional): The slow-time window length. Defaults to 100.
+        num_windows (int, optional): The number of random windows to compare. Defaults to 100.
+        filter_clutter (bool, optional): Whether to apply the clutter filter. Defaults to False.
+        upsample (int, optional): The zero-padding factor of both FFTs. Defaults to 1.
+        seed (int, optional): The seed of the random window starts. Defaults to 0.
+
+    Returns:
+        dict: The memory of both representations, the largest measured and bound relative map error, and whether
+            the bound holds for all windows
+    """
+    with UAVDataset(channelfile, lazy=True) as dataset:
+        compact = CompactArray(dataset.channel, precision)
+        exact_nbytes = int(np.prod(dataset.channel.shape)) * np.dtype(np.complex64).itemsize
+        span = t_window + int(filter_clutter)
+        starts = np.random.default_rng(seed).integers(0, len(dataset) - span + 1, num_windows)
+
+        measured, bound = [], []
+        for start in starts:
+            x = dataset.channel[start:start + span]
+            x_compact = compact[start:start + span]
+            error = compact.error_bound(slice(start, start + span))
+            if filter_clutter:
+                x = np.diff(x, n=1, axis=0)
+                error = error[1:] + error[:-1]
+            y = delay_doppler(x, filter_clutter=False, upsample=upsample)
+            y_compact = delay_doppler(np.diff(x_compact, n=1, axis=0) if filter_clutter else x_compact, upsample=upsample)
+            measured.append(np.linalg.norm(y_compact - y) / np.linalg.norm(y))
+            # both parts of all subcarriers are off by at most `error` per snapshot
+            bound.append(2 * np.sqrt(2 * x.shape[1] * np.sum(error.astype(np.float64)**2)) / np.linalg.norm(x))
+
+    measured, bound = np.array(measured), np.array(bound)
+    return dict(
+        precision=precision,
+        exact_mb=exact_nbytes / 2**20,
+        compact_mb=compact.nbytes / 2**20,
+        measured=float(measured.max()),
+        bound=float(bound.max()),
+        ok=bool(np.all(measured <= bound)),
+    )
+
+
+def main(args):
+    scenario = os.path.basename(args.channel_file).split("_channel.h5")[0]
+    os.makedirs(args.output_dir, exist_ok=True)
+    outputs = []
+    for fmt in [] if args.no_convert else args.format:
+        if fmt == "npy":
+            outputs.append(convert_npy(args.channel_file, args.target_file, os.path.join(args.output_dir, f"{scenario}_npy")))
+        else:
+            compression = None if fmt == "hdf5" else fmt.split("-")[1]
+            outputs.append(convert_hdf5(
+                args.channel_file, args.target_file,
+                os.path.join(args.output_dir, f"{scenario}_{fmt}_channel.h5"),
+                t_window=args.t_window, compression=compression,
+                compression_opts=args.gzip_level if compression == "gzip" else None,
+            ))
+
+    for precision in args.compact:
+        result = compact_error(args.channel_file, precision, args.t_window, args.num_samples, filter_clutter=True)
+        print(
+            f"{precision}: \t{result['compact_mb']:.1f} / {result['exact_mb']:.1f} MB, "
+            f"\tmap error {result['measured']:.2e} (bound {result['bound']:.2e}, {'ok' if result['ok'] else 'VIOLATED'})"
+        )
+
+    if args.benchmark:
+        for path in [args.channel_file] + outputs:
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)) if os.path.isdir(path) else os.path.getsize(path)
+            rate = benchmark(path, args.t_window, args.num_samples)
+            print(f"{path}: \t{size / 2**20:.1f} MB, \t{rate:.1f} windows/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Converts a scenario into layouts optimized for training and benchmarks their random window access."
+    )
+    parser.add_argument(
+        "-c", "--channel-file", help="Path to the channel file.", default="1to2_H15_V11_VGH0_channel.h5",
+    )
+    parser.add_argument(
+        "-t", "--target-file", help="Path to the target file.", default="1to2_H15_V11_VGH0_target.h5",
+    )
+    parser.add_argument(
+        "-o", "--output-dir", help="Output directory of the converted files.", default="converted",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        help="Output formats, separated by spaces.",
+        nargs="+",
+        choices=["hdf5", "hdf5-gzip", "hdf5-lzf", "npy"],
+        default=["hdf5"],
+    )
+    parser.add_argument(
+        "--no-convert", help="Skip the conversion, e.g. to only run `--compact` or `--benchmark` on the original file.", action="store_true",
+    )
+    parser.add_argument(
+        "-w", "--t-window", help="Slow-time window length the HDF5 chunks are aligned to.", type=int, default=100,
+    )
+    parser.add_argument(
+        "--gzip-level", help="Compression level of `hdf5-gzip`.", type=int, default=4,
+    )
+    parser.add_argument(
+        "--benchmark", help="Measure the random window reads per second of the original and converted files.", action="store_true",
+    )
+    parser.add_argument(
+        "--compact",
+        help="Report the memory and delay-Doppler map error of compact in-memory representations, separated by spaces.",
+        nargs="+",
+        choices=list(CompactArray.PRECISIONS),
+        default=[],
+    )
+    parser.add_argument(
+        "--num-samples", help="Number of random windows read by the benchmark.", type=int, default=1000,
+    )
+    args = parser.parse_args()
+
+    main(args)
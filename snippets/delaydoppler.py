@@ -0,0 +1,249 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+import numpy as np
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["sliding_windows", "delay_bins_of", "delay_doppler", "DelayDopplerEngine", "ZoomTransform", "zoom_transform"]
+
+SUBCARRIER_SPACING = 62.5e3
+"""The spacing of the OFDM subcarriers in Hz, i.e. a delay range of 16 us"""
+SNAPSHOT_PERIOD = 320e-6
+"""The time between two slow-time snapshots in s"""
+
+
+def sliding_windows(x: np.ndarray, window: int, hop: int = 1) -> np.ndarray:
+    """Returns all slow-time windows of `x` as a zero-copy strided view
+
+    Args:
+        x (np.ndarray): The channel with shape (t_bins, f_bins)
+        window (int): The number of slow-time samples per window
+        hop (int, optional): The number of slow-time samples between two window starts. Defaults to 1.
+
+    Returns:
+        np.ndarray: Read-only view with shape (n_windows, window, f_bins)
+    """
+    views = np.lib.stride_tricks.sliding_window_view(x, window, axis=0)[::hop]
+    return np.moveaxis(views, -1, 1)
+
+
+def delay_bins_of(n_subcarriers: int, upsample: int = 1, delay_bins: int = None) -> int:
+    """Returns the length of the delay axis of the maps, `delay_bins` capped at the `n_subcarriers*upsample` bins of the IFFT"""
+    return n_subcarriers*upsample if delay_bins is None else min(delay_bins, n_subcarriers*upsample)
+
+
+def delay_doppler(x: np.ndarray, filter_clutter: bool = False, upsample: int = 1, delay_bins: int = None) -> np.ndarray:
+    """Computes the normalized delay-Doppler maps of one or many slow-time windows
+
+    This is the batched version of `get_channel` in the plotting snippets: optional first-order clutter filter,
+    IFFT over the subcarriers, FFT over slow-time, normalization to unit energy, and fftshift of the Doppler axis.
+    The delay axis is cropped to `delay_bins` *before* the slow-time FFT, the normalization still refers to the full map.
+
+    Args:
+        x (np.ndarray): The windows with shape (..., t_bins, f_bins)
+        filter_clutter (bool, optional): Whether to apply the first-order difference along slow-time. Defaults to False.
+        upsample (int, optional): The zero-padding factor of both FFTs. Defaults to 1.
+        delay_bins (int, optional): The number of delay bins to keep. Defaults to None (all).
+
+    Returns:
+        np.ndarray: The maps with shape (..., t_bins*upsample, delay_bins), where t_bins is counted after the clutter filter
+    """
+    if filter_clutter:
+        x = np.diff(x, n=1, axis=-2)
+
+    t_n, f_n = x.shape[-2:]
+    # Parseval: the energy of the full (uncropped) map is t_n/f_n times the energy of the window
+    norm = np.sqrt(t_n / f_n) * np.linalg.norm(x, axis=(-2, -1), keepdims=True)
+
+    y = np.fft.ifft(x, n=f_n*upsample, axis=-1)
+    if delay_bins is not None:
+        y = y[..., :delay_bins]
+    y = np.fft.fft(y, n=t_n*upsample, axis=-2)
+    y /= norm
+    y = np.fft.fftshift(y, axes=-2)
+
+    return y
+
+
+@dataclass
+class DelayDopplerEngine:
+    window: int
+    """The number of slow-time samples per map (after the clutter filter)"""
+    hop: int = None
+    """The number of slow-time samples between two windows. Defaults to `window`"""
+    filter_clutter: bool = False
+    """Whether to apply the first-order difference along slow-time"""
+    upsample: int = 1
+    """The zero-padding factor of both FFTs"""
+    delay_bins: int = None
+    """The number of delay bins to keep, None keeps all"""
+    block_size: int = 16
+    """The number of windows processed per batch, bounds the memory of the intermediate arrays"""
+    zoom: bool = False
+    """Whether to evaluate only the kept bins with partial DFT matrices (see `ZoomTransform`) instead of padded FFTs"""
+
+    def __post_init__(self) -> None:
+        if self.hop is None:
+            self.hop = self.window
+        if self.window < 1 or self.hop < 1 or self.block_size < 1:
+            raise ValueError("Window, hop and block size must be positive.")
+
+    @property
+    def span(self) -> int:
+        """The number of slow-time samples read per window, one more than `window` if the clutter filter is used"""
+        return self.window + int(self.filter_clutter)
+
+    def map_shape(self, n_subcarriers: int) -> tuple:
+        """Returns the shape (doppler_bins, delay_bins) of the maps of a channel with `n_subcarriers`"""
+        return self.window*self.upsample, delay_bins_of(n_subcarriers, self.upsample, self.delay_bins)
+
+    def starts(self, n_slowtime: int) -> np.ndarray:
+        """Returns the start indices of all windows that fit into `n_slowtime` samples"""
+        return np.arange(0, max(n_slowtime - self.span + 1, 0), self.hop)
+
+    def transform(self, windows: np.ndarray) -> np.ndarray:
+        """Computes the maps of already sliced windows with shape (..., span, f_bins)"""
+        if self.zoom:
+            t_n = windows.shape[-2] - int(self.filter_clutter)
+            transform = zoom_transform(t_n, windows.shape[-1], self.upsample, self.delay_bins, self.filter_clutter)
+            return transform(windows)
+        return delay_doppler(windows, self.filter_clutter, self.upsample, self.delay_bins)
+
+    def blocks(self, x: np.ndarray, start: int = 0, stop: int = None):
+        """Yields the maps of all windows of a recording, `block_size` windows at a time
+
+        Each block is read with a single slice of `x`, so `x` may also be a lazy `UAVDataset.channel`.
+
+        Args:
+            x (np.ndarray): The channel with shape (t_bins, f_bins)
+            start (int, optional): The first slow-time sample to use. Defaults to 0.
+            stop (int, optional): The slow-time sample to stop at. Defaults to None (end of `x`).
+
+        Yields:
+            tuple: The window start indices with shape (n,) and their maps with shape (n, window*upsample, delay_bins)
+        """
+        stop = x.shape[0] if stop is None else min(stop, x.shape[0])
+        starts = start + self.starts(stop - start)
+
+        for idx in range(0, len(starts), self.block_size):
+            block_starts = starts[idx:idx + self.block_size]
+            rows = x[block_starts[0]:block_starts[-1] + self.span]
+            windows = sliding_windows(rows, self.span, self.hop)
+            yield block_starts, self.transform(windows)
+
+    def compute(self, x: np.ndarray, start: int = 0, stop: int = None) -> tuple:
+        """Computes the maps of all windows of a recording at once, see `blocks`"""
+        results = list(self.blocks(x, start, stop))
+        if not results:
+            shape = (0,) + self.map_shape(x.shape[1])
+            return np.empty(0, dtype=int), np.empty(shape, dtype=np.complex64)
+        starts, maps = zip(*results)
+
+        return np.concatenate(starts), np.concatenate(maps)
+
+
+@dataclass
+class ZoomTransform:
+    n_slowtime: int
+    """The number of slow-time samples per window (after the clutter filter)"""
+    n_subcarriers: int
+    """The number of subcarriers per snapshot"""
+    delay_range: tuple
+    """The half-open delay interval [start, stop) to compute in s"""
+    doppler_range: tuple
+    """The half-open Doppler interval [start, stop) to compute in Hz"""
+    delay_resolution: float
+    """The spacing of the delay bins in s"""
+    doppler_resolution: float
+    """The spacing of the Doppler bins in Hz"""
+    filter_clutter: bool = False
+    """Whether to apply the first-order difference along slow-time"""
+    subcarrier_spacing: float = SUBCARRIER_SPACING
+    """The subcarrier spacing in Hz"""
+    snapshot_period: float = SNAPSHOT_PERIOD
+    """The slow-time sampling period in s"""
+    delays: np.ndarray = field(init=False, repr=False)
+    """The delay of each output bin in s"""
+    dopplers: np.ndarray = field(init=False, repr=False)
+    """The Doppler shift of each output bin in Hz"""
+
+    def __post_init__(self) -> None:
+        """Delay-Doppler transform that only computes the requested bins
+
+        Instead of zero-padding both FFTs and cropping the result, the two DFTs are evaluated with precomputed
+        partial DFT matrices at the requested bins only. The maps are scaled like the normalized output of
+        `delay_doppler` with the equivalent upsampling factors, so the two are interchangeable.
+        """
+        self.delays = self._grid(self.delay_range, self.delay_resolution)
+        self.dopplers = self._grid(self.doppler_range, self.doppler_resolution)
+
+        m = np.arange(self.n_subcarriers)
+        t = np.arange(self.n_slowtime)
+        self._delay_matrix = np.exp(
+            2j*np.pi*self.subcarrier_spacing*np.outer(m, self.delays)).astype(np.complex64)
+        self._doppler_matrix = np.exp(
+            -2j*np.pi*self.snapshot_period*np.outer(self.dopplers, t)).astype(np.complex64)
+        # unit energy over the full delay-Doppler plane sampled at the given resolutions (Parseval)
+        self._scale = np.sqrt(self.snapshot_period*self.subcarrier_spacing*self.delay_resolution*self.doppler_resolution)
+
+        return
+
+    @staticmethod
+    def _grid(interval: tuple, resolution: float) -> np.ndarray:
+        start, stop = interval
+        return start + resolution*np.arange(int(round((stop - start)/resolution)))
+
+    @classmethod
+    def from_upsample(cls, n_slowtime: int, n_subcarriers: int, upsample: int = 1, delay_bins: int = None, filter_clutter: bool = False, **kwargs) -> "ZoomTransform":
+        """Creates the transform that reproduces `delay_doppler(x, filter_clutter, upsample, delay_bins)`
+
+        Args:
+            n_slowtime (int): The number of slow-time samples per window (after the clutter filter)
+            n_subcarriers (int): The number of subcarriers per snapshot
+            upsample (int, optional): The zero-padding factor of both FFTs. Defaults to 1.
+            delay_bins (int, optional): The number of delay bins to keep. Defaults to None (all).
+            filter_clutter (bool, optional): Whether to apply the first-order difference along slow-time. Defaults to False.
+
+        Returns:
+            ZoomTransform: The transform
+        """
+        subcarrier_spacing = kwargs.get("subcarrier_spacing", SUBCARRIER_SPACING)
+        snapshot_period = kwargs.get("snapshot_period", SNAPSHOT_PERIOD)
+        n_delay = delay_bins_of(n_subcarriers, upsample, delay_bins)
+        n_doppler = n_slowtime*upsample
+        delay_resolution = 1/(n_subcarriers*upsample*subcarrier_spacing)
+        doppler_resolution = 1/(n_doppler*snapshot_period)
+
+        return cls(
+            n_slowtime=n_slowtime,
+            n_subcarriers=n_subcarriers,
+            delay_range=(0, n_delay*delay_resolution),
+            delay_resolution=delay_resolution,
+            doppler_range=(-(n_doppler//2)*doppler_resolution, (n_doppler - n_doppler//2)*doppler_resolution),
+            doppler_resolution=doppler_resolution,
+            filter_clutter=filter_clutter,
+            **kwargs,
+        )
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        """Computes the normalized maps of one or many windows with shape (..., t_bins, f_bins)
+
+        Returns:
+            np.ndarray: The maps with shape (..., len(dopplers), len(delays))
+        """
+        if self.filter_clutter:
+            x = np.diff(x, n=1, axis=-2)
+        if x.shape[-2:] != (self.n_slowtime, self.n_subcarriers):
+            raise ValueError(f"Expected windows with shape { (self.n_slowtime, self.n_subcarriers) }, got { x.shape[-2:] }.")
+
+        norm = np.linalg.norm(x, axis=(-2, -1), keepdims=True)
+        y = self._doppler_matrix @ (x @ self._delay_matrix)
+        y *= self._scale / norm
+
+        return y
+
+
+@lru_cache(maxsize=16)
+def zoom_transform(n_slowtime: int, n_subcarriers: int, upsample: int = 1, delay_bins: int = None, filter_clutter: bool = False) -> ZoomTransform:
+    """Cached `ZoomTransform.from_upsample`, so the DFT matrices are only built once per configuration"""
+    return ZoomTransform.from_upsample(n_slowtime, n_subcarriers, upsample, delay_bins, filter_clutter)
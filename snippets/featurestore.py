@@ -0,0 +1,304 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+import h5py
+from tqdm.auto import tqdm
+from uavdataset import UAVDataset
+from delaydoppler import DelayDopplerEngine
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["FeatureStore", "load_checksums", "build_entry"]
+
+H5_MAPS = "Maps/Data"
+H5_STARTS = "Maps/Starts"
+H5_GROUNDTRUTH = "TargetParameters/Data"
+
+FORMAT_VERSION = 1
+"""Part of every key, increase it when the layout or the computation of the entries changes"""
+OUTPUTS = ("complex", "magnitude", "db")
+
+
+def load_checksums(shasum_file: str) -> dict:
+    """Returns the checksums of a `scenarios.checksum` file, keyed by the recording name (e.g. `1to2_H15_V11_VGH0`)"""
+    checksums = {}
+    with open(shasum_file) as file:
+        for line in file:
+            checksum, name = line.rstrip().split("  ")
+            if name.endswith("_channel.h5"):
+                checksums[name.split("_channel.h5")[0]] = checksum
+    return checksums
+
+
+def build_entry(channelfile: str, out_file: str, engine: DelayDopplerEngine, output: str, attrs: dict) -> int:
+    """Computes the maps of all windows of a recording and writes them to a store entry
+
+    The entry is written to a `.part` file first and renamed when complete, so interrupted builds are never read.
+
+    Returns:
+        int: The number of maps
+    """
+    tmp_file = out_file + ".part"
+    with UAVDataset(channelfile, lazy=True) as dataset, h5py.File(tmp_file, "w") as h5_out:
+        starts = engine.starts(len(dataset))
+        shape = engine.map_shape(dataset.channel.shape[1])
+        maps = h5_out.create_dataset(
+            H5_MAPS,
+            shape=(len(starts),) + shape,
+            dtype=np.complex64 if output == "complex" else np.float32,
+            chunks=(1,) + shape,
+        )
+        h5_out.create_dataset(H5_STARTS, data=starts)
+        h5_out.create_dataset(H5_GROUNDTRUTH, data=np.asarray(dataset.groundtruth[starts + engine.window // 2]).reshape(-1, 2))
+
+        idx = 0
+        for _, block in engine.blocks(dataset.channel):
+            if output == "magnitude":
+                block = np.abs(block)
+            elif output == "db":
+                block = 20*np.log10(np.abs(block))
+            maps[idx:idx + len(block)] = block
+            idx += len(block)
+
+        h5_out.attrs.update(attrs)
+    os.replace(tmp_file, out_file)
+
+    return len(starts)
+
+
+class FeatureStore:
+    def __init__(self, store_dir: str, data_dir: str, engine: DelayDopplerEngine, output: str = "complex", shasum_file: str = None):
+        """Persistent store of the delay-Doppler maps of whole recordings
+
+        Every recording gets one HDF5 entry `<recording>_<key>.h5` with all maps of `engine`, their window starts and
+        the groundtruth at the window centers. The key is a hash of the processing parameters and the checksum of the
+        channel file in `scenarios.checksum`, so changing either leads to a new entry. An entry is stale if it is
+        missing, was written for a channel file of another size or modification time, or belongs to another key.
+        Stale entries are rebuilt by `build`, entries of other keys are removed by `prune`.
+
+        Args:
+            store_dir (str): The directory of the entries
+            data_dir (str): The directory of the `*_channel.h5` files
+            engine (DelayDopplerEngine): The engine computing the maps, `block_size` does not change the key
+            output (str, optional): Store `complex` maps, their `magnitude`, or their power in `db`. Defaults to "complex".
+            shasum_file (str, optional): The `scenarios.checksum` file. Defaults to None (`data_dir/scenarios.checksum`).
+
+        """
+        if output not in OUTPUTS:
+            raise ValueError(f"Unknown output { output }, expected one of { OUTPUTS }.")
+        self.store_dir = store_dir
+        self.data_dir = data_dir
+        self.engine = engine
+        self.output = output
+        self.checksums = load_checksums(shasum_file or os.path.join(data_dir, "scenarios.checksum"))
+
+        params = asdict(engine)
+        params.pop("block_size")
+        self.params = dict(params, output=output, version=FORMAT_VERSION)
+        os.makedirs(store_dir, exist_ok=True)
+
+        return
+
+    def key(self, recording: str) -> str:
+        """Returns the hash of the processing parameters and the checksum of a recording"""
+        content = json.dumps(self.params, sort_keys=True) + self.checksums[recording]
+        return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+    def path(self, recording: str) -> str:
+        return os.path.join(self.store_dir, f"{recording}_{self.key(recording)}.h5")
+
+    def _channelfile(self, recording: str) -> str:
+        return os.path.join(self.data_dir, f"{recording}_channel.h5")
+
+    def _source(self, recording: str) -> dict:
+        stat = os.stat(self._channelfile(recording))
+        return dict(source_size=stat.st_size, source_mtime_ns=stat.st_mtime_ns)
+
+    def is_fresh(self, recording: str) -> bool:
+        """Whether the entry of a recording exists and was built from the current channel file"""
+        try:
+            with h5py.File(self.path(recording), "r") as h5_entry:
+                attrs = dict(h5_entry.attrs)
+        except OSError:
+            return False
+        source = self._source(recording)
+        return all(attrs.get(name) == value for name, value in source.items())
+
+    def stale(self, recordings: list = None) -> list:
+        """Returns the recordings whose entries need to be (re-)built"""
+        recordings = self.local_recordings() if recordings is None else recordings
+        return [r for r in recordings if not self.is_fresh(r)]
+
+    def local_recordings(self) -> list:
+        """Returns the recordings of `scenarios.checksum` whose channel file exists in `data_dir`"""
+        return [r for r in self.checksums if os.path.exists(self._channelfile(r))]
+
+    def build(self, recordings: list = None, jobs: int = None, progress: bool = True) -> list:
+        """Builds the stale entries in parallel worker processes
+
+        Args:
+            recordings (list, optional): The recordings to build. Defaults to None (all local recordings).
+            jobs (int, optional): The number of worker processes. Defaults to None (number of CPUs).
+            progress (bool, optional): Whether to show a progress bar. Defaults to True.
+
+        Returns:
+            list: The rebuilt recordings
+        """
+        stale = self.stale(recordings)
+        if not stale:
+            return []
+
+        with ProcessPoolExecutor(max_workers=jobs) as pool, tqdm(total=len(stale), unit="file", disable=not progress) as pbar:
+            futures = {
+                pool.submit(
+                    build_entry,
+                    self._channelfile(r),
+                    self.path(r),
+                    self.engine,
+                    self.output,
+                    dict(self._source(r), recording=r, checksum=self.checksums[r], params=json.dumps(self.params, sort_keys=True)),
+                ): r for r in stale
+            }
+            for future in as_completed(futures):
+                future.result()
+                pbar.set_description(futures[future])
+                pbar.update()
+
+        return stale
+
+    def prune(self) -> list:
+        """Removes entries of other parameters or checksums and left-over `.part` files, returns the removed files"""
+        current = {os.path.basename(self.path(r)) for r in self.checksums}
+        removed = []
+        for path in glob.glob(os.path.join(self.store_dir, "*.h5")) + glob.glob(os.path.join(self.store_dir, "*.h5.part")):
+            if os.path.basename(path) not in current:
+                os.remove(path)
+                removed.append(path)
+        return removed
+
+    def open(self, recording: str) -> "FeatureEntry":
+        """Opens the entry of a recording, which must have been built"""
+        if not self.is_fresh(recording):
+            raise FileNotFoundError(f"The entry of { recording } is missing or stale, run `build` first.")
+        return FeatureEntry(self.path(recording))
+
+
+class FeatureEntry:
+    def __init__(self, path: str):
+        """Reader of one store entry, the maps are read from the file on slicing
+
+        Args:
+            path (str): The path of the entry
+
+        """
+        self.path = path
+        self._h5 = None
+        self.open()
+
+        return
+
+    def open(self) -> None:
+        if self._h5 is not None:
+            return
+        self._h5 = h5py.File(self.path, "r")
+        self.maps = self._h5[H5_MAPS]
+        self.starts = self._h5[H5_STARTS][:]
+        self.groundtruth = self._h5[H5_GROUNDTRUTH][:]
+        self.params = json.loads(self._h5.attrs["params"])
+
+        return
+
+    def close(self) -> None:
+        if self._h5 is not None:
+            self._h5.close()
+        self._h5 = None
+
+    def __getstate__(self) -> dict:
+        # every DataLoader worker opens its own handle
+        return dict(path=self.path)
+
+    def __setstate__(self, state: dict) -> None:
+        self.path = state["path"]
+        self._h5 = None
+        self.open()
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __enter__(self) -> "FeatureEntry":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def main(args):
+    engine = DelayDopplerEngine(
+        args.window,
+        hop=args.hop,
+        filter_clutter=args.filter_clutter,
+        upsample=args.upsample,
+        delay_bins=args.delay_bins,
+        zoom=args.zoom,
+    )
+    store = FeatureStore(args.store_dir, args.data_dir, engine, args.output, args.shasum_file)
+    recordings = args.recording or store.local_recordings()
+
+    built = store.build(recordings, jobs=args.jobs)
+    print(f"Built {len(built)} entries, {len(recordings) - len(built)} were up to date.")
+    if args.prune:
+        removed = store.prune()
+        print(f"Removed {len(removed)} outdated entries.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Precomputes the delay-Doppler maps of whole recordings into a persistent store, rebuilding stale entries."
+    )
+    parser.add_argument(
+        "-r", "--recording", help="Recording names (e.g. `1to2_H15_V11_VGH0`), separated by spaces. Defaults to all local recordings.", nargs="+",
+    )
+    parser.add_argument(
+        "--data-dir", help="Directory of the `*.h5` files. Default is the current working directory.", default=os.getcwd(),
+    )
+    parser.add_argument(
+        "--store-dir", help="Directory of the store.", default="features",
+    )
+    parser.add_argument(
+        "--shasum-file", help="Path to the `scenarios.checksum` file. Defaults to `<data-dir>/scenarios.checksum`.", default=None,
+    )
+    parser.add_argument(
+        "-w", "--window", help="Length of the slow time window.", type=int, default=100,
+    )
+    parser.add_argument(
+        "--hop", help="Slow time samples between two maps. Defaults to the window length.", type=int, default=None,
+    )
+    parser.add_argument(
+        "--filter-clutter", help="Apply the first-order clutter filter.", action="store_true",
+    )
+    parser.add_argument(
+        "--upsample", help="Zero-padding factor of both FFTs.", type=int, default=1,
+    )
+    parser.add_argument(
+        "--delay-bins", help="Number of delay bins to keep. Defaults to all.", type=int, default=None,
+    )
+    parser.add_argument(
+        "--zoom", help="Evaluate only the kept bins with partial DFT matrices.", action="store_true",
+    )
+    parser.add_argument(
+        "--output", help="Stored values of the maps.", choices=OUTPUTS, default="complex",
+    )
+    parser.add_argument(
+        "-j", "--jobs", help="Number of worker processes. Defaults to the number of CPUs.", type=int, default=None,
+    )
+    parser.add_argument(
+        "--prune", help="Remove entries of other parameters or checksums.", action="store_true",
+    )
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,252 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+from uavdataset import UAVDataset
+from delaydoppler import SNAPSHOT_PERIOD
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["snapshot_times", "window_centers", "interpolate", "GroundtruthIndex"]
+
+
+def snapshot_times(indices: np.ndarray, snapshot_period: float = SNAPSHOT_PERIOD) -> np.ndarray:
+    """Returns the time in s of (fractional) snapshot indices, relative to the first snapshot"""
+    return np.asarray(indices, dtype=np.float64) * snapshot_period
+
+
+def window_centers(starts: np.ndarray, t_window: int) -> np.ndarray:
+    """Returns the (fractional) center snapshot of windows, e.g. 49.5 for the window [0, 100)"""
+    return np.asarray(starts, dtype=np.float64) + (t_window - 1) / 2
+
+
+def interpolate(x: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """Linearly interpolates the rows of `x` at fractional snapshot indices
+
+    Only the two rows around each index are read, so `x` may also be a lazy `UAVDataset` array.
+    Indices outside of [0, len(x) - 1] are clamped to the first or last row.
+
+    Args:
+        x (np.ndarray): The values with shape (t_bins, ...), e.g. `groundtruth` or `uav`
+        indices (np.ndarray): The fractional snapshot indices with shape (n,)
+
+    Returns:
+        np.ndarray: The interpolated rows with shape (n, ...)
+    """
+    indices = np.clip(np.asarray(indices, dtype=np.float64), 0, len(x) - 1)
+    low = np.floor(indices).astype(np.int64)
+    high = np.minimum(low + 1, len(x) - 1)
+    weight = (indices - low).reshape((-1,) + (1,) * (np.ndim(x) - 1))
+    x_low, x_high = np.asarray(x[low]), np.asarray(x[high])
+    return x_low + weight * (x_high - x_low)
+
+
+def _scan(channelfile: str, targetfile: str, t_window: int, hop: int) -> tuple:
+    with UAVDataset(channelfile, targetfile, lazy=True) as dataset:
+        starts = np.arange(0, max(len(dataset) - t_window + 1, 0), hop)
+        centers = window_centers(starts, t_window)
+        groundtruth = interpolate(dataset.groundtruth[:], centers)
+        positions = np.full((len(starts), 3), np.nan)
+        if dataset.uav is not None:
+            # the RTK track may be sampled at another rate, it is assumed to span the same time as the channel
+            uav = dataset.uav[:]
+            positions = interpolate(uav, centers * (len(uav) - 1) / max(len(dataset) - 1, 1))
+    return starts, positions, groundtruth
+
+
+class GroundtruthIndex:
+    def __init__(self, recordings: list, recording: np.ndarray, starts: np.ndarray, positions: np.ndarray, groundtruth: np.ndarray, t_window: int, hop: int, cell_size: float = 10.0):
+        """Index of the windows of many recordings by UAV position, delay and Doppler at the window centers
+
+        The values are interpolated at the fractional window centers. The positions are hashed into a regular grid
+        of `cell_size` m and sorted by cell, the delay and Doppler are sorted, so every query is a few binary searches
+        instead of a pass over all files. Build it once with `build`, then `save` and `load` it.
+
+        Args:
+            recordings (list): The recording names
+            recording (np.ndarray): The index into `recordings` of every window
+            starts (np.ndarray): The start snapshot of every window
+            positions (np.ndarray): The UAV position at the center of every window with shape (n, 3), NaN if unknown
+            groundtruth (np.ndarray): The delay and Doppler at the center of every window with shape (n, 2)
+            t_window (int): The length of the slow-time window
+            hop (int): The slow-time samples between two window starts
+            cell_size (float, optional): The edge length of the grid cells of the spatial index in m. Defaults to 10.
+
+        """
+        self.recordings = list(recordings)
+        self.recording = np.asarray(recording, dtype=np.int32)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.positions = np.asarray(positions, dtype=np.float64)
+        self.groundtruth = np.asarray(groundtruth, dtype=np.float64)
+        self.t_window = int(t_window)
+        self.hop = int(hop)
+        self.cell_size = float(cell_size)
+
+        # spatial index: windows sorted by grid cell, unknown positions are not indexed
+        known = np.flatnonzero(np.all(np.isfinite(self.positions), axis=1))
+        cells = np.floor(self.positions[known] / self.cell_size).astype(np.int64)
+        order = np.lexsort(cells.T[::-1])
+        self._cell_rows = known[order]
+        self._cells = cells[order]
+        self._cell_keys = self._key(self._cells)
+
+        # parameter index
+        self._delay_order = np.argsort(self.groundtruth[:, 0], kind="stable")
+        self._doppler_order = np.argsort(self.groundtruth[:, 1], kind="stable")
+        self._abs_doppler_order = np.argsort(np.abs(self.groundtruth[:, 1]), kind="stable")
+
+        return
+
+    def _key(self, cells: np.ndarray) -> np.ndarray:
+        # lexicographic order of the cells as a single sortable key
+        if len(self._cells) == 0:
+            return np.zeros(len(cells), dtype=np.int64)
+        low = self._cells.min(axis=0)
+        span = self._cells.max(axis=0) - low + 1
+        cells = np.clip(cells - low, -1, span)
+        return ((cells[:, 0] + 1) * (span[1] + 2) + cells[:, 1] + 1) * (span[2] + 2) + cells[:, 2] + 1
+
+    @classmethod
+    def build(cls, data_dir: str, recordings: list, t_window: int = 100, hop: int = 1, cell_size: float = 10.0, jobs: int = None) -> "GroundtruthIndex":
+        """Reads the groundtruth and UAV positions of recordings in parallel worker processes and builds the index
+
+        Args:
+            data_dir (str): The directory of the `*_channel.h5` and `*_target.h5` files
+            recordings (list): The recording names, e.g. `1to2_H15_V11_VGH0`
+            t_window (int, optional): The length of the slow-time window. Defaults to 100.
+            hop (int, optional): The slow-time samples between two window starts. Defaults to 1.
+            cell_size (float, optional): The edge length of the grid cells in m. Defaults to 10.
+            jobs (int, optional): The number of worker processes. Defaults to None (number of CPUs).
+
+        Returns:
+            GroundtruthIndex: The index
+        """
+        files = []
+        for name in recordings:
+            targetfile = os.path.join(data_dir, f"{name}_target.h5")
+            files.append((os.path.join(data_dir, f"{name}_channel.h5"), targetfile if os.path.exists(targetfile) else None))
+
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_scan, *zip(*files), [t_window] * len(files), [hop] * len(files)))
+
+        starts, positions, groundtruth = (list(r) for r in zip(*results))
+        recording = np.concatenate([np.full(len(s), i) for i, s in enumerate(starts)])
+        return cls(
+            recordings, recording, np.concatenate(starts), np.concatenate(positions), np.concatenate(groundtruth),
+            t_window, hop, cell_size,
+        )
+
+    def within(self, point: np.ndarray, radius: float) -> np.ndarray:
+        """Returns the rows of all windows whose UAV position is within `radius` m of `point`"""
+        point = np.asarray(point, dtype=np.float64)
+        low = np.floor((point - radius) / self.cell_size).astype(np.int64)
+        high = np.floor((point + radius) / self.cell_size).astype(np.int64)
+        # every (x, y) column of cells is a contiguous range of z cells in the sorted keys
+        x, y = np.meshgrid(np.arange(low[0], high[0] + 1), np.arange(low[1], high[1] + 1), indexing="ij")
+        first = np.stack((x.ravel(), y.ravel(), np.full(x.size, low[2])), axis=1)
+        last = np.stack((x.ravel(), y.ravel(), np.full(x.size, high[2])), axis=1)
+        left = np.searchsorted(self._cell_keys, self._key(first), side="left")
+        right = np.searchsorted(self._cell_keys, self._key(last), side="right")
+        # cells outside of the indexed range are clipped onto its border, the exact distance test removes them
+        candidates = np.concatenate([self._cell_rows[a:b] for a, b in zip(left, right)] + [np.empty(0, dtype=np.int64)])
+        candidates = np.unique(candidates)
+        distance = np.linalg.norm(self.positions[candidates] - point, axis=1)
+        return candidates[distance <= radius]
+
+    @staticmethod
+    def _range(values: np.ndarray, order: np.ndarray, interval: tuple) -> np.ndarray:
+        low, high = interval
+        sorted_values = values[order]
+        left = 0 if low is None else np.searchsorted(sorted_values, low, side="left")
+        right = len(order) if high is None else np.searchsorted(sorted_values, high, side="right")
+        return np.sort(order[left:right])
+
+    def where(self, delay: tuple = None, doppler: tuple = None, abs_doppler: tuple = None) -> np.ndarray:
+        """Returns the rows of all windows whose delay and Doppler lie in closed intervals, None is unbounded
+
+        Example: `where(delay=(a, b), abs_doppler=(c, None))` for all windows with a <= delay <= b and |Doppler| >= c.
+        """
+        rows = np.arange(len(self.starts))
+        for values, order, interval in (
+            (self.groundtruth[:, 0], self._delay_order, delay),
+            (self.groundtruth[:, 1], self._doppler_order, doppler),
+            (np.abs(self.groundtruth[:, 1]), self._abs_doppler_order, abs_doppler),
+        ):
+            if interval is not None:
+                rows = np.intersect1d(rows, self._range(values, order, interval), assume_unique=True)
+        return rows
+
+    def select(self, rows: np.ndarray) -> dict:
+        """Returns the window starts of rows, grouped by recording name"""
+        rows = np.sort(np.asarray(rows, dtype=np.int64))
+        return {
+            self.recordings[i]: self.starts[rows[self.recording[rows] == i]]
+            for i in np.unique(self.recording[rows])
+        }
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path,
+            recordings=np.array(self.recordings),
+            recording=self.recording,
+            starts=self.starts,
+            positions=self.positions,
+            groundtruth=self.groundtruth,
+            params=np.array([self.t_window, self.hop, self.cell_size]),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "GroundtruthIndex":
+        with np.load(path) as data:
+            t_window, hop, cell_size = data["params"]
+            return cls(
+                data["recordings"].tolist(), data["recording"], data["starts"], data["positions"], data["groundtruth"],
+                int(t_window), int(hop), cell_size,
+            )
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __str__(self) -> str:
+        return f"""
+           ---- Groundtruth Index Summary ----
+           Recordings: \t{len(self.recordings)}
+           Windows: \t\t{len(self)} (t_window={self.t_window}, hop={self.hop})
+           Positioned: \t{len(self._cell_rows)} in {len(np.unique(self._cell_keys))} cells of {self.cell_size:g} m
+           """
+
+
+def main(args):
+    index = GroundtruthIndex.build(args.data_dir, args.recording, args.window, args.hop, args.cell_size, args.jobs)
+    index.save(args.output)
+    print(index)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Builds the index of the windows of recordings by UAV position, delay and Doppler."
+    )
+    parser.add_argument(
+        "-r", "--recording", help="Recording names (e.g. `1to2_H15_V11_VGH0`), separated by spaces.", nargs="+", required=True,
+    )
+    parser.add_argument(
+        "--data-dir", help="Directory of the `*.h5` files. Default is the current working directory.", default=os.getcwd(),
+    )
+    parser.add_argument(
+        "-o", "--output", help="Output `.npz` file of the index.", default="groundtruth_index.npz",
+    )
+    parser.add_argument(
+        "-w", "--window", help="Length of the slow time window.", type=int, default=100,
+    )
+    parser.add_argument(
+        "--hop", help="Slow time samples between two window starts.", type=int, default=1,
+    )
+    parser.add_argument(
+        "--cell-size", help="Edge length of the grid cells of the spatial index in m.", type=float, default=10.0,
+    )
+    parser.add_argument(
+        "-j", "--jobs", help="Number of worker processes. Defaults to the number of CPUs.", type=int, default=None,
+    )
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,205 @@
+import argparse
+from dataclasses import dataclass, field
+import os
+import numpy as np
+from uavdataset import UAVDataset
+from delaydoppler import SNAPSHOT_PERIOD
+from groundtruth import interpolate
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["Localization", "localize", "estimate_velocity", "localize_scenario"]
+
+SPEED_OF_LIGHT = 299792458.0
+"""The speed of light in m/s"""
+CARRIER_FREQUENCY = 3.75e9
+"""The carrier frequency of the channel sounder in Hz"""
+RXS = ["VGH0", "VGH1", "VGH2"]
+
+
+def _ranges(p: np.ndarray, tx: np.ndarray, rx: np.ndarray) -> tuple:
+    # distances and unit vectors from the antennas to the UAV, p with shape (T, 3), tx and rx with shape (T, R, 3)
+    d_tx = p[:, None] - tx
+    d_rx = p[:, None] - rx
+    r_tx = np.linalg.norm(d_tx, axis=-1)
+    r_rx = np.linalg.norm(d_rx, axis=-1)
+    return r_tx, r_rx, d_tx / r_tx[..., None], d_rx / r_rx[..., None]
+
+
+def _gauss_newton(p: np.ndarray, ranges: np.ndarray, tx: np.ndarray, rx: np.ndarray, baseline: np.ndarray, iterations: int, damping: float) -> tuple:
+    for _ in range(iterations):
+        r_tx, r_rx, u_tx, u_rx = _ranges(p, tx, rx)
+        residual = r_tx + r_rx - baseline - ranges
+        jacobian = u_tx + u_rx
+        jt = np.swapaxes(jacobian, -1, -2)
+        # Levenberg-Marquardt damping keeps the steps bounded near the antenna plane, where the geometry degenerates
+        normal = jt @ jacobian + damping * np.eye(3)
+        step = np.linalg.solve(normal, (jt @ residual[..., None]))[..., 0]
+        p = p - step
+        if np.max(np.abs(step)) < 1e-4:
+            break
+    # the residual of the returned positions
+    r_tx, r_rx, _, _ = _ranges(p, tx, rx)
+    return p, r_tx + r_rx - baseline - ranges
+
+
+def localize(delays: np.ndarray, tx: np.ndarray, rx: np.ndarray, initial: np.ndarray = None, relative_to_los: bool = True, block_size: int = 256, iterations: int = 20, damping: float = 1e-6) -> tuple:
+    """Solves for the UAV position of all snapshots from the bistatic delays of several receivers
+
+    The snapshots are solved in blocks with a vectorized (damped) Gauss-Newton method. Every block is
+    warm-started from the last position of the previous block, then every snapshot is refined once more starting
+    from the solution of its predecessor.
+
+    Args:
+        delays (np.ndarray): The bistatic delays in s with shape (T, R)
+        tx (np.ndarray): The transmitter positions with shape (T, 3) or (T, R, 3)
+        rx (np.ndarray): The receiver positions with shape (T, R, 3)
+        initial (np.ndarray, optional): The initial position. Defaults to None (30 m above the centroid of the antennas).
+        relative_to_los (bool, optional): Whether the delays are relative to the direct path from tx to rx. Defaults to True.
+        block_size (int, optional): The number of snapshots solved at once. Defaults to 256.
+        iterations (int, optional): The maximum number of Gauss-Newton iterations per block. Defaults to 20.
+        damping (float, optional): The Levenberg-Marquardt damping in m^2. Defaults to 1e-6.
+
+    Returns:
+        tuple: The positions with shape (T, 3) and the range residuals in m with shape (T, R)
+    """
+    delays = np.asarray(delays, dtype=np.float64)
+    rx = np.asarray(rx, dtype=np.float64)
+    tx = np.broadcast_to(np.asarray(tx, dtype=np.float64)[:, None] if np.ndim(tx) == 2 else tx, rx.shape)
+    ranges = SPEED_OF_LIGHT * delays
+    baseline = np.linalg.norm(rx - tx, axis=-1) if relative_to_los else np.zeros(delays.shape)
+    if initial is None:
+        antennas = np.concatenate((tx[0], rx[0]))
+        initial = antennas.mean(axis=0) + [0, 0, 30]
+
+    positions = np.empty((len(delays), 3))
+    residuals = np.empty(delays.shape)
+    last = np.asarray(initial, dtype=np.float64)
+    for start in range(0, len(delays), block_size):
+        block = slice(start, start + block_size)
+        p = np.repeat(last[None], len(ranges[block]), axis=0)
+        p, _ = _gauss_newton(p, ranges[block], tx[block], rx[block], baseline[block], iterations, damping)
+        # refine from the solution of the previous snapshot, keeps all snapshots on the same branch of the solution
+        p[1:] = p[:-1]
+        p[0] = last
+        p, residual = _gauss_newton(p, ranges[block], tx[block], rx[block], baseline[block], iterations, damping)
+        positions[block] = p
+        residuals[block] = residual
+        last = p[-1]
+
+    return positions, residuals
+
+
+def estimate_velocity(positions: np.ndarray, dopplers: np.ndarray, tx: np.ndarray, rx: np.ndarray, carrier_frequency: float = CARRIER_FREQUENCY) -> np.ndarray:
+    """Solves for the UAV velocity of all snapshots from the bistatic Doppler shifts by least squares
+
+    The bistatic Doppler shift is `-(u_tx + u_rx) @ v / wavelength`, with the unit vectors `u` from the antennas to the UAV.
+
+    Args:
+        positions (np.ndarray): The UAV positions with shape (T, 3)
+        dopplers (np.ndarray): The bistatic Doppler shifts in Hz with shape (T, R)
+        tx (np.ndarray): The transmitter positions with shape (T, 3) or (T, R, 3)
+        rx (np.ndarray): The receiver positions with shape (T, R, 3)
+        carrier_frequency (float, optional): The carrier frequency in Hz. Defaults to 3.75 GHz.
+
+    Returns:
+        np.ndarray: The velocities in m/s with shape (T, 3)
+    """
+    rx = np.asarray(rx, dtype=np.float64)
+    tx = np.broadcast_to(np.asarray(tx, dtype=np.float64)[:, None] if np.ndim(tx) == 2 else tx, rx.shape)
+    wavelength = SPEED_OF_LIGHT / carrier_frequency
+    _, _, u_tx, u_rx = _ranges(positions, tx, rx)
+    a = -(u_tx + u_rx) / wavelength
+    at = np.swapaxes(a, -1, -2)
+    return np.linalg.solve(at @ a + 1e-12 * np.eye(3), at @ np.asarray(dopplers, dtype=np.float64)[..., None])[..., 0]
+
+
+@dataclass
+class Localization:
+    positions: np.ndarray
+    """The estimated UAV positions with shape (T, 3)"""
+    velocities: np.ndarray
+    """The estimated UAV velocities in m/s with shape (T, 3)"""
+    residuals: np.ndarray
+    """The range residuals of the receivers in m with shape (T, R)"""
+    uav: np.ndarray = None
+    """The RTK positions of the UAV at the snapshots with shape (T, 3), if loaded"""
+    position_rmse: float = field(init=False, default=np.nan)
+    """The RMSE of the positions against `uav` in m"""
+    velocity_rmse: float = field(init=False, default=np.nan)
+    """The RMSE of the velocities against the derivative of `uav` in m/s"""
+
+    def __post_init__(self) -> None:
+        if self.uav is not None:
+            if len(self.uav) != len(self.positions):
+                raise ValueError(f"The UAV positions ({ len(self.uav) }) must be aligned to the snapshots ({ len(self.positions) }).")
+            self.position_rmse = float(np.sqrt(np.mean(np.sum((self.positions - self.uav)**2, axis=-1))))
+            reference = np.gradient(self.uav, SNAPSHOT_PERIOD, axis=0)
+            self.velocity_rmse = float(np.sqrt(np.mean(np.sum((self.velocities - reference)**2, axis=-1))))
+
+    def __str__(self) -> str:
+        return f"""
+           ---- Localization Summary ----
+           Snapshots: \t\t{len(self.positions)}
+           Range Residual: \t{np.sqrt(np.mean(self.residuals**2)):.3f} m (RMS)
+           Position RMSE: \t{self.position_rmse:.3f} m
+           Velocity RMSE: \t{self.velocity_rmse:.3f} m/s
+           """
+
+
+def localize_scenario(data_dir: str, scenario: str, rxs: list = RXS, **kwargs) -> Localization:
+    """Localizes the UAV of a scenario from the groundtruth delays and Doppler shifts of its receivers
+
+    Args:
+        data_dir (str): The directory of the `*_channel.h5` and `*_target.h5` files
+        scenario (str): The scenario name, e.g. `1to2_H15_V11`
+        rxs (list, optional): The receivers. Defaults to `["VGH0", "VGH1", "VGH2"]`.
+        **kwargs: Passed to `localize`
+
+    Returns:
+        Localization: The positions, velocities and their RMSE against the RTK positions (if a target file exists)
+    """
+    groundtruth, tx, rx = [], [], []
+    for rx_name in rxs:
+        with UAVDataset(os.path.join(data_dir, f"{scenario}_{rx_name}_channel.h5"), lazy=True) as dataset:
+            groundtruth.append(dataset.groundtruth[:])
+            tx.append(dataset.tx[:])
+            rx.append(dataset.rx[:])
+    n = min(len(g) for g in groundtruth)
+    groundtruth = np.stack([g[:n] for g in groundtruth], axis=1)
+    tx = np.stack([t[:n] for t in tx], axis=1)
+    rx = np.stack([r[:n] for r in rx], axis=1)
+
+    positions, residuals = localize(groundtruth[..., 0], tx, rx, **kwargs)
+    velocities = estimate_velocity(positions, groundtruth[..., 1], tx, rx)
+
+    uav = None
+    targetfile = os.path.join(data_dir, f"{scenario}_{rxs[0]}_target.h5")
+    if os.path.exists(targetfile):
+        with UAVDataset(os.path.join(data_dir, f"{scenario}_{rxs[0]}_channel.h5"), targetfile, lazy=True) as dataset:
+            # the RTK track may be sampled at another rate, it is assumed to span the same time as the channel
+            track = dataset.uav[:]
+            uav = interpolate(track, np.arange(n) * (len(track) - 1) / max(len(dataset) - 1, 1))
+
+    return Localization(positions, velocities, residuals, uav)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Localizes the UAV of whole scenarios from the bistatic delays and Doppler shifts of all receivers."
+    )
+    parser.add_argument(
+        "-s", "--scenario", help="Scenario names (e.g. `1to2_H15_V11`), separated by spaces.", nargs="+", required=True,
+    )
+    parser.add_argument(
+        "--data-dir", help="Directory of the `*.h5` files. Default is the current working directory.", default=os.getcwd(),
+    )
+    parser.add_argument(
+        "--absolute-delays", help="The delays are absolute bistatic delays, not relative to the direct path.", action="store_true",
+    )
+    args = parser.parse_args()
+
+    for scenario in args.scenario:
+        result = localize_scenario(args.data_dir, scenario, relative_to_los=not args.absolute_delays)
+        print(scenario)
+        print(result)
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+import threading
+import numpy as np
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["MapCache"]
+
+
+class MapCache:
+    def __init__(self, max_mb: float = 256):
+        """Bounded least-recently-used cache for delay-Doppler maps
+
+        The maps are keyed by `(file, start_idx, window, filter_clutter, upsample)`.
+        If the total size of the cached maps exceeds `max_mb`, the least-recently-used maps are evicted.
+        The cache is thread-safe, so maps can be computed in a background thread.
+
+        Args:
+            max_mb (float, optional): The memory limit of the cache in MB. Defaults to 256.
+
+        """
+        self.max_bytes = int(max_mb * 2**20)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+        return
+
+    def get(self, key: tuple) -> np.ndarray:
+        """Returns the cached map for `key` and marks it as recently used, or None if it is not cached"""
+        with self._lock:
+            value = self._maps.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._maps.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: tuple, value: np.ndarray) -> None:
+        """Stores `value` and evicts least-recently-used maps until the memory limit is met"""
+        if value.nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._maps.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._maps[key] = value
+            self.nbytes += value.nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._maps.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+        return
+
+    def get_or_compute(self, key: tuple, compute) -> np.ndarray:
+        """Returns the cached map for `key`, or calls `compute()` and caches its result"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._maps.clear()
+            self.nbytes = 0
+
+    def __contains__(self, key: tuple) -> bool:
+        with self._lock:
+            return key in self._maps
+
+    def __len__(self) -> int:
+        return len(self._maps)
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        return f"""
+           ---- Map Cache Summary ----
+           Maps: \t\t{len(self)} ({self.nbytes / 2**20:.1f} / {self.max_bytes / 2**20:.1f} MB)
+           Hits: \t\t{self.hits} ({100 * self.hits / max(total, 1):.1f} %)
+           Misses: \t\t{self.misses}
+           Evictions: \t{self.evictions}
+           """
@@ -0,0 +1,224 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+import glob
+import os
+import numpy as np
+from tqdm.auto import tqdm
+from uavdataset import UAVDataset
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["RunningStats", "recording_statistics", "corpus_statistics", "save_statistics", "load_statistics", "Normalize"]
+
+GROUPS = ("channel", "delay_power", "groundtruth", "uav")
+"""The statistics of a recording: per subcarrier, power per delay bin, delay and Doppler, UAV position"""
+
+
+@dataclass
+class RunningStats:
+    count: int = 0
+    """The number of samples"""
+    mean: np.ndarray = None
+    """The mean of the samples per feature, complex for complex samples"""
+    m2: np.ndarray = None
+    """The sum of the squared magnitude of the deviations from the mean per feature"""
+    min: np.ndarray = None
+    """The minimum (of the magnitude for complex samples) per feature"""
+    max: np.ndarray = None
+    """The maximum (of the magnitude for complex samples) per feature"""
+
+    @property
+    def variance(self) -> np.ndarray:
+        """The (population) variance per feature, `E|x - mean|^2` for complex samples"""
+        return self.m2 / self.count
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.variance)
+
+    def update(self, x: np.ndarray) -> "RunningStats":
+        """Adds a block of samples with shape (n, ...features) to the statistics
+
+        The block statistics are computed exactly (two-pass) and merged, so only the statistics are kept in memory.
+        """
+        x = np.asarray(x)
+        if len(x) == 0:
+            return self
+        x = x.astype(np.complex128 if np.iscomplexobj(x) else np.float64, copy=False)
+        mean = x.mean(axis=0)
+        magnitude = np.abs(x) if np.iscomplexobj(x) else x
+        block = RunningStats(
+            len(x), mean, np.sum(np.abs(x - mean)**2, axis=0), magnitude.min(axis=0), magnitude.max(axis=0),
+        )
+        return self.merge(block)
+
+    def merge(self, other: "RunningStats") -> "RunningStats":
+        """Merges the statistics of another set of samples in place (Chan et al.), returns `self`"""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2, self.min, self.max = other.count, other.mean, other.m2, other.min, other.max
+            return self
+        if np.shape(self.mean) != np.shape(other.mean):
+            raise ValueError(f"Cannot merge statistics of shape { np.shape(self.mean) } and { np.shape(other.mean) }.")
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + np.abs(delta)**2 * (self.count * other.count / count)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.count = count
+        return self
+
+
+def recording_statistics(channelfile: str, targetfile: str = None, chunk_size: int = 4096) -> dict:
+    """Streams a recording in slow-time chunks and returns its statistics
+
+    Only `chunk_size` snapshots are in memory at once. The power per delay bin is `|IFFT(H)|^2` over the subcarriers,
+    i.e. the delay axis of the delay-Doppler maps. The UAV positions are streamed over the full RTK track, whose length
+    may differ from the number of snapshots.
+
+    Args:
+        channelfile (str): The `*_channel.h5` file
+        targetfile (str, optional): The `*_target.h5` file. Defaults to None (no UAV statistics).
+        chunk_size (int, optional): The number of snapshots read at once. Defaults to 4096.
+
+    Returns:
+        dict: The `RunningStats` of every group in `GROUPS`
+    """
+    stats = {name: RunningStats() for name in GROUPS}
+    with UAVDataset(channelfile, targetfile, lazy=True) as dataset:
+        for start in range(0, len(dataset), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            x = np.asarray(dataset.channel[chunk]).astype(np.complex128)
+            stats["channel"].update(x)
+            stats["delay_power"].update(np.abs(np.fft.ifft(x, axis=-1))**2)
+            stats["groundtruth"].update(dataset.groundtruth[chunk])
+        if dataset.uav is not None:
+            # the RTK track has its own length, it is not aligned to the snapshots
+            for start in range(0, len(dataset.uav), chunk_size):
+                stats["uav"].update(dataset.uav[start:start + chunk_size])
+    return stats
+
+
+def corpus_statistics(files: list, chunk_size: int = 4096, jobs: int = None, progress: bool = True) -> dict:
+    """Computes the statistics of many recordings in parallel worker processes and merges them
+
+    Args:
+        files (list): The (channel file, target file or None) of each recording
+        chunk_size (int, optional): The number of snapshots read at once. Defaults to 4096.
+        jobs (int, optional): The number of worker processes. Defaults to None (number of CPUs).
+        progress (bool, optional): Whether to show a progress bar. Defaults to True.
+
+    Returns:
+        dict: The merged `RunningStats` of every group in `GROUPS`
+    """
+    stats = {name: RunningStats() for name in GROUPS}
+    with ProcessPoolExecutor(max_workers=jobs) as pool, tqdm(total=len(files), unit="file", disable=not progress) as pbar:
+        futures = {pool.submit(recording_statistics, channelfile, targetfile, chunk_size): channelfile for channelfile, targetfile in files}
+        for future in as_completed(futures):
+            for name, result in future.result().items():
+                stats[name].merge(result)
+            pbar.set_description(os.path.basename(futures[future]))
+            pbar.update()
+    return stats
+
+
+def save_statistics(stats: dict, path: str) -> None:
+    """Writes the count, mean, variance, min and max of every group to a `.npz` file, e.g. `channel_mean`"""
+    arrays = {}
+    for name, group in stats.items():
+        if group.count == 0:
+            continue
+        arrays.update({
+            f"{name}_count": np.asarray(group.count),
+            f"{name}_mean": group.mean,
+            f"{name}_var": group.variance,
+            f"{name}_min": group.min,
+            f"{name}_max": group.max,
+        })
+    np.savez(path, **arrays)
+
+
+def load_statistics(path: str) -> dict:
+    with np.load(path) as data:
+        return dict(data)
+
+
+class Normalize:
+    def __init__(self, mean: np.ndarray, std: np.ndarray, eps: float = 1e-12):
+        """Normalizes channel windows to zero mean and unit variance per subcarrier, e.g. the `transform` of `TorchDataset`
+
+        Args:
+            mean (np.ndarray): The complex mean per subcarrier with shape (f_bins,)
+            std (np.ndarray): The standard deviation per subcarrier with shape (f_bins,)
+            eps (float, optional): Added to `std` to avoid a division by zero. Defaults to 1e-12.
+
+        """
+        self.mean = np.asarray(mean, dtype=np.complex64)
+        self.scale = (1 / (np.asarray(std, dtype=np.float64) + eps)).astype(np.float32)
+        self._torch = None
+
+        return
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "Normalize":
+        """Creates the transform from a statistics file written by `save_statistics`"""
+        stats = load_statistics(path)
+        return cls(stats["channel_mean"], np.sqrt(stats["channel_var"]), **kwargs)
+
+    def __call__(self, x):
+        """Normalizes windows with shape (..., t_bins, f_bins), a numpy array or a torch tensor"""
+        if isinstance(x, np.ndarray):
+            return ((x - self.mean) * self.scale).astype(np.complex64, copy=False)
+
+        import torch
+        if self._torch is None or self._torch[0].device != x.device:
+            self._torch = (torch.from_numpy(self.mean).to(x.device), torch.from_numpy(self.scale).to(x.device))
+        mean, scale = self._torch
+        return (x - mean) * scale
+
+    def __getstate__(self) -> dict:
+        # the tensors are recreated on the device of the first window in every DataLoader worker
+        return dict(self.__dict__, _torch=None)
+
+
+def main(args):
+    if args.recording is None:
+        channelfiles = sorted(glob.glob(os.path.join(args.data_dir, "*_channel.h5")))
+    else:
+        channelfiles = [os.path.join(args.data_dir, f"{recording}_channel.h5") for recording in args.recording]
+    files = []
+    for channelfile in channelfiles:
+        targetfile = channelfile.replace("_channel.h5", "_target.h5")
+        files.append((channelfile, targetfile if os.path.exists(targetfile) else None))
+
+    stats = corpus_statistics(files, args.chunk_size, args.jobs)
+    save_statistics(stats, args.output)
+    print(f"Wrote the statistics of {len(files)} recordings ({stats['channel'].count} snapshots) to {args.output}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Computes the normalization statistics of all recordings in a single streaming pass."
+    )
+    parser.add_argument(
+        "-r", "--recording", help="Recording names (e.g. `1to2_H15_V11_VGH0`), separated by spaces. Defaults to all local recordings.", nargs="+",
+    )
+    parser.add_argument(
+        "--data-dir", help="Directory of the `*.h5` files. Default is the current working directory.", default=os.getcwd(),
+    )
+    parser.add_argument(
+        "-o", "--output", help="Output `.npz` file of the statistics.", default="statistics.npz",
+    )
+    parser.add_argument(
+        "--chunk-size", help="Number of snapshots read at once.", type=int, default=4096,
+    )
+    parser.add_argument(
+        "-j", "--jobs", help="Number of worker processes. Defaults to the number of CPUs.", type=int, default=None,
+    )
+    args = parser.parse_args()
+
+    main(args)
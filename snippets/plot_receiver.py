@@ -4,6 +4,9 @@ import matplotlib.pyplot as plt
 from matplotlib.widgets import Slider
 import argparse
 from uavdataset import UAVDataset
+from delaydoppler import delay_doppler
+from mapcache import MapCache
+from viewer import MapPrefetcher, SliderPlayer
 matplotlib.use('webagg')
 
 __author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
@@ -30,13 +33,7 @@ def get_channel(x: np.ndarray, start_idx: int, window_slowtime: int, filter_clut
             "Start index must be smaller than the number of slowtime samples minus the window size.")
 
     x = x[start_idx:start_idx+window_slowtime, :]
-    if filter_clutter:
-        x = np.diff(x, n=1, axis=0)
-        
-    y = np.fft.fftshift(np.fft.fft(np.fft.ifft(x, axis=1), axis=0), axes=0)
-    y /= np.linalg.norm(y)
-
-    return y
+    return delay_doppler(x, filter_clutter=filter_clutter)
 
 
 def get_groundtruth(x: np.ndarray, start_idx: int, window_slowtime: int):
@@ -50,33 +47,46 @@ def get_groundtruth(x: np.ndarray, start_idx: int, window_slowtime: int):
     return np.array([delay, doppler])
 
 
-def get_data(channel: np.ndarray, groundtruth: np.ndarray, window_slowtime: int, start_idx: int):
-    channel = get_channel(channel, start_idx, window_slowtime)
+def get_data(channel: np.ndarray, groundtruth: np.ndarray, window_slowtime: int, start_idx: int, cache: MapCache = None, channelfile: str = None):
+    if cache is None:
+        channel = get_channel(channel, start_idx, window_slowtime)
+    else:
+        channel = cache.get_or_compute(
+            (channelfile, start_idx, window_slowtime, False, 1),
+            lambda: get_channel(channel, start_idx, window_slowtime),
+        )
     groundtruth = get_groundtruth(groundtruth, start_idx, window_slowtime)
     return channel, groundtruth
 
 
-def update_fig(fig: plt.Figure, ax: plt.Axes, channel: np.ndarray, groundtruth: np.ndarray):
-    ax.clear()
-    ax.imshow(20*np.log10(np.abs(channel)), aspect="auto",
-              cmap="inferno", vmin=-100, vmax=0, extent=[0, 16e-6, +1/(2*320e-6), -1/(2*320e-6)])
-    ax.plot(groundtruth[0], groundtruth[1], **MARKER_STYLE)
+def init_fig(ax: plt.Axes, channel: np.ndarray, groundtruth: np.ndarray):
+    image = ax.imshow(20*np.log10(np.abs(channel)), aspect="auto",
+                      cmap="inferno", vmin=-100, vmax=0, extent=[0, 16e-6, +1/(2*320e-6), -1/(2*320e-6)])
+    marker, = ax.plot(groundtruth[0], groundtruth[1], **MARKER_STYLE)
     ax.set_xlabel("Delay [s]")
     ax.set_ylabel("Doppler-Shift [Hz]")
+    return image, marker
+
+
+def update_fig(fig: plt.Figure, artists: tuple, channel: np.ndarray, groundtruth: np.ndarray):
+    image, marker = artists
+    image.set_data(20*np.log10(np.abs(channel)))
+    marker.set_data([groundtruth[0]], [groundtruth[1]])
     fig.canvas.draw_idle()
-    return fig, ax
+    return fig, artists
 
 
-def update(fig: plt.Figure, ax: plt.Axes, channel: np.ndarray, groundtruth: np.ndarray, window_slowtime: int, start_idx: int):
+def update(fig: plt.Figure, artists: tuple, channel: np.ndarray, groundtruth: np.ndarray, window_slowtime: int, start_idx: int, cache: MapCache = None, channelfile: str = None):
     channel_window, groundtruth_window = get_data(
-        channel, groundtruth, window_slowtime, start_idx)
-    update_fig(fig, ax, channel_window, groundtruth_window)
+        channel, groundtruth, window_slowtime, start_idx, cache, channelfile)
+    update_fig(fig, artists, channel_window, groundtruth_window)
 
 
 def main(args):
     dataset = UAVDataset(args.channel_file, args.target_file)
     channel = dataset.channel
     groundtruth = dataset.groundtruth
+    cache = MapCache(args.cache_mb)
     window_slowtime = args.window
     num_windows = (channel.shape[0] - window_slowtime) // window_slowtime
 
@@ -86,8 +96,8 @@ def main(args):
         tight_layout=True,
         gridspec_kw={"width_ratios": [0.05, 1, 0.05]}
     )
-    update(fig, ax[1], channel, groundtruth, window_slowtime, 0)
-    cbar = plt.colorbar(ax[1].get_images()[0],
+    artists = init_fig(ax[1], *get_data(channel, groundtruth, window_slowtime, 0, cache, args.channel_file))
+    cbar = plt.colorbar(artists[0],
                         cax=ax[2], orientation="vertical")
     cbar.set_label("Normalized Power [dB]")
     sample_slider = Slider(
@@ -99,9 +109,26 @@ def main(args):
         valstep=1,
         orientation="vertical",
     )
-    sample_slider.on_changed(lambda slider_value: update(
-        fig, ax[1], channel, groundtruth, window_slowtime, slider_value*window_slowtime))
+
+    prefetcher = MapPrefetcher(cache, lambda key: get_channel(channel, key[1], key[2]))
+    player = SliderPlayer(
+        fig, sample_slider,
+        keys=lambda slider_value: [(args.channel_file, slider_value*window_slowtime, window_slowtime, False, 1)],
+        prefetcher=prefetcher,
+        fps=args.fps,
+        ahead=args.prefetch,
+    )
+
+    def on_changed(slider_value):
+        update(fig, artists, channel, groundtruth, window_slowtime, slider_value*window_slowtime, cache, args.channel_file)
+        player.prefetch(slider_value)
+
+    sample_slider.on_changed(on_changed)
+    player.prefetch(sample_slider.val)
     plt.show()
+    prefetcher.close()
+    print(cache)
+    print(player)
 
 
 if __name__ == "__main__":
@@ -121,6 +148,24 @@ if __name__ == "__main__":
         type=int,
         default=100,
     )
+    parser.add_argument(
+        "--cache-mb",
+        help="Memory limit of the delay-Doppler map cache in MB.",
+        type=float,
+        default=256,
+    )
+    parser.add_argument(
+        "--fps",
+        help="Target frame rate of the playback, which is started and paused with the space key.",
+        type=float,
+        default=10,
+    )
+    parser.add_argument(
+        "--prefetch",
+        help="Number of upcoming slider positions to compute in the background.",
+        type=int,
+        default=4,
+    )
     args = parser.parse_args()
 
     main(args)
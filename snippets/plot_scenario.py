@@ -4,24 +4,16 @@ import matplotlib.pyplot as plt
 from matplotlib.widgets import Slider
 import argparse
 from uavdataset import UAVDataset
+from delaydoppler import zoom_transform
+from mapcache import MapCache
+from viewer import MapPrefetcher, SliderPlayer
+from scenario_figure import get_groundtruth, init_fig, update_fig
 matplotlib.use('webagg')
 
 __author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
 __credits__ = "Zhixiang Zhao, Carsten Smeenk"
 __all__ = ["UAVDataset"]
 
-MARKER_STYLE = dict(
-    linestyle="none",
-    markersize=10,
-    marker="o",
-    fillstyle="none",
-    markeredgewidth=1.5,
-    color="none",
-    markerfacecolor="none",
-    markerfacecoloralt="none",
-    markeredgecolor="red",
-)
-    
 # def fft_upsample(x: np.ndarray, factor: int) -> np.ndarray:
 #     x_n, y_n = x.shape
 #     X = np.fft.ifft(np.fft.fft(x, axis=1), axis=0)
@@ -33,51 +25,31 @@ def get_channel(x: np.ndarray, start_idx: int, window_slowtime: int, filter_clut
             "Start index must be smaller than the number of slowtime samples minus the window size.")
         
     x = x[start_idx:start_idx+window_slowtime+1, :]
-    if filter_clutter:
-        x = np.diff(x, n=1, axis=0)
-    
-    t_n, f_n = x.shape 
-    y = np.fft.fft(np.fft.ifft(x, n=f_n*upsample, axis=1), n=t_n*upsample, axis=0)
-    y /= np.linalg.norm(y)
-    y = np.fft.fftshift(y, axes=0)
-    y = y[:, :80*upsample]
-    
-    return y
-
-def get_groundtruth(x: np.ndarray, start_idx: int, window_slowtime: int):
-    if start_idx > x.shape[0] - window_slowtime:
-        raise ValueError(
-            "Start index must be smaller than the number of slowtime samples minus the window size.")
-
-    delay = x[start_idx+window_slowtime//2, 0]
-    doppler = x[start_idx+window_slowtime//2, 1]
-
-    return np.array([delay, doppler])
-
-
-def get_data(channel: np.ndarray, groundtruth: np.ndarray, window_slowtime: int, start_idx: int):
-    channel = get_channel(channel, start_idx, window_slowtime, filter_clutter=True, upsample=2)
+    t_n = x.shape[0] - int(filter_clutter)
+    transform = zoom_transform(t_n, x.shape[1], upsample=upsample, delay_bins=80*upsample, filter_clutter=filter_clutter)
+    return transform(x)
+
+def get_data(channel: np.ndarray, groundtruth: np.ndarray, window_slowtime: int, start_idx: int, cache: MapCache = None, channelfile: str = None):
+    if cache is None:
+        channel = get_channel(channel, start_idx, window_slowtime, filter_clutter=True, upsample=2)
+    else:
+        channel = cache.get_or_compute(
+            (channelfile, start_idx, window_slowtime, True, 2),
+            lambda: get_channel(channel, start_idx, window_slowtime, filter_clutter=True, upsample=2),
+        )
     groundtruth = get_groundtruth(groundtruth, start_idx, window_slowtime)
     return channel, groundtruth
 
-def update_fig(fig: plt.Figure, ax: plt.Axes, channel: np.ndarray, groundtruth: np.ndarray):
-    ax.clear()
-    ax.imshow(20*np.log10(np.abs(channel)), aspect="auto",
-              cmap="inferno", vmin=-60, vmax=0, extent=[0, 1e-6, +1/(2*320e-6), -1/(2*320e-6)])
-    ax.plot(groundtruth[0], groundtruth[1], **MARKER_STYLE)
-    ax.set_xlabel("Delay [$s$]")
-    ax.set_ylabel("Doppler-Shift [Hz]")
-    fig.canvas.draw_idle()
-    return fig, ax
-
-def update(fig: plt.Figure, ax: plt.Axes, channel: np.ndarray, groundtruth: np.ndarray, window_slowtime: int, start_idx: int):
+def update(fig: plt.Figure, artists: tuple, channel: np.ndarray, groundtruth: np.ndarray, window_slowtime: int, start_idx: int, cache: MapCache = None, channelfile: str = None):
     channel_window, groundtruth_window = get_data(
-        channel, groundtruth, window_slowtime, start_idx)
-    update_fig(fig, ax, channel_window, groundtruth_window)
+        channel, groundtruth, window_slowtime, start_idx, cache, channelfile)
+    update_fig(fig, artists, channel_window, groundtruth_window)
     
-def update_all(fig: plt.Figure, ax: list[plt.Axes,], channel: list[np.ndarray,], groundtruth: list[np.ndarray,], window_slowtime: int, start_idx: int):
-    for aa, cc, gg in zip(ax, channel, groundtruth):
-        update(fig, aa, cc, gg, window_slowtime, start_idx)
+def update_all(fig: plt.Figure, artists: list[tuple,], channel: list[np.ndarray,], groundtruth: list[np.ndarray,], window_slowtime: int, start_idx: int, cache: MapCache = None, channelfiles: list[str,] = None):
+    if channelfiles is None:
+        channelfiles = [None] * len(channel)
+    for aa, cc, gg, ff in zip(artists, channel, groundtruth, channelfiles):
+        update(fig, aa, cc, gg, window_slowtime, start_idx, cache, ff)
 
 
 def main(args):
@@ -93,8 +65,13 @@ def main(args):
     groundtruth = [
         d.groundtruth for d in dataset
     ]
+    channelfiles = [
+        d.channelfile for d in dataset
+    ]
+    cache = MapCache(args.cache_mb)
     window_slowtime = args.window
-    num_windows = (len(dataset[0]) - window_slowtime) // window_slowtime
+    # the receivers may differ in length, the slider only covers the windows of all of them
+    num_windows = (min(len(d) for d in dataset) - window_slowtime) // window_slowtime
 
     fig, ax = plt.subplots(
         1, 5,
@@ -102,11 +79,14 @@ def main(args):
         tight_layout=True,
         gridspec_kw={"width_ratios": [0.05, 1, 1, 1, 0.05]},
     )
-    update_all(fig, ax[1:4], channel, groundtruth, window_slowtime, 0)
+    artists = [
+        init_fig(aa, *get_data(cc, gg, window_slowtime, 0, cache, ff))
+        for aa, cc, gg, ff in zip(ax[1:4], channel, groundtruth, channelfiles)
+    ]
     ax[1].set_title("VGH0")
     ax[2].set_title("VGH1")
     ax[3].set_title("VGH2")
-    cbar = plt.colorbar(ax[1].get_images()[0],
+    cbar = plt.colorbar(artists[0][0],
                         cax=ax[-1], orientation="vertical")
     cbar.set_label("Normalized Power [dB]")
     sample_slider = Slider(
@@ -118,9 +98,28 @@ def main(args):
         valstep=1,
         orientation="vertical",
     )
-    sample_slider.on_changed(lambda slider_value: update_all(
-        fig, ax[1:4], channel, groundtruth, window_slowtime, slider_value*window_slowtime))
+
+    channel_by_file = dict(zip(channelfiles, channel))
+    prefetcher = MapPrefetcher(cache, lambda key: get_channel(
+        channel_by_file[key[0]], key[1], key[2], filter_clutter=key[3], upsample=key[4]))
+    player = SliderPlayer(
+        fig, sample_slider,
+        keys=lambda slider_value: [(ff, slider_value*window_slowtime, window_slowtime, True, 2) for ff in channelfiles],
+        prefetcher=prefetcher,
+        fps=args.fps,
+        ahead=args.prefetch,
+    )
+
+    def on_changed(slider_value):
+        update_all(fig, artists, channel, groundtruth, window_slowtime, slider_value*window_slowtime, cache, channelfiles)
+        player.prefetch(slider_value)
+
+    sample_slider.on_changed(on_changed)
+    player.prefetch(sample_slider.val)
     plt.show()
+    prefetcher.close()
+    print(cache)
+    print(player)
 
 
 if __name__ == "__main__":
@@ -137,6 +136,24 @@ if __name__ == "__main__":
         type=int,
         default=100,
     )
+    parser.add_argument(
+        "--cache-mb",
+        help="Memory limit of the delay-Doppler map cache in MB.",
+        type=float,
+        default=256,
+    )
+    parser.add_argument(
+        "--fps",
+        help="Target frame rate of the playback, which is started and paused with the space key.",
+        type=float,
+        default=10,
+    )
+    parser.add_argument(
+        "--prefetch",
+        help="Number of upcoming slider positions to compute in the background.",
+        type=int,
+        default=4,
+    )
     args = parser.parse_args()
 
     main(args)
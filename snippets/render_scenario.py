@@ -0,0 +1,215 @@
+import argparse
+import glob
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+from tqdm.auto import tqdm
+from uavdataset import UAVDataset
+from delaydoppler import DelayDopplerEngine
+from scenario_figure import get_groundtruth, init_fig, update_fig
+matplotlib.use('agg')
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["render_frames", "render_scenario"]
+
+RXS = ["VGH0", "VGH1", "VGH2"]
+
+# state of each worker process, the figure is created once and reused for every frame
+_worker = {}
+
+
+def _init_worker(data_dir: str, window_slowtime: int, dpi: int) -> None:
+    fig, ax = plt.subplots(
+        1, 4,
+        figsize=(16, 5),
+        tight_layout=True,
+        gridspec_kw={"width_ratios": [1, 1, 1, 0.05]},
+    )
+    _worker.update(
+        data_dir=data_dir,
+        window_slowtime=window_slowtime,
+        dpi=dpi,
+        fig=fig,
+        ax=ax,
+        artists=None,
+        datasets={},
+    )
+
+
+def _get_datasets(scenario: str) -> list:
+    datasets = _worker["datasets"]
+    if scenario not in datasets:
+        for dataset in datasets.values():
+            for d in dataset:
+                d.close()
+        datasets.clear()
+        datasets[scenario] = [
+            UAVDataset(
+                os.path.join(_worker["data_dir"], f"{scenario}_{rx}_channel.h5"),
+                lazy=True,
+            ) for rx in RXS
+        ]
+    return datasets[scenario]
+
+
+def render_frames(scenario: str, starts: np.ndarray, out_dir: str) -> int:
+    """Renders the frames of one scenario with the figure of the current worker process
+
+    Args:
+        scenario (str): The scenario name, e.g. `1to2_H15_V11`
+        starts (np.ndarray): The slow-time start index of each frame, equally spaced by the hop of the frames
+        out_dir (str): The directory for the PNG files, named `frame_<start>.png`
+
+    Returns:
+        int: The number of rendered frames
+    """
+    fig, ax = _worker["fig"], _worker["ax"]
+    window_slowtime = _worker["window_slowtime"]
+    datasets = _get_datasets(scenario)
+    hop = int(starts[1] - starts[0]) if len(starts) > 1 else window_slowtime
+    # same maps as `get_channel` in `plot_scenario.py`
+    engine = DelayDopplerEngine(window_slowtime, hop=hop, filter_clutter=True, upsample=2, delay_bins=160, zoom=True)
+    first, last = int(starts[0]), int(starts[-1])
+
+    maps = [engine.compute(d.channel, first, last + engine.span)[1] for d in datasets]
+    groundtruth = [d.groundtruth[first:last + window_slowtime] for d in datasets]
+    num_frames = min(len(mm) for mm in maps)
+
+    for i, start in enumerate(starts[:num_frames]):
+        frame_gt = [get_groundtruth(gt, i*hop, window_slowtime) for gt in groundtruth]
+        if _worker["artists"] is None:
+            _worker["artists"] = [init_fig(aa, mm[i], gg) for aa, mm, gg in zip(ax[:3], maps, frame_gt)]
+            for aa, rx in zip(ax[:3], RXS):
+                aa.set_title(rx)
+            cbar = plt.colorbar(_worker["artists"][0][0], cax=ax[-1], orientation="vertical")
+            cbar.set_label("Normalized Power [dB]")
+            _worker["title"] = fig.suptitle(f"{scenario} - Slow-Time Index {start}")
+            # the layout does not change between frames, so it is only computed once
+            fig.canvas.draw()
+            fig.set_layout_engine("none")
+        else:
+            for artists, mm, gg in zip(_worker["artists"], maps, frame_gt):
+                update_fig(fig, artists, mm[i], gg, draw=False)
+            _worker["title"].set_text(f"{scenario} - Slow-Time Index {start}")
+        fig.savefig(os.path.join(out_dir, f"frame_{start:08d}.png"), dpi=_worker["dpi"], pil_kwargs={"compress_level": 1})
+
+    return num_frames
+
+
+def render_scenario(scenario: str, args, pool: ProcessPoolExecutor, progress: tqdm) -> str:
+    """Renders all windows of a scenario in the process pool and optionally encodes them as a video
+
+    The frames of earlier runs are removed first, so the sequence and the video only contain the frames of this run.
+
+    Returns:
+        str: The directory with the PNG sequence
+    """
+    out_dir = os.path.join(args.output_dir, scenario)
+    os.makedirs(out_dir, exist_ok=True)
+    for frame in glob.glob(os.path.join(out_dir, "frame_*.png")):
+        os.remove(frame)
+
+    lengths = []
+    for rx in RXS:
+        with UAVDataset(os.path.join(args.data_dir, f"{scenario}_{rx}_channel.h5"), lazy=True) as dataset:
+            lengths.append(len(dataset))
+    engine = DelayDopplerEngine(args.window, hop=args.hop, filter_clutter=True)
+    starts = engine.starts(min(lengths))
+    progress.total = (progress.total or 0) + len(starts)
+    progress.refresh()
+
+    futures = [
+        pool.submit(render_frames, scenario, starts[idx:idx + args.chunk], out_dir)
+        for idx in range(0, len(starts), args.chunk)
+    ]
+    for future in futures:
+        progress.update(future.result())
+
+    if args.video:
+        video = os.path.join(args.output_dir, f"{scenario}.mp4")
+        subprocess.run(
+            ["ffmpeg", "-y", "-loglevel", "error", "-framerate", str(args.fps), "-pattern_type", "glob",
+             "-i", os.path.join(out_dir, "frame_*.png"), "-c:v", "libx264", "-pix_fmt", "yuv420p", video],
+            check=True,
+        )
+
+    return out_dir
+
+
+def load_scenarios(shasum_file: str) -> list:
+    """Returns the scenario names (without receiver) listed in a `scenarios.checksum` file"""
+    scenarios = []
+    with open(shasum_file) as file:
+        for line in file:
+            name = line.rstrip().split("  ")[-1]
+            if name.endswith(f"_{RXS[0]}_channel.h5"):
+                scenarios.append(name.split(f"_{RXS[0]}_channel.h5")[0])
+    return scenarios
+
+
+def main(args):
+    if args.scenario is None:
+        args.scenario = load_scenarios(args.shasum_file)
+    if args.hop is None:
+        args.hop = args.window
+
+    with ProcessPoolExecutor(
+        max_workers=args.jobs,
+        initializer=_init_worker,
+        initargs=(args.data_dir, args.window, args.dpi),
+    ) as pool, tqdm(unit="frame") as progress:
+        for scenario in args.scenario:
+            progress.set_description(scenario)
+            render_scenario(scenario, args, pool, progress)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Renders the delay-Doppler maps of all three receivers of whole scenarios to PNG sequences or videos."
+    )
+    parser.add_argument(
+        "-s", "--scenario", help="Scenario names, separated by spaces. If none is given, all scenarios in the shasum file are rendered.", nargs="+",
+    )
+    parser.add_argument(
+        "--shasum-file",
+        help="Path to the `scenarios.checksum` file. Defaults to `$cwd/scenarios.checksum`.",
+        default=os.path.join(os.getcwd(), "scenarios.checksum"),
+    )
+    parser.add_argument(
+        "--data-dir", help="Directory of the `*.h5` files. Default is the current working directory.", default=os.getcwd(),
+    )
+    parser.add_argument(
+        "--output-dir", help="Output directory, each scenario gets its own subdirectory of frames.", default="renders",
+    )
+    parser.add_argument(
+        "-w",
+        "--window",
+        help="Length of the slow time window.",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "--hop", help="Slow time samples between two frames. Defaults to the window length.", type=int, default=None,
+    )
+    parser.add_argument(
+        "-j", "--jobs", help="Number of worker processes. Defaults to the number of CPUs.", type=int, default=None,
+    )
+    parser.add_argument(
+        "--chunk", help="Number of consecutive frames per task.", type=int, default=32,
+    )
+    parser.add_argument(
+        "--dpi", help="Resolution of the frames.", type=int, default=100,
+    )
+    parser.add_argument(
+        "--video", help="Encode each PNG sequence into an mp4 video with ffmpeg.", action="store_true",
+    )
+    parser.add_argument(
+        "--fps", help="Frame rate of the video.", type=float, default=25,
+    )
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,46 @@
+import numpy as np
+import matplotlib.pyplot as plt
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["MARKER_STYLE", "get_groundtruth", "init_fig", "update_fig"]
+
+# Backend-neutral figure helpers, shared by the interactive `plot_scenario.py` and the headless `render_scenario.py`
+
+MARKER_STYLE = dict(
+    linestyle="none",
+    markersize=10,
+    marker="o",
+    fillstyle="none",
+    markeredgewidth=1.5,
+    color="none",
+    markerfacecolor="none",
+    markerfacecoloralt="none",
+    markeredgecolor="red",
+)
+
+def get_groundtruth(x: np.ndarray, start_idx: int, window_slowtime: int):
+    if start_idx > x.shape[0] - window_slowtime:
+        raise ValueError(
+            "Start index must be smaller than the number of slowtime samples minus the window size.")
+
+    delay = x[start_idx+window_slowtime//2, 0]
+    doppler = x[start_idx+window_slowtime//2, 1]
+
+    return np.array([delay, doppler])
+
+def init_fig(ax: plt.Axes, channel: np.ndarray, groundtruth: np.ndarray):
+    image = ax.imshow(20*np.log10(np.abs(channel)), aspect="auto",
+                      cmap="inferno", vmin=-60, vmax=0, extent=[0, 1e-6, +1/(2*320e-6), -1/(2*320e-6)])
+    marker, = ax.plot(groundtruth[0], groundtruth[1], **MARKER_STYLE)
+    ax.set_xlabel("Delay [$s$]")
+    ax.set_ylabel("Doppler-Shift [Hz]")
+    return image, marker
+
+def update_fig(fig: plt.Figure, artists: tuple, channel: np.ndarray, groundtruth: np.ndarray, draw: bool = True):
+    image, marker = artists
+    image.set_data(20*np.log10(np.abs(channel)))
+    marker.set_data([groundtruth[0]], [groundtruth[1]])
+    if draw:
+        fig.canvas.draw_idle()
+    return fig, artists
@@ -0,0 +1,200 @@
+from contextlib import contextmanager
+import hashlib
+import os
+import tempfile
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["SharedArray", "shared_name"]
+
+HEADER = np.dtype([("refcount", np.int64), ("ready", np.int64)])
+"""The header in front of the array data, holds the number of attached users"""
+
+
+def shared_name(path: str) -> str:
+    """Returns the shared memory name of a file, changes when the file is modified"""
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return "uav_" + hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def _lock_file(file) -> None:
+    if fcntl is not None:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        return
+    file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            # `LK_LOCK` gives up after 10 seconds
+            pass
+
+
+def _unlock_file(file) -> None:
+    if fcntl is not None:
+        fcntl.flock(file, fcntl.LOCK_UN)
+        return
+    file.seek(0)
+    msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def _locked(name: str):
+    # serializes creation, attach and detach of a segment across processes, yields the path of the lock file
+    path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+    while True:
+        lock = open(path, "a")
+        _lock_file(lock)
+        try:
+            if os.path.samestat(os.fstat(lock.fileno()), os.stat(path)):
+                break
+        except FileNotFoundError:
+            pass
+        # the last user removed the lock file while this process waited for it
+        _unlock_file(lock)
+        lock.close()
+    try:
+        yield path
+    finally:
+        _unlock_file(lock)
+        lock.close()
+
+
+def _open_segment(name: str, size: int = 0) -> shared_memory.SharedMemory:
+    create = size > 0
+    try:
+        shm = shared_memory.SharedMemory(name, create=create, size=size, track=False)
+    except TypeError:
+        # before Python 3.13, every process registers the segment with its resource tracker, which unlinks it
+        # when *that* process exits, while others are still attached. The reference count decides instead.
+        shm = shared_memory.SharedMemory(name, create=create, size=size)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        shm._untracked = True
+    return shm
+
+
+def _unlink(shm: shared_memory.SharedMemory, lock_path: str) -> None:
+    # only called by the last user, while holding the lock
+    if getattr(shm, "_untracked", False):
+        # `unlink` unregisters the segment again
+        resource_tracker.register(shm._name, "shared_memory")
+    shm.unlink()
+    try:
+        os.remove(lock_path)
+    except OSError:
+        # Windows does not remove open files
+        pass
+
+    return
+
+
+def _detach(shm: shared_memory.SharedMemory, name: str, pid: int) -> None:
+    if pid != os.getpid():
+        # forked children share the mapping of their parent, only the parent detaches
+        return
+
+    with _locked(name) as lock_path:
+        header = np.ndarray((), HEADER, buffer=shm.buf)
+        header["refcount"] -= 1
+        last = header["refcount"] <= 0
+        del header
+        try:
+            shm.close()
+        except BufferError:
+            # views of the array are still alive, the mapping is released together with them
+            pass
+        if last:
+            _unlink(shm, lock_path)
+
+    return
+
+
+class SharedArray:
+    def __init__(self, name: str, shape: tuple, dtype: np.dtype, load):
+        """Read-only array in shared memory, loaded once and attached by name by all other processes
+
+        The first user creates the segment and fills it in place with `load(out)`, all others attach to the existing segment.
+        A reference count in the header of the segment is updated under a file lock, the last user to `close`
+        unlinks the segment and removes the lock file. If `load` fails, the unused segment is unlinked again.
+        Processes that are killed without closing leave the segment until the next reboot (or until it is removed
+        from `/dev/shm`).
+
+        Args:
+            name (str): The name of the segment, e.g. from `shared_name`
+            shape (tuple): The shape of the array
+            dtype (np.dtype): The dtype of the array
+            load (callable): Function that writes the array into the writeable segment view `out`, only called by the process that creates the segment
+
+        """
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.created = False
+        self._pid = os.getpid()
+
+        nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        with _locked(name) as lock_path:
+            try:
+                self._shm = _open_segment(name)
+            except FileNotFoundError:
+                self._shm = _open_segment(name, HEADER.itemsize + max(nbytes, 1))
+                self.created = True
+            header = np.ndarray((), HEADER, buffer=self._shm.buf)
+            try:
+                if self.created or not header["ready"]:
+                    # a previous creator may have died before the array was loaded
+                    load(self._array(writeable=True))
+                    header["ready"] = 1
+            except BaseException:
+                unused = header["refcount"] <= 0
+                del header
+                self._shm.close()
+                if unused:
+                    # nobody is attached to the unloaded segment
+                    _unlink(self._shm, lock_path)
+                raise
+            header["refcount"] += 1
+            del header
+
+        self.array = self._array()
+        # also detaches at interpreter exit, e.g. in DataLoader workers
+        self._finalizer = weakref.finalize(self, _detach, self._shm, name, self._pid)
+
+        return
+
+    def _array(self, writeable: bool = False) -> np.ndarray:
+        array = np.ndarray(self.shape, self.dtype, buffer=self._shm.buf, offset=HEADER.itemsize)
+        array.flags.writeable = writeable
+        return array
+
+    @property
+    def refcount(self) -> int:
+        return int(np.ndarray((), HEADER, buffer=self._shm.buf)["refcount"])
+
+    def close(self) -> None:
+        """Detaches from the segment and unlinks it if this was the last user. Views of `array` must not be used afterwards."""
+        self.array = None
+        self._finalizer()
+
+        return
+
+    def __getstate__(self) -> dict:
+        raise TypeError("SharedArray cannot be pickled, pickle the owning UAVDataset to attach by name instead.")
+
+    def __enter__(self) -> "SharedArray":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
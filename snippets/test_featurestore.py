@@ -0,0 +1,32 @@
+import numpy as np
+import h5py
+import pytest
+from uavdataset import H5_CDATA, H5_TARGET_DELAY, H5_TARGET_DOPPLER, H5_TXANTENNA, H5_RXANTENNA
+from delaydoppler import DelayDopplerEngine
+from featurestore import H5_MAPS, build_entry
+
+
+def write_channel(path, t_bins: int = 250, f_bins: int = 64) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    x = (rng.standard_normal((t_bins, f_bins)) + 1j*rng.standard_normal((t_bins, f_bins))).astype(np.complex64)
+    with h5py.File(path, "w") as h5_channel:
+        h5_channel[H5_CDATA] = x[..., None]
+        h5_channel[H5_TARGET_DELAY] = rng.random((t_bins, 1))
+        h5_channel[H5_TARGET_DOPPLER] = rng.random((t_bins, 1))
+        h5_channel[H5_TXANTENNA] = rng.random((t_bins, 3))
+        h5_channel[H5_RXANTENNA] = rng.random((t_bins, 3))
+    return x
+
+
+@pytest.mark.parametrize("zoom", [False, True])
+def test_build_entry_caps_delay_bins(tmp_path, zoom):
+    # more delay bins than the 64*2 bins of the upsampled IFFT
+    x = write_channel(tmp_path / "S_VGH0_channel.h5")
+    engine = DelayDopplerEngine(100, filter_clutter=True, upsample=2, delay_bins=160, zoom=zoom)
+    out_file = str(tmp_path / "entry.h5")
+
+    assert build_entry(str(tmp_path / "S_VGH0_channel.h5"), out_file, engine, "complex", {}) == 2
+    with h5py.File(out_file, "r") as h5_entry:
+        maps = h5_entry[H5_MAPS][:]
+    assert maps.shape == (2, 200, 128)
+    np.testing.assert_allclose(maps, engine.compute(x)[1], rtol=1e-4, atol=1e-6)
@@ -1,111 +1,550 @@
-import h5py
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
 import numpy as np
-from dataclasses import dataclass, field
+import h5py
 import torch
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, Sampler, default_collate
+# For an explanation of the HDF5 layout, see the PDF description in the repository
+from uavdataset import (
+    UAVDataset,
+    H5_CDATA,
+    H5_TARGET_DELAY,
+    H5_TARGET_DOPPLER,
+    H5_TXANTENNA,
+    H5_RXANTENNA,
+    H5_UAVPOSITIONS,
+    NPY_FILES,
+)
 
 __author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
 __credits__ = "Zhixiang Zhao, Carsten Smeenk"
-__all__ = ["UAVDataset", "TorchDataset"]
-
-# For an explanation of the following, see the PDF description in the repository
-H5_CDATA = "Channel/FrequencyResponses/Data"
-H5_TARGET_DELAY = "TargetParameters/Delay/Data"
-H5_TARGET_DOPPLER = "TargetParameters/Doppler/Data"
-H5_TXANTENNA = "AntennaPositions/PositionTx/Data"
-H5_RXANTENNA = "AntennaPositions/PositionRx/Data"
-H5_UAVPOSITIONS = "Positions/Data"
-
-@dataclass
-class UAVDataset:
-    channelfile: str
-    """The path to the channel file"""
-    targetfile: str = None
-    """The path to the target file"""
-    channel: np.ndarray = field(init=False)
-    """Property to store the channel data as a numpy array"""
-    groundtruth: np.ndarray = field(init=False)
-    """Property to store the delay and Doppler groundtruth of the UAV as a numpy array"""
-    tx: np.ndarray = field(init=False)
-    """Property to store the transmitter antenna positions as a numpy array"""
-    rx: np.ndarray = field(init=False)
-    """Property to store the receiver antenna positions as a numpy array"""
-    uav: np.ndarray = field(init=False)
-    """Property to store the UAV positions as a numpy array"""
-    
-    def __post_init__(self) -> None:
-        # load channel, positions
-        h5_channel = h5py.File(self.channelfile, "r")
-        self.channel = np.array(h5_channel[H5_CDATA]).view(np.complex64).squeeze()
-        self.groundtruth = np.concatenate(
-            (
-                np.array(h5_channel[H5_TARGET_DELAY]),
-                np.array(h5_channel[H5_TARGET_DOPPLER]),
-            ),
-            axis=1,
-        )
-        self.tx = np.array(h5_channel[H5_TXANTENNA]).view(np.float64).squeeze()
-        self.rx = np.array(h5_channel[H5_RXANTENNA]).view(np.float64).squeeze()
-        
-        if self.targetfile is not None:
-            h5_target = h5py.File(self.targetfile, "r")
-            self.uav = np.array(h5_target[H5_UAVPOSITIONS]).view(np.float64).squeeze()
-        
+__all__ = [
+    "UAVDataset",
+    "TorchDataset",
+    "CorpusDataset",
+    "MultiReceiverDataset",
+    "FeatureDataset",
+    "ClusteredRandomSampler",
+    "read_windows",
+    "collate_batch",
+    "delay_doppler_torch",
+    "DelayDopplerCollate",
+    "load_recordings",
+]
+
+RXS = ["VGH0", "VGH1", "VGH2"]
+
+
+def read_windows(channel, starts: np.ndarray, t_window: int, out: np.ndarray = None) -> np.ndarray:
+    """Reads many slow-time windows with as few contiguous reads as possible
+
+    The starts are sorted and overlapping or adjacent windows are merged into runs, each run is read with a single
+    slice of `channel` (which may be a lazy `UAVDataset.channel`) and its windows are copied into `out`.
+
+    Args:
+        channel (np.ndarray): The channel with shape (t_bins, f_bins)
+        starts (np.ndarray): The start index of each window
+        t_window (int): The length of the slow-time window
+        out (np.ndarray, optional): The array to write to, with shape (len(starts), t_window, f_bins). Defaults to None.
+
+    Returns:
+        np.ndarray: The windows in the order of `starts`
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    if out is None:
+        out = np.empty((len(starts), t_window) + tuple(channel.shape[1:]), dtype=channel.dtype)
+    if len(starts) == 0:
+        return out
+
+    order = np.argsort(starts, kind="stable")
+    sorted_starts = starts[order]
+    # a new run begins where a window starts after the end of the previous one
+    breaks = np.flatnonzero(sorted_starts[1:] > sorted_starts[:-1] + t_window) + 1
+    for run in np.split(np.arange(len(starts)), breaks):
+        first = sorted_starts[run[0]]
+        rows = channel[first: sorted_starts[run[-1]] + t_window]
+        for i in run:
+            offset = sorted_starts[i] - first
+            out[order[i]] = rows[offset: offset + t_window]
+
+    return out
+
+
+def collate_batch(batch):
+    """Pass-through `collate_fn` for datasets whose `__getitems__` already returns whole batches"""
+    return batch
+
+
+def delay_doppler_torch(x: torch.Tensor, filter_clutter: bool = False, upsample: int = 1, delay_bins: int = None) -> torch.Tensor:
+    """Torch version of `delay_doppler.delay_doppler`, computes the normalized maps of a batch of windows at once
+
+    Args:
+        x (torch.Tensor): The windows with shape (..., t_bins, f_bins)
+        filter_clutter (bool, optional): Whether to apply the first-order difference along slow-time. Defaults to False.
+        upsample (int, optional): The zero-padding factor of both FFTs. Defaults to 1.
+        delay_bins (int, optional): The number of delay bins to keep. Defaults to None (all).
+
+    Returns:
+        torch.Tensor: The maps with shape (..., t_bins*upsample, delay_bins), where t_bins is counted after the clutter filter
+    """
+    if filter_clutter:
+        x = torch.diff(x, n=1, dim=-2)
+
+    t_n, f_n = x.shape[-2:]
+    # the norm of the real view is much faster than the complex norm on CPU
+    norm = torch.linalg.vector_norm(torch.view_as_real(x), dim=(-3, -2, -1))
+    norm = (t_n / f_n) ** 0.5 * norm.reshape(norm.shape + (1, 1))
+
+    y = torch.fft.ifft(x, n=f_n*upsample, dim=-1)
+    if delay_bins is not None:
+        y = y[..., :delay_bins]
+    y = torch.fft.fft(y, n=t_n*upsample, dim=-2)
+    y = torch.fft.fftshift(y / norm, dim=-2)
+
+    return y
+
+
+class DelayDopplerCollate:
+    def __init__(self, filter_clutter: bool = False, upsample: int = 1, delay_bins: int = None, output: str = "complex", collate_fn=default_collate, device: torch.device = None):
+        """`collate_fn` that replaces the channel windows of a batch by their delay-Doppler maps
+
+        The maps of the whole batch are computed at once with `delay_doppler_torch`, i.e. the same maps as
+        `get_channel` in `plot_receiver.py`. The remaining entries of the batch (groundtruth, positions) are unchanged.
+
+        Args:
+            filter_clutter (bool, optional): Whether to apply the first-order difference along slow-time. Defaults to False.
+            upsample (int, optional): The zero-padding factor of both FFTs. Defaults to 1.
+            delay_bins (int, optional): The number of delay bins to keep. Defaults to None (all).
+            output (str, optional): `complex` maps, their `magnitude`, or their power in `db`. Defaults to "complex".
+            collate_fn (callable, optional): The collate function that builds the batch, e.g. `collate_batch` for batched datasets. Defaults to `default_collate`.
+            device (torch.device, optional): The device to compute the maps on, e.g. in the main process. Defaults to None (the device of the batch).
+
+        """
+        if output not in ("complex", "magnitude", "db"):
+            raise ValueError(f"Unknown output { output }, expected complex, magnitude or db.")
+        self.filter_clutter = filter_clutter
+        self.upsample = upsample
+        self.delay_bins = delay_bins
+        self.output = output
+        self.collate_fn = collate_fn
+        self.device = device
+
         return
 
-    def __str__(self) -> str:
-        return f"""
-           ---- Dataset Summary ----           
-           Channel: \t\t{self.channel.shape}
-           Groundtruth: \t{self.groundtruth.shape}
-           Antenna Positions: \t{'Loaded' if self.tx is not None else 'Not Loaded'}
-           UAV Positions: \t{'Loaded' if self.uav is not None else 'Not Loaded'}
-           
-           From Files: 
-           \t - Channel: {self.channelfile}
-           \t - Target: {self.targetfile}
-           """
+    def transform(self, x: torch.Tensor) -> torch.Tensor:
+        """Computes the maps of a batch of windows with shape (..., t_bins, f_bins)"""
+        if self.device is not None:
+            x = x.to(self.device, non_blocking=True)
+        y = delay_doppler_torch(x, self.filter_clutter, self.upsample, self.delay_bins)
+        if self.output == "magnitude":
+            return y.abs()
+        if self.output == "db":
+            return 20*torch.log10(y.abs())
+        return y
+
+    def __call__(self, batch):
+        batch = self.collate_fn(batch)
+        return (self.transform(batch[0]),) + tuple(batch[1:])
+
 
 class TorchDataset(Dataset):
-    def __init__(self, dataset: UAVDataset, t_window: int = 100, return_uavpos: bool = False):
+    def __init__(self, dataset: UAVDataset, t_window: int = 100, return_uavpos: bool = False, batched: bool = False, transform=None):
         """Torch Dataset for UAV Channel Data
 
+        The DataLoader fetches a batch with `__getitems__`, which reads the windows of all indices with coalesced reads
+        (see `read_windows`). With `batched=True`, the windows are written directly into one preallocated batch tensor
+        and the batch is returned as is, so the DataLoader needs `collate_fn=collate_batch`.
+        The dataset runs in the DataLoader workers, so it never allocates pinned memory itself (that would initialize
+        CUDA in forked workers). Use `DataLoader(pin_memory=True)` instead, which pins the batches in the main process.
+
         Args:
             dataset (UAVDataset): An instance of `UAVDataset`
             t_window (int, optional): The length of the slow-time window. Defaults to 100.
             return_uavpos (bool, optional): Whether to return the RTK UAV position. Defaults to False.
+            batched (bool, optional): Whether `__getitems__` returns whole batches instead of a list of samples. Defaults to False.
+            transform (callable, optional): Applied to the channel windows, e.g. `Normalize` of `normalization.py`. Defaults to None.
 
         """        
         self.dataset = dataset
         self.t_window = t_window
         self.return_uavpos = return_uavpos
+        self.batched = batched
+        self.transform = transform
         
         if return_uavpos and self.dataset.uav is None:
             raise ValueError("UAV Positions not loaded!")
         
         return
     
+    def _transform(self, channel: torch.Tensor) -> torch.Tensor:
+        return channel if self.transform is None else self.transform(channel)
+
     def __getitem__(self, idx: int) -> [torch.Tensor, torch.Tensor]:
         if self.return_uavpos:
             return (
-                torch.from_numpy(self.dataset.channel[idx: idx + self.t_window]), 
+                self._transform(torch.from_numpy(self.dataset.channel[idx: idx + self.t_window])), 
                 torch.from_numpy(self.dataset.groundtruth[idx + self.t_window // 2]),
                 torch.from_numpy(self.dataset.uav[idx + self.t_window // 2])
             )
         else:
             return (
-                torch.from_numpy(self.dataset.channel[idx: idx + self.t_window]), 
+                self._transform(torch.from_numpy(self.dataset.channel[idx: idx + self.t_window])), 
                 torch.from_numpy(self.dataset.groundtruth[idx + self.t_window // 2]),
             )
+
+    def __getitems__(self, indices: list):
+        starts = np.asarray(indices, dtype=np.int64)
+        centers = starts + self.t_window // 2
+
+        if self.batched:
+            channel = torch.empty(
+                (len(starts), self.t_window) + tuple(self.dataset.channel.shape[1:]),
+                dtype=torch.complex64,
+            )
+            read_windows(self.dataset.channel, starts, self.t_window, channel.numpy())
+            batch = (self._transform(channel), torch.from_numpy(np.asarray(self.dataset.groundtruth[centers])))
+            if self.return_uavpos:
+                batch += (torch.from_numpy(np.asarray(self.dataset.uav[centers])),)
+            return batch
+
+        channel = self._transform(torch.from_numpy(read_windows(self.dataset.channel, starts, self.t_window)))
+        groundtruth = torch.from_numpy(np.asarray(self.dataset.groundtruth[centers]))
+        if self.return_uavpos:
+            uav = torch.from_numpy(np.asarray(self.dataset.uav[centers]))
+            return [(channel[i], groundtruth[i], uav[i]) for i in range(len(starts))]
+        return [(channel[i], groundtruth[i]) for i in range(len(starts))]
     
     def __len__(self) -> int:
-        return len(self.dataset)- self.t_window//2
+        # only windows that lie completely inside the recording
+        return max(len(self.dataset) - self.t_window + 1, 0)
     
     def __str__(self) -> str:
         return str(self.dataset)
+
+
+class ClusteredRandomSampler(Sampler):
+    def __init__(self, data_source, cluster_size: int = 64, generator: torch.Generator = None):
+        """Random sampler that draws shuffled, but locally clustered window starts
+
+        The indices are split into clusters of `cluster_size` consecutive window starts. Every epoch, the order of the
+        clusters and the order within each cluster are shuffled. The indices of a batch then mostly come from the
+        same cluster, so their windows overlap and are read with few contiguous reads (see `read_windows`).
+
+        Args:
+            data_source (Dataset): The dataset to sample from
+            cluster_size (int, optional): The number of consecutive window starts per cluster. Defaults to 64.
+            generator (torch.Generator, optional): The random number generator. Defaults to None.
+
+        """
+        self.data_source = data_source
+        self.cluster_size = cluster_size
+        self.generator = generator
+
+        return
+
+    def __iter__(self):
+        n = len(self.data_source)
+        num_clusters = -(-n // self.cluster_size)
+        for cluster in torch.randperm(num_clusters, generator=self.generator).tolist():
+            start = cluster * self.cluster_size
+            size = min(self.cluster_size, n - start)
+            yield from (start + torch.randperm(size, generator=self.generator)).tolist()
+
+    def __len__(self) -> int:
+        return len(self.data_source)
+
+
+def load_recordings(shasum_file: str) -> list:
+    """Returns the recording names (scenario and receiver, e.g. `1to2_H15_V11_VGH0`) listed in a `scenarios.checksum` file"""
+    recordings = []
+    with open(shasum_file) as file:
+        for line in file:
+            name = line.rstrip().split("  ")[-1]
+            if name.endswith("_channel.h5"):
+                recordings.append(name.split("_channel.h5")[0])
+    return recordings
+
+
+class CorpusDataset(Dataset):
+    def __init__(self, data_dir: str, recordings: list = None, shasum_file: str = None, t_window: int = 100, hop: int = 1, return_uavpos: bool = False, max_open: int = 64):
+        """Torch Dataset over the windows of many recordings (scenarios and receivers)
+
+        Only the number of snapshots of each recording is read on construction. The windows are addressed by a global
+        index with cumulative offsets per recording, which is mapped to (recording, start) by a binary search.
+        The files are opened lazily by each DataLoader worker on first access, at most `max_open` at once.
+
+        Args:
+            data_dir (str): The directory of the `*_channel.h5` and `*_target.h5` files
+            recordings (list, optional): The recording names, e.g. `1to2_H15_V11_VGH0`. Defaults to None (all in `shasum_file`).
+            shasum_file (str, optional): The `scenarios.checksum` file. Defaults to None (`data_dir/scenarios.checksum`).
+            t_window (int, optional): The length of the slow-time window. Defaults to 100.
+            hop (int, optional): The slow-time samples between two window starts. Defaults to 1.
+            return_uavpos (bool, optional): Whether to return the RTK UAV position. Defaults to False.
+            max_open (int, optional): The maximum number of recordings kept open per process. Defaults to 64.
+
+        """
+        if recordings is None:
+            recordings = load_recordings(shasum_file or os.path.join(data_dir, "scenarios.checksum"))
+        self.data_dir = data_dir
+        self.recordings = list(recordings)
+        self.t_window = t_window
+        self.hop = hop
+        self.return_uavpos = return_uavpos
+        self.max_open = max_open
+
+        lengths = []
+        for name in self.recordings:
+            with h5py.File(self._channelfile(name), "r") as h5_channel:
+                lengths.append(h5_channel[H5_CDATA].shape[0])
+        self.lengths = np.array(lengths, dtype=np.int64)
+        windows = np.maximum((self.lengths - t_window) // hop + 1, 0)
+        self.offsets = np.concatenate(([0], np.cumsum(windows)))
+
+        self._datasets = OrderedDict()
+        self._pid = os.getpid()
+
+        return
+
+    def _channelfile(self, name: str) -> str:
+        return os.path.join(self.data_dir, f"{name}_channel.h5")
+
+    def _targetfile(self, name: str) -> str:
+        return os.path.join(self.data_dir, f"{name}_target.h5")
+
+    def locate(self, idx: int) -> tuple:
+        """Maps a global window index to the recording index and the slow-time start of the window"""
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Index { idx } out of range for { len(self) } windows.")
+        recording = int(np.searchsorted(self.offsets, idx, side="right")) - 1
+        return recording, int(idx - self.offsets[recording]) * self.hop
+
+    def dataset(self, recording: int) -> UAVDataset:
+        """Returns the lazy `UAVDataset` of a recording, opened once per process"""
+        if self._pid != os.getpid():
+            # HDF5 handles inherited from a forked parent must not be used
+            self._datasets = OrderedDict()
+            self._pid = os.getpid()
+
+        dataset = self._datasets.get(recording)
+        if dataset is None:
+            name = self.recordings[recording]
+            dataset = UAVDataset(
+                self._channelfile(name),
+                self._targetfile(name) if self.return_uavpos else None,
+                lazy=True,
+            )
+            self._datasets[recording] = dataset
+            if len(self._datasets) > self.max_open:
+                _, evicted = self._datasets.popitem(last=False)
+                evicted.close()
+        else:
+            self._datasets.move_to_end(recording)
+
+        return dataset
+
+    def __getitem__(self, idx: int) -> [torch.Tensor, torch.Tensor]:
+        recording, start = self.locate(idx)
+        dataset = self.dataset(recording)
+        center = start + self.t_window // 2
+        sample = (
+            torch.from_numpy(dataset.channel[start: start + self.t_window]),
+            torch.from_numpy(dataset.groundtruth[center]),
+        )
+        if self.return_uavpos:
+            sample += (torch.from_numpy(dataset.uav[center]),)
+        return sample
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def __getstate__(self) -> dict:
+        # every worker opens its own handles
+        state = self.__dict__.copy()
+        state["_datasets"] = OrderedDict()
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._pid = os.getpid()
+
+    def __str__(self) -> str:
+        return f"""
+           ---- Corpus Summary ----
+           Recordings: \t{len(self.recordings)}
+           Snapshots: \t\t{self.lengths.sum()}
+           Windows: \t\t{len(self)} (t_window={self.t_window}, hop={self.hop})
+           Open Files: \t{len(self._datasets)}
+           """
     
 
+class MultiReceiverDataset(Dataset):
+    def __init__(self, data_dir: str, scenario: str, t_window: int = 100, return_uavpos: bool = False, rxs: list = RXS, truncate: bool = False, parallel: bool = None):
+        """Torch Dataset with the synchronized windows of all receivers of one scenario
+
+        The recordings of the receivers share the slow-time axis, so a window is read from the same snapshots of every
+        receiver. Their lengths are checked on construction: by default, differing lengths raise a `ValueError`,
+        with `truncate=True` all receivers are cut to the shortest recording.
+        The windows are written into one preallocated array instead of being stacked.
+        A receiver converted with `convert.py --format npy` (a `<scenario>_<rx>_npy` directory in `data_dir`) is
+        memory-mapped instead of reading its HDF5 files. With `parallel=True`, the receivers are read by a thread pool,
+        which only overlaps the reads of memory-mapped receivers, HDF5 reads are serialized by the global lock of h5py.
+
+        Args:
+            data_dir (str): The directory of the `*_channel.h5` and `*_target.h5` files or `*_npy` directories
+            scenario (str): The scenario name, e.g. `1to2_H15_V11`
+            t_window (int, optional): The length of the slow-time window. Defaults to 100.
+            return_uavpos (bool, optional): Whether to return the RTK UAV position. Defaults to False.
+            rxs (list, optional): The receivers. Defaults to `["VGH0", "VGH1", "VGH2"]`.
+            truncate (bool, optional): Whether to cut all receivers to the shortest recording. Defaults to False.
+            parallel (bool, optional): Whether to read the receivers in parallel threads. Defaults to None (only if all receivers are memory-mapped).
+
+        """
+        self.data_dir = data_dir
+        self.scenario = scenario
+        self.t_window = t_window
+        self.return_uavpos = return_uavpos
+        self.rxs = list(rxs)
+
+        shapes = []
+        for rx in self.rxs:
+            if os.path.isdir(self._npydir(rx)):
+                shapes.append(np.load(os.path.join(self._npydir(rx), NPY_FILES["channel"]), mmap_mode="r").shape)
+            else:
+                with h5py.File(self._channelfile(rx), "r") as h5_channel:
+                    shapes.append(h5_channel[H5_CDATA].shape)
+        lengths = [shape[0] for shape in shapes]
+        if len(set(shape[1:] for shape in shapes)) > 1:
+            raise ValueError(f"Receivers of { scenario } have different numbers of subcarriers: { shapes }.")
+        if len(set(lengths)) > 1 and not truncate:
+            raise ValueError(f"Receivers of { scenario } are not aligned, lengths: { dict(zip(self.rxs, lengths)) }.")
+        self.length = min(lengths)
+
+        if parallel is None:
+            parallel = all(os.path.isdir(self._npydir(rx)) for rx in self.rxs)
+        self.parallel = parallel
+
+        self._datasets = None
+        self._pool = None
+        self._pid = None
+
+        return
+
+    def _channelfile(self, rx: str) -> str:
+        return os.path.join(self.data_dir, f"{self.scenario}_{rx}_channel.h5")
+
+    def _npydir(self, rx: str) -> str:
+        return os.path.join(self.data_dir, f"{self.scenario}_{rx}_npy")
+
+    def _dataset(self, rx: str) -> UAVDataset:
+        if os.path.isdir(self._npydir(rx)):
+            return UAVDataset(self._npydir(rx))
+        return UAVDataset(
+            self._channelfile(rx),
+            os.path.join(self.data_dir, f"{self.scenario}_{rx}_target.h5") if self.return_uavpos else None,
+            lazy=True,
+        )
+
+    def _open(self) -> list:
+        if self._pid != os.getpid():
+            # HDF5 handles and threads inherited from a forked parent must not be used
+            self._datasets = [self._dataset(rx) for rx in self.rxs]
+            if self.return_uavpos and self._datasets[0].uav is None:
+                raise ValueError(f"UAV Positions of { self.scenario }_{ self.rxs[0] } not found!")
+            self._pool = ThreadPoolExecutor(len(self.rxs)) if self.parallel else None
+            self._pid = os.getpid()
+        return self._datasets
+
+    def __getitem__(self, idx: int) -> [torch.Tensor, torch.Tensor, torch.Tensor]:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Index { idx } out of range for { len(self) } windows.")
+        datasets = self._open()
+        center = idx + self.t_window // 2
+        channel = np.empty((len(datasets),) + (self.t_window,) + datasets[0].channel.shape[1:], dtype=np.complex64)
+
+        def read(i: int) -> None:
+            channel[i] = datasets[i].channel[idx: idx + self.t_window]
+
+        if self._pool is not None:
+            list(self._pool.map(read, range(len(datasets))))
+        else:
+            for i in range(len(datasets)):
+                read(i)
+
+        sample = (
+            torch.from_numpy(channel),
+            torch.from_numpy(np.stack([d.groundtruth[center] for d in datasets])),
+            torch.from_numpy(np.stack([d.rx[center] for d in datasets])),
+        )
+        if self.return_uavpos:
+            sample += (torch.from_numpy(np.array(datasets[0].uav[center])),)
+        return sample
+
+    def __len__(self) -> int:
+        return max(self.length - self.t_window + 1, 0)
+
+    def __getstate__(self) -> dict:
+        # every worker opens its own handles and threads
+        state = self.__dict__.copy()
+        state.update(_datasets=None, _pool=None, _pid=None)
+        return state
+
+
+
+class FeatureDataset(Dataset):
+    def __init__(self, store: "FeatureStore", recordings: list = None, build: bool = True):
+        """Torch Dataset over the precomputed delay-Doppler maps of a `FeatureStore`
+
+        Index `i` of a recording is the map of the window starting at snapshot `i*engine.hop`, paired with the
+        groundtruth at `start + engine.window // 2`. These are the maps of `TorchDataset(t_window=engine.span)` followed
+        by `DelayDopplerCollate` with the same parameters, at the indices on the hop grid (the clutter filter reads
+        `engine.window + 1` snapshots per map). The entries are opened lazily by each DataLoader worker.
+
+        Args:
+            store (FeatureStore): The store
+            recordings (list, optional): The recording names. Defaults to None (all local recordings of the store).
+            build (bool, optional): Whether to build missing and stale entries first. Defaults to True.
+
+        """
+        self.store = store
+        self.recordings = store.local_recordings() if recordings is None else list(recordings)
+        if build:
+            store.build(self.recordings)
+
+        self.entries = [store.open(r) for r in self.recordings]
+        self.offsets = np.concatenate(([0], np.cumsum([len(e) for e in self.entries])))
+        for entry in self.entries:
+            entry.close()
+
+        return
+
+    def __getitem__(self, idx: int) -> [torch.Tensor, torch.Tensor]:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Index { idx } out of range for { len(self) } maps.")
+        recording = int(np.searchsorted(self.offsets, idx, side="right")) - 1
+        entry = self.entries[recording]
+        entry.open()
+        idx = int(idx - self.offsets[recording])
+        return (
+            torch.from_numpy(entry.maps[idx]),
+            torch.from_numpy(entry.groundtruth[idx]),
+        )
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
 if __name__ == "__main__":
+    # only needed by the examples
+    from featurestore import FeatureStore
+    from delaydoppler import DelayDopplerEngine
+    from normalization import Normalize, corpus_statistics, save_statistics
+
     channel_file = "1to2_H15_V11_VGH0_channel.h5"
     
     # Example 1: Dataloader with complex baseband and delay-doppler groundtruth
@@ -134,4 +573,98 @@ if __name__ == "__main__":
             Data shape: {tuple(X.shape)} (bs x t_bins x f_bins)
             Delay-Doppler-Groundtruth shape: {tuple(Y.shape)} (bs x 2)
             UAV-Position shape: {tuple(Z.shape)} (bs x 3)
-    """)
\ No newline at end of file
+    """)
+    
+    # Example 3: Lazy dataset, only the slow-time rows of each window are read from the file
+    with UAVDataset(channel_file, target_file, lazy=True) as dataset:
+        dataloader = DataLoader(TorchDataset(dataset, return_uavpos=True), batch_size=16, shuffle=True)
+        X, Y, Z = next(iter(dataloader))
+    
+    print(f"""
+            ---- Lazy Dataloader with complex baseband, delay-doppler groundtruth, and UAV positions ----
+            Number of samples in Dataloader: {len(dataloader)}
+            Data shape: {tuple(X.shape)} (bs x t_bins x f_bins)
+    """)
+    
+    # Example 4: Batched fetching, the windows of a batch are read with few contiguous reads into one batch tensor
+    dataset = TorchDataset(UAVDataset(channel_file, lazy=True), batched=True)
+    dataloader = DataLoader(
+        dataset,
+        batch_size=16,
+        sampler=ClusteredRandomSampler(dataset, cluster_size=64),
+        collate_fn=collate_batch,
+        pin_memory=torch.cuda.is_available(),
+    )
+    X, Y = next(iter(dataloader))
+    
+    print(f"""
+            ---- Batched Dataloader with clustered sampling ----
+            Number of samples in Dataloader: {len(dataloader)}
+            Data shape: {tuple(X.shape)} (bs x t_bins x f_bins)
+    """)
+    
+    # Example 5: Delay-Doppler maps in dB, computed for the whole batch in the collate function
+    dataloader = DataLoader(
+        TorchDataset(UAVDataset(channel_file, lazy=True)),
+        batch_size=16,
+        shuffle=True,
+        collate_fn=DelayDopplerCollate(filter_clutter=True, upsample=2, output="db"),
+    )
+    X, Y = next(iter(dataloader))
+    
+    print(f"""
+            ---- Dataloader with delay-doppler maps ----
+            Number of samples in Dataloader: {len(dataloader)}
+            Data shape: {tuple(X.shape)} (bs x doppler_bins x delay_bins)
+    """)
+    
+    # Example 6: Precomputed delay-Doppler maps, built once and rebuilt when the parameters or files change
+    engine = DelayDopplerEngine(100, filter_clutter=True, upsample=2, delay_bins=160, zoom=True)
+    dataset = FeatureDataset(FeatureStore("features", os.getcwd(), engine, output="db"), [channel_file.split("_channel.h5")[0]])
+    dataloader = DataLoader(dataset, batch_size=16, shuffle=True)
+    X, Y = next(iter(dataloader))
+    
+    print(f"""
+            ---- Dataloader with precomputed delay-doppler maps ----
+            Number of samples in Dataloader: {len(dataloader)}
+            Data shape: {tuple(X.shape)} (bs x doppler_bins x delay_bins)
+    """)
+    
+    # Example 7: All recordings listed in `scenarios.checksum`, each worker opens the files it needs
+    dataset = CorpusDataset(os.getcwd())
+    dataloader = DataLoader(dataset, batch_size=16, shuffle=True, num_workers=4)
+    X, Y = next(iter(dataloader))
+    
+    print(dataset)
+    print(f"""
+            ---- Dataloader over the whole corpus ----
+            Number of samples in Dataloader: {len(dataloader)}
+            Data shape: {tuple(X.shape)} (bs x t_bins x f_bins)
+    """)
+    
+    # Example 8: Synchronized windows of all three receivers of a scenario
+    dataset = MultiReceiverDataset(os.getcwd(), "1to2_H15_V11", return_uavpos=True)
+    dataloader = DataLoader(dataset, batch_size=16, shuffle=True)
+    X, Y, R, Z = next(iter(dataloader))
+    
+    print(f"""
+            ---- Dataloader with all receivers of a scenario ----
+            Number of samples in Dataloader: {len(dataloader)}
+            Data shape: {tuple(X.shape)} (bs x rx x t_bins x f_bins)
+            Delay-Doppler-Groundtruth shape: {tuple(Y.shape)} (bs x rx x 2)
+            RX-Position shape: {tuple(R.shape)} (bs x rx x 3)
+            UAV-Position shape: {tuple(Z.shape)} (bs x 3)
+    """)
+    
+    # Example 9: Windows normalized per subcarrier with the statistics of the whole corpus, computed in one streaming pass
+    save_statistics(corpus_statistics([(channel_file, target_file)]), "statistics.npz")
+    dataset = TorchDataset(UAVDataset(channel_file, target_file), transform=Normalize.from_file("statistics.npz"))
+    dataloader = DataLoader(dataset, batch_size=16, shuffle=True)
+    X, Y = next(iter(dataloader))
+    
+    print(f"""
+            ---- Dataloader with normalized windows ----
+            Number of samples in Dataloader: {len(dataloader)}
+            Data shape: {tuple(X.shape)} (bs x t_bins x f_bins)
+            Mean power: {X.abs().pow(2).mean():.3f}
+    """)
@@ -1,4 +1,7 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field
+import operator
+import os
 import numpy as np
 import h5py
 
@@ -8,13 +11,219 @@ H5_TARGET_DOPPLER = "TargetParameters/Doppler/Data"
 H5_TXANTENNA = "AntennaPositions/PositionTx/Data"
 H5_RXANTENNA = "AntennaPositions/PositionRx/Data"
 H5_UAVPOSITIONS = "Positions/Data"
+H5_CHUNK_CACHE = 32 * 2**20
+"""The HDF5 chunk cache of lazily opened files in bytes, holds the chunks of consecutive windows of converted files"""
+SHARED_BLOCK_SIZE = 4096
+"""The number of snapshots copied at once into the shared memory of a `shared=True` dataset"""
+
+NPY_FILES = dict(
+    channel="channel.npy",
+    groundtruth="groundtruth.npy",
+    tx="tx.npy",
+    rx="rx.npy",
+    uav="uav.npy",
+)
+"""The file names of a scenario converted to a directory of `.npy` files (see `convert.py`)"""
+
+
+def _squeeze_tail(x: np.ndarray) -> np.ndarray:
+    # like `np.squeeze`, but never drops the slow-time axis
+    return x.reshape((x.shape[0],) + tuple(n for n in x.shape[1:] if n != 1))
+
+
+class LazyArray:
+    def __init__(self, datasets: list, dtype: np.dtype = None, squeeze: bool = True):
+        """Array-like proxy for one or more HDF5 datasets sharing the slow-time axis
+
+        Indexing along the first (slow-time) axis only reads the requested rows from the file.
+        The rows are then viewed as `dtype` and squeezed, exactly like the eager `UAVDataset` does for the full array.
+        If several datasets are given, they are concatenated along the second axis.
+
+        Args:
+            datasets (list): The `h5py.Dataset`s to read from
+            dtype (np.dtype, optional): The dtype to view the raw rows as. Defaults to None (no view).
+            squeeze (bool, optional): Whether to drop singleton axes (except the slow-time axis). Defaults to True.
+
+        """
+        self.datasets = datasets
+        self.dtype_view = dtype
+        self.squeeze = squeeze
+        self._len = datasets[0].shape[0]
+
+        sample = self._read(slice(0, 1))
+        self.shape = (self._len,) + sample.shape[1:]
+        self.dtype = sample.dtype
+
+        return
+
+    def _read(self, rows) -> np.ndarray:
+        parts = []
+        for dataset in self.datasets:
+            x = np.asarray(dataset[rows])
+            if self.dtype_view is not None:
+                x = x.view(self.dtype_view)
+            if self.squeeze:
+                x = _squeeze_tail(x)
+            parts.append(x)
+
+        return parts[0] if len(parts) == 1 else np.concatenate(parts, axis=1)
+
+    def _read_indices(self, idx: np.ndarray) -> np.ndarray:
+        # h5py only supports increasing, unique indices
+        idx = np.where(idx < 0, idx + self._len, idx)
+        if idx.size and (idx.min() < 0 or idx.max() >= self._len):
+            raise IndexError(f"Index out of range for axis 0 with size { self._len }.")
+        uniq, inverse = np.unique(idx, return_inverse=True)
+        if uniq.size == 0:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)
+        if uniq.size == uniq[-1] - uniq[0] + 1:
+            x = self._read(slice(int(uniq[0]), int(uniq[-1]) + 1))
+        else:
+            x = self._read(uniq)
+
+        return x[inverse.reshape(-1)]
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        rows, rest = key[0], key[1:]
+
+        if isinstance(rows, (int, np.integer)):
+            idx = operator.index(rows)
+            if idx < 0:
+                idx += self._len
+            if not 0 <= idx < self._len:
+                raise IndexError(f"Index { rows } out of range for axis 0 with size { self._len }.")
+            return self._read(slice(idx, idx + 1))[0][rest]
+
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(self._len)
+            if step == 1:
+                x = self._read(slice(start, max(start, stop)))
+            elif step > 0:
+                x = self._read(slice(start, max(start, stop)))[::step]
+            else:
+                x = self._read_indices(np.arange(start, stop, step))
+        else:
+            rows = np.asarray(rows)
+            if rows.dtype == bool:
+                rows = np.flatnonzero(rows)
+            x = self._read_indices(rows.astype(np.int64))
+
+        return x[(slice(None),) + rest]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        x = self[:]
+        return x if dtype is None else x.astype(dtype)
+
+    def __len__(self) -> int:
+        return self._len
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def __repr__(self) -> str:
+        return f"LazyArray(shape={ self.shape }, dtype={ self.dtype })"
+
+
+class CompactArray:
+    PRECISIONS = ("float16", "int16", "int8")
+    """The supported storage types of the real and imaginary parts"""
+
+    def __init__(self, x, precision: str = "int16", block_size: int = 4096):
+        """Reduced-precision copy of a complex channel, dequantized to complex64 on slicing
+
+        The real and imaginary parts of each snapshot are divided by their largest magnitude (one float32 scale per
+        snapshot) and stored as `float16`, or rounded to `int16` / `int8`. This needs 1/2 (or 1/4 for `int8`) of
+        the memory of complex64. Each part of a snapshot is off by at most `eps * scale` after dequantization.
+
+        Args:
+            x (np.ndarray): The channel with shape (t_bins, f_bins), may be a `LazyArray`, read in blocks
+            precision (str, optional): The storage type, `float16`, `int16` or `int8`. Defaults to "int16".
+            block_size (int, optional): The number of snapshots quantized at once, bounds the memory of the conversion. Defaults to 4096.
+
+        """
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Unknown precision { precision }, expected one of { self.PRECISIONS }.")
+        self.precision = precision
+        self.shape = tuple(x.shape)
+        self.dtype = np.dtype(np.complex64)
+        self.data = np.empty(self.shape + (2,), dtype=precision)
+        self.scale = np.empty(self.shape[0], dtype=np.float32)
+
+        if precision == "float16":
+            # relative rounding error, values below the normal range of float16 have an even smaller absolute error
+            self._max = 1
+            self.eps = 2.0**-11
+        else:
+            self._max = np.iinfo(precision).max
+            self.eps = 0.5 / self._max
+        # the scaling in float32 adds a few rounding errors of float32
+        self.eps += 2.0**-21
+
+        for start in range(0, self.shape[0], block_size):
+            block = np.asarray(x[start:start + block_size], dtype=np.complex64)
+            parts = block.view(np.float32).reshape(block.shape + (2,))
+            peak = np.abs(parts).max(axis=tuple(range(1, parts.ndim)))
+            peak[peak == 0] = 1
+            normalized = parts / peak.reshape((-1,) + (1,) * (parts.ndim - 1)) * self._max
+            if precision != "float16":
+                normalized = np.rint(normalized)
+            self.data[start:start + len(block)] = normalized
+            self.scale[start:start + len(block)] = peak
+
+        return
+
+    def _dequantize(self, data: np.ndarray, scale: np.ndarray) -> np.ndarray:
+        scale = np.asarray(scale, dtype=np.float32) / self._max
+        x = data.astype(np.float32) * scale.reshape(scale.shape + (1,) * (data.ndim - scale.ndim))
+        return x.view(np.complex64)[..., 0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        rows, rest = key[0], key[1:]
+        x = self._dequantize(self.data[rows], self.scale[rows])
+        if isinstance(rows, (int, np.integer)):
+            return x[rest]
+        return x[(slice(None),) + rest]
+
+    def error_bound(self, rows=slice(None)) -> np.ndarray:
+        """Returns the maximum absolute error of the real and imaginary parts of each snapshot"""
+        return self.eps * self.scale[rows]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        x = self[:]
+        return x if dtype is None else x.astype(dtype)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + self.scale.nbytes
+
+    def __repr__(self) -> str:
+        return f"CompactArray(shape={ self.shape }, precision={ self.precision }, nbytes={ self.nbytes })"
+
 
 @dataclass
 class UAVDataset:
     channelfile: str
-    """The path to the channel file"""
+    """The path to the channel file, or to a directory of `.npy` files created by `convert.py`"""
     targetfile: str = None
     """The path to the target file"""
+    lazy: bool = False
+    """Whether to keep the files open and read only the requested slow-time rows on slicing"""
+    shared: bool = False
+    """Whether to load the channel once into shared memory, which all other processes attach to (see `sharedstore.py`)"""
+    precision: str = None
+    """Whether to keep the channel in a compact `float16`, `int16` or `int8` representation (see `CompactArray`)"""
     channel: np.ndarray = field(init=False)
     """Property to store the channel data as a numpy array"""
     groundtruth: np.ndarray = field(init=False)
@@ -23,28 +232,202 @@ class UAVDataset:
     """Property to store the transmitter antenna positions as a numpy array"""
     rx: np.ndarray = field(init=False)
     """Property to store the receiver antenna positions as a numpy array"""
-    uav: np.ndarray = field(init=False)
+    uav: np.ndarray = field(init=False, default=None)
     """Property to store the UAV positions as a numpy array"""
+    _h5_channel: h5py.File = field(init=False, default=None, repr=False)
+    _h5_target: h5py.File = field(init=False, default=None, repr=False)
+    _shared: "SharedArray" = field(init=False, default=None, repr=False)
 
     def __post_init__(self) -> None:
+        if os.path.isdir(self.channelfile):
+            self._load_npy()
+            return
+        if self.lazy:
+            if self.shared or self.precision is not None:
+                raise ValueError("A lazy dataset cannot be shared or compact.")
+            self.open()
+            return
+
         # load channel, positions
-        h5_channel = h5py.File(self.channelfile, "r")
-        self.channel = np.array(h5_channel[H5_CDATA]).view(
-            np.complex64).squeeze()
-        self.groundtruth = np.concatenate(
-            (
-                np.array(h5_channel[H5_TARGET_DELAY]),
-                np.array(h5_channel[H5_TARGET_DOPPLER]),
-            ),
-            axis=1,
+        with h5py.File(self.channelfile, "r") as h5_channel:
+            if self.shared:
+                if self.precision is not None:
+                    raise ValueError("A shared dataset cannot be compact.")
+                self._attach_shared(h5_channel)
+            elif self.precision is not None:
+                # quantized block by block, the full complex64 channel is never loaded
+                self.channel = CompactArray(LazyArray([h5_channel[H5_CDATA]], np.complex64), self.precision)
+            else:
+                self.channel = np.array(h5_channel[H5_CDATA]).view(
+                    np.complex64).squeeze()
+            self.groundtruth = np.concatenate(
+                (
+                    np.array(h5_channel[H5_TARGET_DELAY]),
+                    np.array(h5_channel[H5_TARGET_DOPPLER]),
+                ),
+                axis=1,
+            )
+            self.tx = np.array(h5_channel[H5_TXANTENNA]).view(np.float64).squeeze()
+            self.rx = np.array(h5_channel[H5_RXANTENNA]).view(np.float64).squeeze()
+
+        if self.targetfile is not None:
+            with h5py.File(self.targetfile, "r") as h5_target:
+                self.uav = np.array(h5_target[H5_UAVPOSITIONS]).view(
+                    np.float64).squeeze()
+
+        return
+
+    def _load_npy(self) -> None:
+        # memory-mapped, only the sliced rows are read from disk
+        for name, filename in NPY_FILES.items():
+            path = os.path.join(self.channelfile, filename)
+            if os.path.exists(path):
+                setattr(self, name, np.load(path, mmap_mode="r"))
+
+        return
+
+    def _attach_shared(self, h5_channel: h5py.File) -> None:
+        # only the first process reads the channel, all others attach to its shared memory
+        from sharedstore import SharedArray, shared_name
+
+        proxy = LazyArray([h5_channel[H5_CDATA]], np.complex64)
+
+        def load(out: np.ndarray) -> None:
+            # copied in row blocks, the full channel is never held in private memory
+            for start in range(0, len(proxy), SHARED_BLOCK_SIZE):
+                out[start:start + SHARED_BLOCK_SIZE] = proxy[start:start + SHARED_BLOCK_SIZE]
+
+        self._shared = SharedArray(shared_name(self.channelfile), proxy.shape, proxy.dtype, load)
+        self.channel = self._shared.array
+
+        return
+
+    def open(self) -> None:
+        """Opens the files and (re-)creates the lazy array proxies. Only used with `lazy=True`."""
+        if self._h5_channel is not None or os.path.isdir(self.channelfile):
+            return
+
+        self._h5_channel = h5py.File(self.channelfile, "r", rdcc_nbytes=H5_CHUNK_CACHE)
+        self.channel = LazyArray([self._h5_channel[H5_CDATA]], np.complex64)
+        self.groundtruth = LazyArray(
+            [self._h5_channel[H5_TARGET_DELAY], self._h5_channel[H5_TARGET_DOPPLER]],
+            squeeze=False,
         )
-        self.tx = np.array(h5_channel[H5_TXANTENNA]).view(np.float64).squeeze()
-        self.rx = np.array(h5_channel[H5_RXANTENNA]).view(np.float64).squeeze()
+        self.tx = LazyArray([self._h5_channel[H5_TXANTENNA]], np.float64)
+        self.rx = LazyArray([self._h5_channel[H5_RXANTENNA]], np.float64)
 
         if self.targetfile is not None:
-            h5_target = h5py.File(self.targetfile, "r")
-            self.uav = np.array(h5_target[H5_UAVPOSITIONS]).view(
-                np.float64).squeeze()
+            self._h5_target = h5py.File(self.targetfile, "r")
+            self.uav = LazyArray([self._h5_target[H5_UAVPOSITIONS]], np.float64)
+
+        return
+
+    def close(self) -> None:
+        """Closes the files opened with `lazy=True` and detaches from the shared channel.
+        The proxies become unusable until `open` is called again."""
+        for h5_file in (self._h5_channel, self._h5_target):
+            if h5_file is not None:
+                h5_file.close()
+        self._h5_channel = None
+        self._h5_target = None
+        if self._shared is not None:
+            self.channel = None
+            self._shared.close()
+            self._shared = None
+
+        return
+
+    def __enter__(self) -> "UAVDataset":
+        if self.lazy:
+            self.open()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __getstate__(self) -> dict:
+        # open HDF5 handles cannot be pickled and memory maps would be copied, both are reopened after unpickling
+        state = self.__dict__.copy()
+        if self.lazy or os.path.isdir(self.channelfile):
+            for key in ("channel", "groundtruth", "tx", "rx", "uav", "_h5_channel", "_h5_target"):
+                state.pop(key, None)
+        elif self._shared is not None:
+            # the shared channel is attached by name instead of copied
+            state.pop("channel")
+            state["_shared"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if self.lazy or os.path.isdir(self.channelfile):
+            self._h5_channel = None
+            self._h5_target = None
+            self.uav = None
+            if os.path.isdir(self.channelfile):
+                self._load_npy()
+            else:
+                self.open()
+        elif self.shared and "channel" not in state:
+            with h5py.File(self.channelfile, "r") as h5_channel:
+                self._attach_shared(h5_channel)
+
+    def _read_block(self, start: int, stop: int, return_uavpos: bool) -> tuple:
+        block = (np.asarray(self.channel[start:stop]), np.asarray(self.groundtruth[start:stop]))
+        if return_uavpos:
+            block += (np.asarray(self.uav[start:stop]),)
+        return block
+
+    def iter_blocks(self, block_size: int = 4096, t_window: int = 1, start: int = 0, stop: int = None, return_uavpos: bool = False, prefetch: bool = True):
+        """Yields consecutive slow-time blocks of the channel and the groundtruth in constant memory
+
+        Every block repeats the last `t_window - 1` snapshots of the previous block, so every window of `t_window`
+        snapshots lies completely inside exactly one block: the windows starting at `offset` to
+        `offset + len(channel) - t_window`. With `prefetch`, the next block is read on a background thread while the
+        current one is processed, i.e. at most two blocks are in memory.
+
+        Args:
+            block_size (int, optional): The number of new snapshots per block. Defaults to 4096.
+            t_window (int, optional): The length of the windows of the consumer. Defaults to 1 (no overlap).
+            start (int, optional): The first snapshot. Defaults to 0.
+            stop (int, optional): The snapshot to stop at. Defaults to None (end of the recording).
+            return_uavpos (bool, optional): Whether to yield the RTK UAV positions as well. Defaults to False.
+            prefetch (bool, optional): Whether to read the next block on a background thread. Defaults to True.
+
+        Yields:
+            tuple: The index `offset` of the first snapshot of the block, the channel with shape (n, f_bins),
+            the groundtruth with shape (n, 2), and the UAV positions with shape (n, 3) if `return_uavpos`
+        """
+        if return_uavpos and self.uav is None:
+            raise ValueError("UAV Positions not loaded!")
+        if block_size < 1 or t_window < 1:
+            raise ValueError("The block size and the window length must be positive.")
+        stop = len(self) if stop is None else min(stop, len(self))
+        reads = [(s, min(s + block_size, stop)) for s in range(start, stop, block_size)]
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            def fetch(idx: int) -> Future:
+                if idx >= len(reads):
+                    return None
+                if prefetch:
+                    return pool.submit(self._read_block, *reads[idx], return_uavpos)
+                future = Future()
+                future.set_result(self._read_block(*reads[idx], return_uavpos))
+                return future
+
+            pending = fetch(0)
+            overlap = None
+            for idx, (read_start, _) in enumerate(reads):
+                block = pending.result()
+                # the next read overlaps the processing of this block
+                pending = fetch(idx + 1)
+                if overlap is not None:
+                    block = tuple(np.concatenate((old, new)) for old, new in zip(overlap, block))
+                offset = read_start - (0 if overlap is None else len(overlap[0]))
+                # a block too short for a single window is carried over completely
+                keep = min(t_window - 1, len(block[0]))
+                overlap = tuple(x[len(x) - keep:] for x in block)
+                if len(block[0]) >= t_window:
+                    yield (offset,) + block
 
         return
 
@@ -60,6 +443,6 @@ class UAVDataset:
            \t - Channel: {self.channelfile}
            \t - Target: {self.targetfile}
            """
-           
+
     def __len__(self) -> int:
-        return self.channel.shape[0]
\ No newline at end of file
+        return self.channel.shape[0]
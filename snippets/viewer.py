@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+import matplotlib.pyplot as plt
+from matplotlib.widgets import Slider
+from mapcache import MapCache
+
+__author__ = "steffen.schieler@tu-ilmenau.de, FG EMS"
+__credits__ = "Zhixiang Zhao, Carsten Smeenk"
+__all__ = ["MapPrefetcher", "SliderPlayer"]
+
+logger = logging.getLogger(__name__)
+
+
+class MapPrefetcher:
+    def __init__(self, cache: MapCache, compute):
+        """Computes delay-Doppler maps on a background thread and stores them in a `MapCache`
+
+        Only the most recent request is worked on: keys of older requests that were not computed yet are dropped.
+        A key whose computation fails is logged and not requested again, the thread continues with the next key.
+
+        Args:
+            cache (MapCache): The cache to fill
+            compute (callable): Function that computes the map for a cache key
+
+        """
+        self.cache = cache
+        self.compute = compute
+        self._pending = []
+        self.failed = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        return
+
+    def request(self, keys: list) -> None:
+        """Replaces the pending keys, keys that are already cached are skipped"""
+        with self._cond:
+            self._pending = [key for key in keys if key not in self.cache and key not in self.failed]
+            self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                key = self._pending.pop(0)
+            if key in self.cache:
+                continue
+            try:
+                self.cache.put(key, self.compute(key))
+            except Exception:
+                logger.exception(f"Failed to compute the map { key }.")
+                with self._cond:
+                    self.failed.add(key)
+
+
+class SliderPlayer:
+    def __init__(self, fig: plt.Figure, slider: Slider, keys, prefetcher: MapPrefetcher, fps: float = 10, ahead: int = 4):
+        """Prefetches the neighbouring slider positions and plays back the slider at a target frame rate
+
+        Playback is started and paused with the space key. During playback, the slider position follows the wall clock.
+        Positions whose maps are not cached yet when their frame is due are dropped instead of computed on the UI thread.
+
+        Args:
+            fig (plt.Figure): The figure with the slider
+            slider (Slider): The slider to drive, its `on_changed` callback draws the maps
+            keys (callable): Function that returns the cache keys of all maps shown for a slider value
+            prefetcher (MapPrefetcher): The prefetcher computing the maps
+            fps (float, optional): The target frame rate of the playback. Defaults to 10.
+            ahead (int, optional): The number of slider positions to prefetch. Defaults to 4.
+
+        """
+        self.fig = fig
+        self.slider = slider
+        self.keys = keys
+        self.prefetcher = prefetcher
+        self.fps = fps
+        self.ahead = ahead
+        self.dropped = 0
+        self.shown = 0
+        self._play_start = None
+
+        fig.canvas.mpl_connect("key_press_event", self._on_key)
+        self.timer = fig.canvas.new_timer(interval=max(int(1000 / fps), 1))
+        self.timer.add_callback(self._tick)
+
+        return
+
+    def _values(self, value: int) -> list:
+        valmax = int(self.slider.valmax)
+        neighbours = [value + step for step in range(1, self.ahead + 1)] + [value - 1]
+        return [v for v in neighbours if self.slider.valmin <= v <= valmax]
+
+    def prefetch(self, value: int) -> None:
+        """Requests the maps of the slider positions around `value`"""
+        keys = []
+        for v in self._values(int(value)):
+            keys.extend(self.keys(v))
+        self.prefetcher.request(keys)
+
+    def _on_key(self, event) -> None:
+        if event.key == " ":
+            self.toggle()
+
+    def toggle(self) -> None:
+        """Starts or pauses the playback"""
+        if self._play_start is None:
+            self._play_start = (time.monotonic(), int(self.slider.val))
+            self.timer.start()
+        else:
+            self._play_start = None
+            self.timer.stop()
+
+    def _tick(self) -> None:
+        if self._play_start is None:
+            return
+        start_time, start_value = self._play_start
+        value = start_value + int((time.monotonic() - start_time) * self.fps)
+        if value > self.slider.valmax:
+            self.toggle()
+            return
+        if value == int(self.slider.val):
+            return
+
+        if all(key in self.prefetcher.cache for key in self.keys(value)):
+            self.slider.set_val(value)
+            self.shown += 1
+        else:
+            self.dropped += 1
+            self.prefetcher.request([key for v in [value] + self._values(value) for key in self.keys(v)])
+
+    def __str__(self) -> str:
+        return f"""
+           ---- Playback Summary ----
+           Shown Frames: \t{self.shown}
+           Dropped Frames: \t{self.dropped}
+           """